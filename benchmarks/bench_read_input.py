@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Throughput of the line-by-line ``read_input`` and the bulk ``fast_read_input`` parsers, in MB/s.
+
+Usage::
+
+    python benchmarks/bench_read_input.py [FILE ...]
+
+By default the FeO example inputs are read, plus a synthetic input of 5 volumes, 8000 q-points and 15 modes
+(about 7 MB, the size of a typical production file).
+"""
+import os
+import sys
+import tempfile
+import timeit
+
+import numpy as np
+
+from pgm.reader.read_input import read_input, fast_read_input
+
+
+def write_synthetic_input(filename, nv=5, nq=8000, nm=15, seed=0):
+    rng = np.random.default_rng(seed)
+    lines = ["Number of volumes(nv), q-vectors(nq), normal mode(np), formula units(nm)", f"{nv} {nq} {nm} 4"]
+    for i in range(nv):
+        lines.append(f"P = {100 + 10 * i:.4f}\tV = {300 - 5 * i:.4f}\tE = {-1000 + 0.1 * i:.14f}\tS_el = 0.0")
+        qs, freqs = rng.uniform(-0.5, 0.5, (nq, 3)), rng.uniform(0, 1000, (nq, nm))
+        for q, freq in zip(qs, freqs):
+            lines.append("%.7f %.7f %.7f" % tuple(q))
+            lines.extend("%.4f" % f for f in freq)
+    lines.append("weight")
+    lines.extend("   %.7f   %.7f   %.7f   %.7f" % (0.1, 0.2, 0.3, 1 / nq) for _ in range(nq))
+    with open(filename, 'w') as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def throughput(parser, filename, number=3):
+    seconds = min(timeit.repeat(lambda: parser(filename), number=1, repeat=number))
+    return os.path.getsize(filename) / 1e6 / seconds
+
+
+def main(filenames):
+    print(f"{'file':40s} {'MB':>8s} {'read_input':>12s} {'fast_read_input':>16s} {'speedup':>8s}")
+    for filename in filenames:
+        expected, result = read_input(filename), fast_read_input(filename)
+        assert all(np.array_equal(a, b) for a, b in zip(expected, result)), filename
+        slow, fast = throughput(read_input, filename), throughput(fast_read_input, filename)
+        print(f"{filename:40s} {os.path.getsize(filename) / 1e6:8.2f} {slow:9.1f} MB/s {fast:13.1f} MB/s "
+              f"{fast / slow:7.1f}x")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        main(sys.argv[1:])
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            synthetic = os.path.join(directory, 'synthetic.txt')
+            write_synthetic_input(synthetic)
+            main(sorted(os.path.join('examples', 'feo', f) for f in os.listdir(os.path.join('examples', 'feo'))
+                        if f.endswith('K.txt')) + [synthetic])
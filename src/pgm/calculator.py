@@ -7,171 +7,629 @@ Core module for energy calculation in pgm
 """
 
 from pgm.reader.read_input import Input
+from pgm.reader.cache import InputCache
 import numpy as np
 from scipy.constants import physical_constants as pc
-from scipy.integrate import cumtrapz
 from .settings import Settings
-from .interpolate import Interpolation, FrequencyInterpolation, ElectronicEntropyInterpolation
-from numba import jit
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import ExitStack
+from .interpolate import Interpolation, FrequencyInterpolation, ElectronicEntropyInterpolation, batched_polyfit, \
+    batched_polyval, batched_polyder, iter_polyval
+from .util.shared_array import SharedArray, read_shared_array
+from .util.grid_interpolation import equidistributed_grid, FinerGrid
+from .util.stage_graph import StageGraph
+import numba
+from numba import jit, prange
 
 HBAR = 100 / pc['electron volt-inverse meter relationship'][0] / pc['Rydberg constant times hc in eV'][0]
 K = pc['Boltzmann constant in eV/K'][0] / pc['Rydberg constant times hc in eV'][0]
+# The number of temperatures each quadrature interpolates S(T) through on every interval
+INTEGRATION_POINTS = {'trapezoid': 2, 'simpson': 3, 'cubic': 4}
 
 
 class FreeEnergyCalculation:
     """
     Calculate free energy using pgm
+
+    The calculation is a graph of stages (parse -> fit -> entropy -> integrate -> volume fit).
+    Each stage is computed once and memoized. The results wanted are declared by ``evaluate``,
+    then every intermediate is released as soon as no later stage needs it.
     """
 
     def __init__(self, setting: Settings):
         self.NV = setting.NV
         self.NT = setting.NT
+        # The volume expansion ratio, or 'auto' for the smallest one covering the pressures, known once evaluated
         self.ratio = setting.ratio
         self.folder = setting.folder
         self.discrete_temperatures = setting.temperature
-        self.continuous_temperature = setting.continuous_temperature
+        # 'uniform', or 'adaptive' to place the temperatures where the heat capacity is curved, known once evaluated
+        self.temperature_grid = setting.temperature_grid
+        if self.temperature_grid not in ('uniform', 'adaptive'):
+            raise ValueError("The temperature grid should be either 'uniform' or 'adaptive'!")
+        # The quadrature turning S(T) into F(T), one of INTEGRATION_POINTS
+        self.integration = setting.integration
+        if self.integration not in INTEGRATION_POINTS:
+            raise ValueError("The integration should be one of {0}!".format(', '.join(INTEGRATION_POINTS)))
+        # 'analytic' to also provide S(T, V) and C_V(T, V) from the frequencies, for 'entropy' and 'heat_capacity'
+        self.temperature_derivatives = setting.temperature_derivatives
+        if self.temperature_derivatives not in ('numerical', 'analytic'):
+            raise ValueError("The temperature derivatives should be either 'numerical' or 'analytic'!")
+        # 'analytic' to take P, B_T and B_T' from the 'strain_polynomial' of F(T, V) rather than from the volume grid
+        self.volume_derivatives = setting.volume_derivatives
+        if self.volume_derivatives not in ('numerical', 'analytic'):
+            raise ValueError("The volume derivatives should be either 'numerical' or 'analytic'!")
+        self._continuous_temperature = setting.continuous_temperature if self.temperature_grid == 'uniform' else None
         self.pressures = setting.desired_pressure
-        self.input = Input(self.folder, self.discrete_temperatures)
+        # Temperatures evaluated at a time, all of them at once if not set
+        self.chunk_size = setting.chunk_size or self.NT
+        # Processes for the volume-independent stages, serial if not larger than 1
+        self.workers = setting.workers or 1
+        # Precision of the frequencies and the entropy of each mode, sums are always accumulated in float64
+        self.precision = np.dtype(setting.precision)
+        if self.precision not in (np.float32, np.float64):
+            raise ValueError("The precision should be either 'float32' or 'float64'!")
+        # Binary cache of the parsed input files
+        self.cache = InputCache(setting.cache_directory) if setting.cache else None
+        # A .npy file the frequencies are memory-mapped to, read one volume at a time, or None to keep them in memory
+        self.frequency_store = setting.frequency_store
+        self.stages = self.build_stages()
+
+    def build_stages(self):
+        """
+        Build the stage graph of the calculation, stages are added in evaluation order
+        """
+        stages = StageGraph()
+        stages.add('input', lambda: Input(self.folder, self.discrete_temperatures, dtype=self.precision,
+                                          workers=self.workers, cache=self.cache,
+                                          frequency_store=self.frequency_store))
+        # here of course ensure that all weights are the same
+        stages.add('q_weights', lambda inp: inp.weights[0], ('input',))
+        if self.temperature_grid == 'adaptive':
+            stages.add('temperatures', self._adaptive_temperatures, ('input', 'q_weights'))
+        else:
+            stages.add('temperatures', lambda: self._continuous_temperature)
+        by_volume = self.workers > 1 or self.frequency_store is not None
+        if by_volume:
+            # Fit, entropy and zero point energy of each volume block, in its own process if workers > 1
+            stages.add('volume_blocks', self._volume_blocks, ('input', 'q_weights', 'temperatures'))
+        else:
+            stages.add('frequency_fit', lambda inp: FrequencyInterpolation(inp).fit(), ('input',))
+        stages.add('electronic_entropy', lambda inp, ts: ElectronicEntropyInterpolation(inp).batched_polyfit(ts),
+                   ('input', 'temperatures'))
+        stages.add('static_energy', lambda inp: inp.static_energy, ('input',))
+        stages.add('raw_volumes', lambda inp: inp.volumes, ('input',))
+        analytic = self.temperature_derivatives == 'analytic'
+        if by_volume:
+            stages.add('vibrational_entropy', lambda blocks: blocks[0], ('volume_blocks',))
+            stages.add('zero_point_energy', lambda blocks: blocks[1], ('volume_blocks',))
+            if analytic:
+                stages.add('vibrational_heat_capacity', lambda blocks: blocks[2], ('volume_blocks',))
+        else:
+            stages.add('vibrational_entropy', self._vibrational_entropy, ('frequency_fit', 'q_weights', 'temperatures'))
+            stages.add('zero_point_energy', self._zero_point_energy, ('frequency_fit', 'q_weights', 'temperatures'))
+            if analytic:
+                stages.add('vibrational_heat_capacity', self._vibrational_heat_capacity,
+                           ('frequency_fit', 'q_weights', 'temperatures'))
+        if analytic:
+            stages.add('electronic_heat_capacity',
+                       lambda inp, ts: ElectronicEntropyInterpolation(inp).heat_capacity(ts), ('input', 'temperatures'))
+        stages.add('integrate', self._integrate_entropy, ('vibrational_entropy', 'electronic_entropy', 'temperatures'))
+        if 0 not in self.discrete_temperatures:
+            stages.add('raw_free_energy', self._raw_F_total, ('integrate', 'static_energy'))
+        else:
+            stages.add('raw_free_energy', self._raw_F_total, ('integrate', 'static_energy', 'zero_point_energy'))
+        if self.ratio == 'auto':
+            # Checked on the fit of the input volumes, before any work on the dense volume grid
+            stages.add('ratio', self._covering_ratio, ('raw_volumes', 'raw_free_energy'))
+        else:
+            stages.add('ratio', lambda: self.ratio)
+        stages.add('volume_grid', lambda raw_V, ratio: Interpolation(raw_V, num=self.NV, ratio=ratio),
+                   ('raw_volumes', 'ratio'))
+        stages.add('free_energy', self._interpolate_F_total, ('raw_free_energy', 'volume_grid'))
+        # F(T, V) as polynomials of the strain, for analytic volume derivatives
+        stages.add('strain_polynomial', lambda F_total, inter: inter.strain_polynomial(F_total),
+                   ('raw_free_energy', 'volume_grid'))
+        stages.add('volumes', lambda inter: inter.out_volumes, ('volume_grid',))
+        if analytic:
+            # S = -dF/dT exactly, since F is its integral, and C_V = T dS/dT from the fitted frequencies,
+            # projected onto the dense volumes like F
+            stages.add('entropy', lambda integrated, inter: inter.fitting(integrated[1]), ('integrate', 'volume_grid'))
+            stages.add('heat_capacity', lambda cv_vib, cv_el, inter: inter.fitting(cv_vib + cv_el),
+                       ('vibrational_heat_capacity', 'electronic_heat_capacity', 'volume_grid'))
+        return stages
+
+    def evaluate(self, *targets):
+        """
+        Compute the stages *targets* (e.g. 'free_energy', 'volumes'), each intermediate only once
+        and released once it is no longer needed
+        """
+        results = dict(self.stages.evaluate(*targets))
+        return tuple(results[target] for target in targets)
+
+    @property
+    def input(self):
+        return self.stages.get('input')
+
+    @property
+    def continuous_temperature(self):
+        """
+        The temperatures of the calculation. An adaptive grid is computed here if no evaluation has computed it yet.
+        """
+        if self._continuous_temperature is None:
+            self._continuous_temperature = self.stages.get('temperatures')
+        return self._continuous_temperature
 
     def interpolate_frequencies(self):
         """
         interpolate the frequencies
         """
-        freq = FrequencyInterpolation(self.input).numba_polyfit(self.continuous_temperature)
+        freq = FrequencyInterpolation(self.input).batched_polyfit(self.continuous_temperature)
         return freq
 
     def calculate_electronic_entropy(self):
         """
         interpolate the electronic_entropy
         """
-        s_el = ElectronicEntropyInterpolation(self.input).numba_polyfit(self.continuous_temperature)
-        return s_el
+        return self.stages.get('electronic_entropy')
 
     def calculate_vibrational_entropy(self):
         """
         calculate vibrational properties, i.e. vibrational entropy and free energy
-        depends on "interpolate_frequencies"
+        depends on "frequency_fit"
         """
-        number_of_raw_volume = len(self.input.volumes)
-        s_vib = np.empty((self.NT, number_of_raw_volume))
-        freq = self.interpolate_frequencies()
-        weight = self.input.weights[0]  # here of course ensure that all weights are the same
-        for i in range(len(self.continuous_temperature)):
-            s_vib[i] = entropy(self.continuous_temperature[i], freq[i], weight)
-        return s_vib
+        return self.stages.get('vibrational_entropy')
 
     def calculate_zero_point_energy(self):
         """
         Calculate zero point energy
-        depends on "interpolate_frequencies"
-        """
-        number_of_raw_volume = len(self.input.volumes)
-        f_zp = np.empty((self.NT, number_of_raw_volume))
-        freq = self.interpolate_frequencies()
-        weight = self.input.weights[0]  # here of course ensure that all weights are the same
-        fzp0 = zero_point_energy(freq[0], weight)
-        for i in range(len(self.continuous_temperature)):
-            f_zp[i] = fzp0
-        return f_zp
+        depends on "frequency_fit"
+        """
+        return self.stages.get('zero_point_energy')
 
     def integrate_entropy(self):
         """
         Calculate the free energy on a finer temperature grid by integrating entropy
         The entropy here is the summation of electronic entropy and vibrational entropy
-        depends on "calculate_vibrational_entropy" and "calculate_electronic_entropy"
+        depends on "vibrational_entropy" and "electronic_entropy"
         """
-        s_vib = self.calculate_vibrational_entropy()
-        s_el = self.calculate_electronic_entropy()
-        assert (s_el.shape == s_vib.shape)
-        s_total = s_vib + s_el
-        f_total = integrate(self.continuous_temperature, s_total)
-        return f_total, s_total
+        return self.stages.get('integrate')
 
     def interpolate_F_total(self):
         """
         interpolate the F_total on a finer volume grid
-        depends on "integrate_entropy"
+        depends on "integrate"
         """
-        f_total_raw, s_total_raw = self.integrate_entropy()
-        raw_E = self.input.static_energy  # E(V) from input
-        raw_V = self.input.volumes  # V
-        inter = Interpolation(raw_V, num=self.NV, ratio=self.ratio)
-        F_total_fitted = np.empty((self.NT, self.NV))
-        # if the first temperature isn't 0, the free energy needs to minus a base energy S_0T
-        if 0 not in self.discrete_temperatures:
-            T_0 = self.discrete_temperatures[0]
-            F_total = f_total_raw + raw_E - T_0 * s_total_raw[0]
-        else:
-            f_zp = self.calculate_zero_point_energy()
-            F_total = f_total_raw + f_zp + raw_E
-        for i in range(len(self.continuous_temperature)):
-            F_total_fitted[i] = inter.fitting(F_total[i])
-        return F_total_fitted
+        return self.stages.get('free_energy')
+
+    def calculate_strain_polynomial(self):
+        """
+        Fit the F_total of each temperature as a polynomial of the strain, keeping its coefficients
+        depends on "integrate"
+        """
+        return self.stages.get('strain_polynomial')
 
     def calculate_volumes(self):
         """
         Interpolate volumes on a finer volume grid
         """
-        raw_V = self.input.volumes  # V
-        inter = Interpolation(raw_V, num=self.NV, ratio=self.ratio)
-        return inter.out_volumes
+        return self.stages.get('volumes')
 
+    def _adaptive_temperatures(self, inp, weight):
+        """
+        The NT temperatures that equidistribute the error of the central differences of the heat capacity,
+        i.e., whose density is the square root of the curvature of the vibrational C_V, estimated on the uniform grid
+        at the smallest and the largest volumes, which bound where the curvature lies. Only those two volumes
+        of the frequencies are read.
+        """
+        pilot = np.linspace(self.discrete_temperatures[0], self.discrete_temperatures[-1], self.NT)
+        ends = [int(np.argmin(inp.volumes)), int(np.argmax(inp.volumes))]
+        p_coeffs = batched_polyfit(np.array(inp.get_temperature()), np.array(inp.frequencies[:, ends]), 2)
+        s_vib = streamed_vibrational_entropies(p_coeffs, pilot, weight, self.chunk_size)
+        cv = pilot[:, None] * np.gradient(s_vib, pilot, axis=0)
+        curvature = np.abs(np.gradient(np.gradient(cv, pilot, axis=0), pilot, axis=0))
+        curvature /= np.maximum(curvature.max(axis=0), np.finfo(float).tiny)
+        self._continuous_temperature = equidistributed_grid(pilot, np.sqrt(curvature).max(axis=1), self.NT)
+        return self._continuous_temperature
 
-def zero_point_energy(frequency, weights):
+    def _covering_ratio(self, raw_V, F_total):
+        """
+        The smallest volume expansion ratio whose grid covers the desired pressures at every temperature.
+        """
+        self.ratio = FinerGrid(np.min(self.pressures), self.NV).covering_ratio(raw_V, F_total, np.max(self.pressures))
+        return self.ratio
+
+    def _vibrational_entropy(self, p_coeffs, weight, temperatures):
+        return streamed_vibrational_entropies(p_coeffs, temperatures, weight, self.chunk_size)
+
+    def _vibrational_heat_capacity(self, p_coeffs, weight, temperatures):
+        return streamed_vibrational_heat_capacities(p_coeffs, temperatures, weight, self.chunk_size)
+
+    def _zero_point_energy(self, p_coeffs, weight, temperatures):
+        # Only the frequencies at the first temperature are needed
+        f_zp = np.empty((self.NT, p_coeffs.shape[1]))
+        fzp0 = fitted_zero_point_energy(p_coeffs, temperatures[0], weight)
+        for i in range(len(temperatures)):
+            f_zp[i] = fzp0
+        return f_zp
+
+    def _volume_blocks(self, inp, weight, temperatures):
+        """
+        Split the volumes into blocks, over a process pool if workers > 1. In memory, the frequencies are shared
+        through shared memory, each worker only copies its own block. With a frequency store, every block is
+        a single volume read from the memory-mapped file, so that only a few volumes are resident at a time.
+        Every volume is computed exactly as in the serial run. With analytic temperature derivatives,
+        the vibrational heat capacity is computed as well, otherwise it is None.
+        """
+        nv = inp.frequencies.shape[1]
+        s_vib = np.empty((self.NT, nv))
+        f_zp = np.empty((self.NT, nv))
+        heat_capacity = self.temperature_derivatives == 'analytic'
+        cv_vib = np.empty((self.NT, nv)) if heat_capacity else None
+        if self.frequency_store is None:
+            blocks = [block for block in np.array_split(np.arange(nv), self.workers) if len(block)]
+        else:
+            blocks = [np.array([j]) for j in range(nv)]
+        arguments = (inp.get_temperature(), temperatures, weight, self.chunk_size, heat_capacity)
+        with ExitStack() as stack:
+            if self.frequency_store is None:
+                source = stack.enter_context(SharedArray(inp.frequencies)).descriptor
+            else:
+                source = self.frequency_store
+            if self.workers > 1:
+                n_processes = min(self.workers, len(blocks))
+                # Leave the cores to the processes rather than to numba threads inside each of them
+                threads = max(1, numba.config.NUMBA_NUM_THREADS // n_processes)
+                executor = stack.enter_context(ProcessPoolExecutor(
+                    max_workers=n_processes, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=numba.set_num_threads, initargs=(threads,)))
+                futures = {executor.submit(_volume_block, source, slice(block[0], block[-1] + 1), *arguments): block
+                           for block in blocks}
+                results = ((futures[future], future.result()) for future in as_completed(futures))
+            else:
+                results = ((block, _volume_block(source, slice(block[0], block[-1] + 1), *arguments))
+                           for block in blocks)
+            for block, (s_vib_block, f_zp_block, cv_vib_block) in results:
+                s_vib[:, block], f_zp[:, block] = s_vib_block, f_zp_block
+                if heat_capacity:
+                    cv_vib[:, block] = cv_vib_block
+        return s_vib, f_zp, cv_vib
+
+    def _integrate_entropy(self, s_vib, s_el, temperatures):
+        assert (s_el.shape == s_vib.shape)
+        s_total = s_vib + s_el
+        f_total = integrate(temperatures, s_total, scheme=self.integration)
+        return f_total, s_total
+
+    def _raw_F_total(self, integrated, raw_E, f_zp=None):
+        f_total_raw, s_total_raw = integrated
+        # if the first temperature isn't 0, the free energy needs to minus a base energy S_0T
+        if f_zp is None:
+            T_0 = self.discrete_temperatures[0]
+            return f_total_raw + raw_E - T_0 * s_total_raw[0]
+        return f_total_raw + f_zp + raw_E
+
+    def _interpolate_F_total(self, F_total, inter):
+        # All the temperatures are projected onto the dense volumes by one matrix product
+        return inter.fitting(F_total)
+
+
+@jit(nopython=True, cache=True, error_model='numpy')
+def _mode_entropy(kt, frequency, constants):
     """
-    Equation for calculate entropy from frequencies
+    Vibrational entropy of one mode, negative frequencies are treated as 0.
+    The contribution is 0 if it is not finite, e.g., for a zero frequency or at 0 K.
+    *constants* holds HBAR, K, 0 and 2 in the precision of *frequency*, so the whole formula stays in it.
     """
+    hbar, k, zero, two = constants[0], constants[1], constants[2], constants[3]
+    if frequency < zero:
+        frequency = zero
+    hw_2kt = hbar * frequency / (two * kt)
+    result = k * (hw_2kt / np.tanh(hw_2kt) - np.log(two * np.sinh(hw_2kt)))
+    if not np.isfinite(result):
+        return zero
+    return result
 
-    @jit(nopython=True, parallel=True)
-    def zp_formula(frequency):
-        shape = frequency.shape
-        frequency = frequency.reshape(-1)
-        # if frequency is negative, they are treated as 0
-        frequency[frequency < 0] = 0.0
-        hw = HBAR * frequency
-        result = 1 / 2 * hw
-        return result.reshape(shape)
 
-    scaled_q_weights = weights / np.sum(weights)
-    zp_energies = np.dot(np.nan_to_num(zp_formula(
-        frequency)).sum(axis=2), scaled_q_weights)
+@jit(nopython=True, parallel=True, cache=True, error_model='numpy')
+def _vibrational_entropy_kernel(temperatures, frequencies, scaled_q_weights, constants):
+    """
+    S_vib(T, V) for all *temperatures* at once, *frequencies* has shape (nt, nv, nq, nm).
+    Each mode is evaluated in the precision of *frequencies*, the sum over q-points and modes
+    is accumulated in float64.
+    """
+    nt, nv, nq, nm = frequencies.shape
+    result = np.empty((nt, nv))
+    for n in prange(nt * nv):
+        i, j = n // nv, n % nv
+        kt = constants[1] * temperatures[i]
+        total = 0.0
+        for q in range(nq):
+            s_q = 0.0
+            for m in range(nm):
+                s_q += _mode_entropy(kt, frequencies[i, j, q, m], constants)
+            total += s_q * scaled_q_weights[q]
+        result[i, j] = total
+    return result
 
-    return zp_energies
+
+@jit(nopython=True, cache=True, error_model='numpy')
+def _mode_heat_capacity(kt, frequency, slope, constants):
+    """
+    Heat capacity :math:`T \\partial S / \\partial T` of one mode whose frequency changes with temperature by
+    *slope*, i.e., the harmonic heat capacity times :math:`1 - T \\omega' / \\omega`. As in ``_mode_entropy``,
+    negative frequencies are treated as 0, whose entropy is 0 at any temperature, and the contribution is 0
+    if it is not finite.
+    """
+    hbar, k, zero, two = constants[0], constants[1], constants[2], constants[3]
+    if frequency <= zero:
+        return zero
+    hw_2kt = hbar * frequency / (two * kt)
+    result = k * (hw_2kt / np.sinh(hw_2kt)) ** 2 * (frequency - kt / k * slope) / frequency
+    if not np.isfinite(result):
+        return zero
+    return result
+
+
+@jit(nopython=True, parallel=True, cache=True, error_model='numpy')
+def _vibrational_heat_capacity_kernel(temperatures, frequencies, slopes, scaled_q_weights, constants):
+    """
+    C_V,vib(T, V) for all *temperatures* at once, *frequencies* and their temperature derivatives *slopes* have
+    shape (nt, nv, nq, nm). Accumulated like ``_vibrational_entropy_kernel``.
+    """
+    nt, nv, nq, nm = frequencies.shape
+    result = np.empty((nt, nv))
+    for n in prange(nt * nv):
+        i, j = n // nv, n % nv
+        kt = constants[1] * temperatures[i]
+        total = 0.0
+        for q in range(nq):
+            c_q = 0.0
+            for m in range(nm):
+                c_q += _mode_heat_capacity(kt, frequencies[i, j, q, m], slopes[i, j, q, m], constants)
+            total += c_q * scaled_q_weights[q]
+        result[i, j] = total
+    return result
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _zero_point_energy_kernel(frequencies, scaled_q_weights):
+    """
+    Zero point energy of every volume, *frequencies* has shape (nv, nq, nm).
+    """
+    nv, nq, nm = frequencies.shape
+    result = np.empty(nv)
+    for j in prange(nv):
+        total = 0.0
+        for q in range(nq):
+            e_q = 0.0
+            for m in range(nm):
+                # if frequency is negative, they are treated as 0
+                e_q += 1 / 2 * HBAR * max(frequencies[j, q, m], 0.0)
+            total += e_q * scaled_q_weights[q]
+        result[j] = total
+    return result
+
+
+def zero_point_energy(frequency, weights):
+    """
+    Equation for calculate zero point energy from frequencies
+
+    :param frequency: The frequencies with shape (nv, nq, nm).
+    :param weights: The weights of q-points.
+    :return: The zero point energy of each volume.
+    """
+    scaled_q_weights = weights / np.sum(weights)
+    return _zero_point_energy_kernel(np.ascontiguousarray(frequency), scaled_q_weights)
 
 
 def entropy(temperature, frequency, weights):
     """
     Equation for calculate entropy from frequencies
+
+    :param temperature: A temperature.
+    :param frequency: The frequencies at *temperature* with shape (nv, nq, nm).
+    :param weights: The weights of q-points.
+    :return: The vibrational entropy of each volume.
+    """
+    return vibrational_entropies(np.array([temperature]), frequency[None], weights)[0]
+
+
+def vibrational_entropies(temperatures, frequencies, weights):
     """
+    Calculate the vibrational entropies for all temperatures in one call of a compiled parallel kernel
 
-    @jit(nopython=True, parallel=True)
-    def vib_entropy(temperature, frequency):
-        kt = K * temperature
-        shape = frequency.shape
-        frequency = frequency.reshape(-1)
-        # if frequency is negative, they are treated as 0
-        frequency[frequency < 0] = 0.0
+    :param temperatures: A vector of temperatures, with length nt.
+    :param frequencies: The frequencies at each temperature with shape (nt, nv, nq, nm), either float32 or float64,
+        which is the precision each mode is evaluated in.
+    :param weights: The weights of q-points.
+    :return: The vibrational entropy :math:`S_{vib}(T, V)`, with shape (nt, nv), always float64.
+    """
+    frequencies = np.ascontiguousarray(frequencies)
+    dtype = frequencies.dtype
+    scaled_q_weights = weights / np.sum(weights)
+    constants = np.array([HBAR, K, 0, 2], dtype=dtype)
+    return _vibrational_entropy_kernel(np.asarray(temperatures, dtype=dtype), frequencies, scaled_q_weights,
+                                       constants)
 
-        # result = np.zeros(len(frequency))
-        hw = HBAR * frequency
-        hw_2kt = hw / (2 * kt)
-        result = K * (hw_2kt / np.tanh(hw_2kt) - np.log(2 * np.sinh(hw_2kt)))
 
-        return result.reshape(shape)
+def streamed_vibrational_entropies(p_coeffs, temperatures, weights, chunk_size):
+    """
+    Calculate the vibrational entropies from the fitted frequencies, evaluating the frequencies
+    *chunk_size* temperatures at a time
 
+    :param p_coeffs: The coefficients of the frequencies fitted against temperature, with shape (3, nv, nq, nm).
+    :param temperatures: A vector of temperatures, with length nt.
+    :param weights: The weights of q-points.
+    :param chunk_size: The number of temperatures evaluated at a time.
+    :return: The vibrational entropy :math:`S_{vib}(T, V)`, with shape (nt, nv).
+    """
+    s_vib = np.empty((len(temperatures), p_coeffs.shape[1]))
+    for start, freq in iter_polyval(p_coeffs, temperatures, chunk_size):
+        s_vib[start:start + len(freq)] = vibrational_entropies(temperatures[start:start + len(freq)], freq, weights)
+    return s_vib
+
+
+def vibrational_heat_capacities(temperatures, frequencies, slopes, weights):
+    """
+    Calculate the vibrational heat capacities :math:`C_V = T (\\partial S_{vib} / \\partial T)_V` for all
+    temperatures in one call of a compiled parallel kernel, including the change of the frequencies with temperature
+
+    :param temperatures: A vector of temperatures, with length nt.
+    :param frequencies: The frequencies at each temperature with shape (nt, nv, nq, nm), either float32 or float64,
+        which is the precision each mode is evaluated in.
+    :param slopes: The temperature derivatives of *frequencies*, with the same shape.
+    :param weights: The weights of q-points.
+    :return: The vibrational heat capacity :math:`C_{V, vib}(T, V)`, with shape (nt, nv), always float64.
+    """
+    frequencies = np.ascontiguousarray(frequencies)
+    dtype = frequencies.dtype
     scaled_q_weights = weights / np.sum(weights)
-    vibrational_entropies = np.dot(np.nan_to_num(vib_entropy(temperature, frequency)).sum(axis=2), scaled_q_weights)
+    constants = np.array([HBAR, K, 0, 2], dtype=dtype)
+    return _vibrational_heat_capacity_kernel(np.asarray(temperatures, dtype=dtype), frequencies,
+                                             np.ascontiguousarray(slopes, dtype=dtype), scaled_q_weights, constants)
+
+
+def streamed_vibrational_heat_capacities(p_coeffs, temperatures, weights, chunk_size):
+    """
+    Calculate the vibrational heat capacities from the fitted frequencies and their derivatives, evaluating them
+    *chunk_size* temperatures at a time
+
+    :param p_coeffs: The coefficients of the frequencies fitted against temperature, with shape (3, nv, nq, nm).
+    :param temperatures: A vector of temperatures, with length nt.
+    :param weights: The weights of q-points.
+    :param chunk_size: The number of temperatures evaluated at a time.
+    :return: The vibrational heat capacity :math:`C_{V, vib}(T, V)`, with shape (nt, nv).
+    """
+    cv_vib = np.empty((len(temperatures), p_coeffs.shape[1]))
+    chunks = zip(iter_polyval(p_coeffs, temperatures, chunk_size),
+                 iter_polyval(batched_polyder(p_coeffs), temperatures, chunk_size))
+    for (start, freq), (_, slopes) in chunks:
+        cv_vib[start:start + len(freq)] = vibrational_heat_capacities(temperatures[start:start + len(freq)], freq,
+                                                                      slopes, weights)
+    return cv_vib
+
+
+def fitted_zero_point_energy(p_coeffs, temperature, weights):
+    """
+    Calculate the zero point energy from the frequencies fitted against temperature, evaluated at *temperature*
+    """
+    freq = batched_polyval(p_coeffs, np.array([temperature]))
+    return zero_point_energy(freq[0], weights)
+
+
+def _read_frequencies(source, key):
+    """
+    Copy a block of the frequencies, from a ``SharedArray`` if *source* is its descriptor,
+    otherwise from the memory-mapped ``.npy`` file *source*.
+    """
+    if isinstance(source, tuple):
+        return read_shared_array(source, key)
+    return np.array(np.load(source, mmap_mode='r')[key])
+
+
+def _volume_block(source, volumes, discrete_temperatures, temperatures, weights, chunk_size, heat_capacity=False):
+    """
+    Worker of ``FreeEnergyCalculation``: fit the frequencies of a block of *volumes*, and calculate
+    their vibrational entropy, zero point energy, and if *heat_capacity*, vibrational heat capacity
+    """
+    freq = _read_frequencies(source, (slice(None), volumes))
+    p_coeffs = batched_polyfit(np.array(discrete_temperatures), freq, 2)  # quadratic form
+    del freq
+    s_vib = streamed_vibrational_entropies(p_coeffs, temperatures, weights, chunk_size)
+    cv_vib = streamed_vibrational_heat_capacities(p_coeffs, temperatures, weights, chunk_size) if heat_capacity \
+        else None
+    return s_vib, fitted_zero_point_energy(p_coeffs, temperatures[0], weights), cv_vib
 
-    return vibrational_entropies
 
+@jit(nopython=True, parallel=True, cache=True)
+def _integrate_kernel(temperatures, entropies, out):
+    """
+    Cumulative trapezoidal integral of every column of *entropies* into *out*, with the first row
+    of *entropies* as the first row of the integral, negated.
+    """
+    nt, nv = entropies.shape
+    for j in prange(nv):
+        out[0, j] = -entropies[0, j]
+        area = 0.0
+        for i in range(1, nt):
+            # In the same order of operations as scipy's cumtrapz, which started from 0 and inserted the initial
+            area += (temperatures[i] - temperatures[i - 1]) * (entropies[i, j] + entropies[i - 1, j]) / 2.0
+            out[i, j] = -area
+    return out
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _integrate_stencils_kernel(starts, weights, entropies, out):
+    """
+    Cumulative integral of every column of *entropies* into *out*, where interval i adds
+    ``weights[i] . entropies[starts[i]:starts[i] + m]``. The first row is the first row of *entropies*, negated.
+    """
+    nt, nv = entropies.shape
+    m = weights.shape[1]
+    for j in prange(nv):
+        out[0, j] = -entropies[0, j]
+        area = 0.0
+        for i in range(1, nt):
+            start = starts[i - 1]
+            piece = 0.0
+            for k in range(m):
+                piece += weights[i - 1, k] * entropies[start + k, j]
+            area += piece
+            out[i, j] = -area
+    return out
 
-def integrate(temperatures, entropies):
-    all_energies = []
-    for i, entropy in enumerate(entropies.T):  # for same temperature
-        energy = cumtrapz(entropy, temperatures, initial=entropy[0])
-        all_energies.append(energy)
 
-    return - np.array(all_energies).T
+def stencil_weights(temperatures, points: int):
+    """
+    The quadrature weights of every interval :math:`[T_{i-1}, T_i]`, i.e., the integrals over the interval of
+    the Lagrange basis polynomials through *points* consecutive temperatures. The stencil is centered on the
+    interval (for 3 points, :math:`T_{i-1}, T_i, T_{i+1}`) and shifted inwards at the ends of the grid.
+
+    :param temperatures: A vector of increasing temperatures, with length nt >= *points*.
+    :param points: The number of temperatures of each stencil, 2 is the trapezoidal rule.
+    :return: The first index of the stencil of every interval, with length nt - 1,
+        and the weights, with shape (nt - 1, *points*).
+    """
+    temperatures = np.asarray(temperatures, dtype=float)
+    nt = len(temperatures)
+    if nt < points:
+        raise ValueError("At least {0} temperatures are needed by a {0}-point quadrature!".format(points))
+    starts = np.clip(np.arange(1, nt) - points // 2, 0, nt - points)
+    # In the coordinate (T - T_{i-1}) / h the interval is [0, 1], the moments of which are 1 / (n + 1)
+    h = np.diff(temperatures)
+    nodes = (temperatures[starts[:, None] + np.arange(points)] - temperatures[:-1, None]) / h[:, None]
+    vandermonde = nodes[:, None, :] ** np.arange(points)[None, :, None]
+    moments = np.broadcast_to(1 / np.arange(1, points + 1), (nt - 1, points))
+    weights = np.linalg.solve(vandermonde, moments[..., None])[..., 0] * h[:, None]
+    return starts, weights
+
+
+def integrate(temperatures, entropies, out=None, scheme: str = 'trapezoid'):
+    """
+    The free energy :math:`F(T) = -\\int S(T) dT` of every volume, by a cumulative quadrature over
+    the whole (nt, nv) entropy matrix in one call, in parallel over the volumes. The temperatures may be
+    non-uniform. The first row of the result is :math:`-S(T_0)`.
+
+    With ``'trapezoid'`` S(T) is linear on every interval. With ``'simpson'`` (``'cubic'``) it is the quadratic
+    (cubic) through the 3 (4) nearest temperatures, so the error of F drops from :math:`O(h^2)` to
+    :math:`O(h^3)` (:math:`O(h^4)`) for a smooth S(T).
+
+    :param temperatures: A vector of temperatures, with length nt.
+    :param entropies: The entropy :math:`S(T, V)`, with shape (nt, nv).
+    :param out: A preallocated (nt, nv) array for the result, a new one if not given.
+    :param scheme: One of ``'trapezoid'``, ``'simpson'`` and ``'cubic'``.
+    :return: The free energy :math:`F(T, V)` up to a constant, with shape (nt, nv).
+    """
+    temperatures = np.asarray(temperatures, dtype=float)
+    entropies = np.asarray(entropies, dtype=float)
+    if out is None:
+        out = np.empty(entropies.shape)
+    if scheme == 'trapezoid':
+        return _integrate_kernel(temperatures, entropies, out)
+    starts, weights = stencil_weights(temperatures, INTEGRATION_POINTS[scheme])
+    return _integrate_stencils_kernel(starts, weights, entropies, out)
 
 
 if __name__ == '__main__':
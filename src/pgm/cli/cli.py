@@ -14,6 +14,12 @@ main.add_command(_run, "run")
 from pgm.cli.plot import main as _plot
 main.add_command(_plot, "plot")
 
+from pgm.cli.validate import main as _validate
+main.add_command(_validate, "validate")
+
+from pgm.cli.query import main as _query
+main.add_command(_query, "query")
+
 main.context_settings["max_content_width"] = 9999
 
 if __name__ == "__main__":
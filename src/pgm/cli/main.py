@@ -3,17 +3,39 @@ import click
 import os
 from pathlib import Path
 from pgm.calculator import FreeEnergyCalculation
+from pgm.reader.cache import InputCache
 from pgm.data import save_data
 from pgm.settings import Settings, DEFAULT_SETTINGS
-from pgm.thermo import ThermodynamicProperties
+from pgm.thermo import evaluate_thermodynamics, evaluate_thermodynamics_blocks
 from pgm.util.unit_conversion import gpa_to_ry_b3, ry_b3_to_gpa, ry_to_j_mol, ry_to_ev, b3_to_a3
 from pgm.cli.banner import print_banner
 
 with open(Path(__file__).parent / "../version.py") as fp: exec(fp.read())
 
-def run(file_settings: str):
+# The output of each property: the settings flag, the file name, the conversion to output units, and its grid
+OUTPUTS = {
+    'p_tv': ('ptv', 'ptv_gpa_K_a3', ry_b3_to_gpa, 'tv'),
+    's_tv': ('stv', 'stv_ev_K_a3', ry_to_ev, 'tv'),
+    'u_tp': ('utp', 'utp_ev_K_gpa', ry_to_ev, 'tp'),
+    'h_tp': ('htp', 'htp_ev_T_gpa', ry_to_ev, 'tp'),
+    'g_tp': ('gtp', 'gtp_ev_T_gpa', ry_to_ev, 'tp'),
+    'alpha_tp': ('alpha_tp', 'alpha_tp_K_gpa', lambda x: x, 'tp'),
+    'bt_tp': ('bt_tp', 'bt_tp_gpa_K_gpa', ry_b3_to_gpa, 'tp'),
+    'gamma_tp': ('gamma_tp', 'gamma_tp_K_gpa', lambda x: x, 'tp'),
+    'bs_tp': ('bs_tp', 'bs_tp_gpa_K_gpa', ry_b3_to_gpa, 'tp'),
+    'cv_tp': ('cv_tp', 'cv_tp_jmol_K_gpa', ry_to_j_mol, 'tp'),
+    'cp_tp': ('cp_tp', 'cp_tp_jmol_K_gpa', ry_to_j_mol, 'tp'),
+    'btp_tp': ('btp_tp', 'btp_tp_K_gpa', lambda x: x, 'tp'),
+}
+
+
+def run(file_settings: str, cache: bool = True, clear_cache: bool = False):
     user_settings = Settings(DEFAULT_SETTINGS)
     user_settings.read_from_yaml(file_settings)
+    if clear_cache:
+        InputCache(user_settings.cache_directory).clear(user_settings.input_paths)
+    if not cache:
+        user_settings.cache = False
 
     out_dir = user_settings.output_directory
     if not os.path.exists(out_dir):
@@ -22,59 +44,43 @@ def run(file_settings: str):
     print("Caution: If imaginary frequencies found, they are currently treated as 0!")
     calc = FreeEnergyCalculation(user_settings)
     print("Calculating free energies")
-    total_free_energies = calc.interpolate_F_total()
-    volumes = calc.calculate_volumes()
+    targets = ['free_energy', 'volumes']
+    if calc.volume_derivatives == 'analytic':
+        # P, B_T and B_T' from the strain polynomials of F(T, V) rather than numerically on the volume grid
+        targets.append('strain_polynomial')
+    if calc.temperature_derivatives == 'analytic':
+        # S and C_V from the frequencies rather than numerically on the temperature grid
+        targets.extend(['entropy', 'heat_capacity'])
+    results = dict(zip(targets, calc.evaluate(*targets)))
+    total_free_energies, volumes = results['free_energy'], results['volumes']
+    analytic = {'strain_polynomial': results.get('strain_polynomial'), 'entropies': results.get('entropy'),
+                'heat_capacities': results.get('heat_capacity')}
+    del results
+    if user_settings.ratio == 'auto':
+        print("Volume expansion ratio: {0:.4f}".format(calc.ratio))
     continuous_temperature = calc.continuous_temperature
     desired_pressure = calc.pressures
     print("Calculating thermodynamics properties")
-    thermo = ThermodynamicProperties(volumes, continuous_temperature, gpa_to_ry_b3(desired_pressure),
-                                     total_free_energies)
-
     save_data(ry_to_ev(total_free_energies), continuous_temperature, b3_to_a3(volumes), out_dir + 'ftv_ev_a3')
 
-    if (user_settings.ptv):
-        ptv = ry_b3_to_gpa(thermo.p_tv)
-        save_data(ptv, continuous_temperature, b3_to_a3(volumes), out_dir + 'ptv_gpa_K_a3')
-
-    if (user_settings.stv):
-        stv = ry_to_ev(thermo.s_tv)
-        save_data(stv, continuous_temperature, b3_to_a3(volumes), out_dir + 'stv_ev_K_a3')
-
-    if (user_settings.utp):
-        utp = ry_to_ev(thermo.u_tp)
-        save_data(utp, continuous_temperature, desired_pressure, out_dir + 'utp_ev_K_gpa')
-
-    if (user_settings.htp):
-        htp = ry_to_ev(thermo.h_tp)
-        save_data(htp, continuous_temperature, desired_pressure, out_dir + 'htp_ev_T_gpa')
-
-    if (user_settings.gtp):
-        gtp = ry_to_ev(thermo.g_tp)
-        save_data(gtp, continuous_temperature, desired_pressure, out_dir + 'gtp_ev_T_gpa')
-
-    if (user_settings.alpha_tp):
-        alpha_tp = thermo.alpha_tp
-        save_data(alpha_tp, continuous_temperature, desired_pressure, out_dir + 'alpha_tp_K_gpa')
-
-    if (user_settings.bt_tp):
-        bt_tp = ry_b3_to_gpa(thermo.bt_tp)
-        save_data(bt_tp, continuous_temperature, desired_pressure, out_dir + 'bt_tp_gpa_K_gpa')
-
-    if (user_settings.gamma_tp):
-        gamma_tp = thermo.gamma_tp
-        save_data(gamma_tp, continuous_temperature, desired_pressure, out_dir + 'gamma_tp_K_gpa')
-
-    if (user_settings.bs_tp):
-        bs_tp = ry_b3_to_gpa(thermo.bs_tp)
-        save_data(bs_tp, continuous_temperature, desired_pressure, out_dir + 'bs_tp_gpa_K_gpa')
-
-    if (user_settings.cv_tp):
-        cv = ry_to_j_mol(thermo.cv_tp)
-        save_data(cv, continuous_temperature, desired_pressure, out_dir + 'cv_tp_jmol_K_gpa')
-
-    if (user_settings.cp_tp):
-        cp = ry_to_j_mol(thermo.cp_tp)
-        save_data(cp, continuous_temperature, desired_pressure, out_dir + 'cp_tp_jmol_K_gpa')
+    # Only the wanted properties and what they depend on are computed, each one is saved as soon as it is ready
+    wanted = {name: output for name, output in OUTPUTS.items() if getattr(user_settings, output[0])}
+    arguments = (volumes, continuous_temperature, gpa_to_ry_b3(desired_pressure), total_free_energies, *wanted)
+    # The wanted (T, P) properties are interpolated in one pass only if asked, it keeps their (T, V) ones alive together
+    stacked = tuple(wanted) if user_settings.stack_interpolations else ()
+    if user_settings.block_size:
+        # A block of temperatures at a time, each block is appended to the files after the previous ones
+        results = evaluate_thermodynamics_blocks(*arguments, block_size=user_settings.block_size, stacked=stacked,
+                                                 **analytic)
+    else:
+        results = ((slice(None), name, quantity) for name, quantity in
+                   evaluate_thermodynamics(*arguments, stacked=stacked, **analytic))
+    for rows, name, quantity in results:
+        _, filename, convert, grid = wanted[name]
+        columns = b3_to_a3(volumes) if grid == 'tv' else desired_pressure
+        save_data(convert(quantity), continuous_temperature[rows], columns, out_dir + filename,
+                  append=bool(rows.start))
+        del quantity
     print("Saving thermodynamics properties")
 
 
@@ -83,11 +89,13 @@ def run(file_settings: str):
 @click.version_option(version=__version__, prog_name="pgm")  # pylint: disable=undefined-variable
 @click.option("--debug", default="INFO", type=click.Choice(logging._levelToName.values()),
               help="Verbosity level of debug log emitted to the standard output.")
-def main(settings: str, debug: str):
+@click.option("--no-cache", is_flag=True, help="Parse the input files without reading or writing the binary cache.")
+@click.option("--clear-cache", is_flag=True, help="Remove the binary cache of the input files before running.")
+def main(settings: str, debug: str, no_cache: bool, clear_cache: bool):
     logger = logging.getLogger("pgm")
     logger.setLevel(debug)
     handler = logging.StreamHandler()
     logger.addHandler(handler)
 
     print_banner()
-    run(settings)
+    run(settings, cache=not no_cache, clear_cache=clear_cache)
@@ -0,0 +1,46 @@
+import click
+import numpy
+import pandas as pd
+from pgm.cli.plot import process_input
+from pgm.query import PROPERTIES, ThermodynamicModel
+
+
+@click.command("query")
+@click.argument("source", type=click.Path(exists=True))
+@click.option('-t', '--temperature', callback=process_input, required=True,
+              help='Comma separated temperature(s) of the points, in K.')
+@click.option('-p', '--pressure', callback=process_input, help='Comma separated pressure(s) of the points, in GPa.')
+@click.option('-v', '--volume', callback=process_input, help='Comma separated volume(s) of the points, in A^3.')
+@click.option('-q', '--property', 'names', multiple=True, type=click.Choice(list(PROPERTIES)),
+              help='A property to be evaluated, can be repeated, all of them by default.')
+@click.option('-o', '--outname', help='Also save the results to this csv file.')
+@click.option('--save-model', help='Save the fitted model to this .npz file, to be queried later without fitting.')
+def main(source, temperature, pressure, volume, names, outname, save_model):
+    """
+    \b
+    Evaluate thermodynamic properties at (T, P) or (T, V) points.
+    SOURCE is either a settings file, whose model is fitted first, or a model saved by --save-model.
+    The temperatures are paired with the pressures (or volumes) one by one, a single value is paired with all.
+    """
+    if (pressure is None) == (volume is None):
+        raise click.UsageError('Specify either the pressures or the volumes of the points.')
+    if source.endswith('.npz'):
+        model = ThermodynamicModel.load(source)
+    else:
+        model = ThermodynamicModel.from_settings(source)
+    if save_model:
+        model.save(save_model)
+
+    if pressure is not None:
+        temperature, pressure = numpy.broadcast_arrays(temperature, pressure)
+        points = {'T (K)': temperature, 'P (GPa)': pressure}
+        results = model.at_pressures(temperature, pressure, *names)
+    else:
+        temperature, volume = numpy.broadcast_arrays(temperature, volume)
+        points = {'T (K)': temperature, 'V (A^3)': volume}
+        results = model.at_volumes(temperature, volume, *names)
+    points.update({'{0} ({1})'.format(name, PROPERTIES[name]): result for name, result in results.items()})
+    table = pd.DataFrame(points)
+    print(table.to_string(index=False, float_format='%.6e'))
+    if outname:
+        table.to_csv(outname, index=False)
@@ -0,0 +1,22 @@
+import click
+from pgm.cli.plot import process_input
+from pgm.settings import Settings, DEFAULT_SETTINGS
+from pgm.validation import compare_integration, compare_precision
+
+
+@click.command("validate", help="Compare the float32 mode against the float64 run of the calculation in SETTINGS.")
+@click.argument("settings", type=click.Path(exists=True))
+@click.option('-o', '--outname', help='Also save the report to this csv file.')
+@click.option('--integration', 'nts', callback=process_input,
+              help='Comma separated numbers of temperatures, run the convergence study of the temperature '
+                   'integration schemes instead.')
+def main(settings: str, outname: str, nts):
+    user_settings = Settings(DEFAULT_SETTINGS)
+    user_settings.read_from_yaml(settings)
+    if nts is not None:
+        report = compare_integration(user_settings, nts.astype(int))
+    else:
+        report = compare_precision(user_settings, 'float32')
+    print(report.to_string(float_format='%.3e'))
+    if outname:
+        report.to_csv(outname)
@@ -13,14 +13,15 @@ def read_data(filename: str) -> pd.DataFrame:
     return df
 
 
-def save_data(quantities, index, column, filename):
+def save_data(quantities, index, column, filename, append=False):
     """
     save a matrix quantity to csv
     The saved files can be easily parsed using
     pandas.read_table("PATH_TO_FILE", sep=',', header=0, index_col=0)
+    If append, the rows are appended to the file without the header, e.g., a block of rows after the previous ones
     """
     df = pd.DataFrame(quantities, index=index, columns=column)
-    df.to_csv(filename)
+    df.to_csv(filename, mode='a' if append else 'w', header=not append)
     gc.collect()
 
 
@@ -5,9 +5,9 @@ All interpolation related module in pgm
 .. moduleauthor:: Hongjin Wang <hw2626@columbia.edu>
 """
 import numpy
-from pgm.util.fitting import polynomial_least_square_fitting
-from pgm.util.grid_interpolation import calculate_eulerian_strain, from_eulerian_strain
-from numba import jit
+from pgm.util.grid_cache import least_square_projection, strain_grid
+from pgm.util.grid_interpolation import calculate_eulerian_strain
+from numba import jit, prange
 from pgm.reader.read_input import Input
 import time
 
@@ -31,24 +31,102 @@ class Interpolation:
     @property
     def interpolate_volumes(self):
         """
-        for a vector of volumes, interpolate num, expand the volume by ratio
+        for a vector of volumes, interpolate num, expand the volume by ratio,
+        the read-only grid is shared with every other instance of the same volumes, num and ratio
         """
-        in_strains = calculate_eulerian_strain(self.in_volumes[0], self.in_volumes)
-        v_min, v_max = np.min(self.in_volumes), np.max(self.in_volumes)
-        # r = v_upper / v_max = v_min / v_lower
-        v_lower, v_upper = v_min / self.ratio, v_max * self.ratio
-        # The *v_max* is a reference value here.
-        s_upper, s_lower = calculate_eulerian_strain(v_max, v_lower), calculate_eulerian_strain(v_max, v_upper)
-        out_strains = np.linspace(s_lower, s_upper, self.num)
-        out_volumes = from_eulerian_strain(v_max, out_strains)
-        return out_volumes, out_strains, in_strains
+        return strain_grid(self.in_volumes, self.num, self.ratio)
+
+    def projection(self, order=3):
+        """
+        The least-square maps of ``polynomial_least_square_projection`` from the input volumes,
+        cached by ``least_square_projection`` for each *order*.
+
+        :return: A tuple, the (order + 1, number of input volumes) matrix to the coefficients,
+            and the (num, number of input volumes) matrix to the values on ``out_volumes``.
+        """
+        return least_square_projection(self.in_volumes, self.num, self.ratio, order)
 
     def fitting(self, quantity, order=3):
         """
-        quantity: the discrete quantity to be fitted
+        quantity: the discrete quantity to be fitted, a vector, or a matrix with one row per temperature
+        """
+        _, projection = self.projection(order)
+        return np.asarray(quantity) @ projection.T
+
+    def strain_polynomial(self, quantities, order=3):
+        """
+        Fit each row of *quantities* like ``fitting``, but keep the polynomials instead of their values.
+
+        :param quantities: The discrete quantities to be fitted, with shape (nt, number of input volumes).
+        :param order: The order of the polynomials.
+        :return: A ``StrainPolynomial``, whose values on ``out_volumes`` are the results of ``fitting``.
+        """
+        coefficients, _ = self.projection(order)
+        coefficients = coefficients @ np.asarray(quantities).T
+        # The output strains are taken with respect to the largest volume
+        return StrainPolynomial(coefficients, np.max(self.in_volumes))
+
+
+class StrainPolynomial:
+    """
+    A quantity :math:`F(T, V)` given at each temperature by a polynomial of the Eulerian strain
+    :math:`f = \\frac{1}{2} \\big( (V_0 / V)^{2/3} - 1 \\big)`, as fitted by ``Interpolation``,
+    with its volume derivatives computed analytically through the chain rule instead of numerically on a grid.
+    With :math:`u = 2 f + 1` and :math:`F_f, F_{ff}, F_{fff}` the strain derivatives,
+
+    .. math::
+
+       P = \\frac{ u F_f }{ 3 V }, \\quad
+       B_T = \\frac{ u^2 F_{ff} + 5 u F_f }{ 9 V }, \\quad
+       B_T' = \\frac{ u^2 F_{fff} + 12 u F_{ff} + 25 F_f }{ 3 (u F_{ff} + 5 F_f) }.
+
+    :param coefficients: The coefficients, lowest order first, with shape (order + 1, nt).
+    :param v0: The reference volume :math:`V_0` of the strain.
+    """
+
+    def __init__(self, coefficients, v0):
+        self.coefficients = np.asarray(coefficients)
+        self.v0 = v0
+
+    def strain_derivative(self, vs, n: int = 0):
+        """
+        :return: The *n*-th derivative of the quantity with respect to the strain at the volumes *vs*,
+            with shape (nt, len(vs)).
+        """
+        fs = calculate_eulerian_strain(self.v0, np.asarray(vs))
+        return numpy.polynomial.polynomial.polyval(fs, numpy.polynomial.polynomial.polyder(self.coefficients, n))
+
+    def __call__(self, vs):
+        return self.strain_derivative(vs)
+
+    def __getitem__(self, key):
+        """
+        :return: The ``StrainPolynomial`` of the temperatures *key*, e.g., a slice.
+        """
+        return StrainPolynomial(self.coefficients[:, key], self.v0)
+
+    def pressure(self, vs):
+        """
+        :return: :math:`P = -\\partial F / \\partial V` at the volumes *vs*, with shape (nt, len(vs)).
         """
-        _, fitted_quantity = polynomial_least_square_fitting(self.in_strains, quantity, self.out_strains, order)
-        return fitted_quantity
+        u = (self.v0 / vs) ** (2 / 3)
+        return u * self.strain_derivative(vs, 1) / (3 * vs)
+
+    def isothermal_bulk_modulus(self, vs):
+        """
+        :return: :math:`B_T = -V \\partial P / \\partial V` at the volumes *vs*, with shape (nt, len(vs)).
+        """
+        u = (self.v0 / vs) ** (2 / 3)
+        f_f, f_ff = self.strain_derivative(vs, 1), self.strain_derivative(vs, 2)
+        return (u ** 2 * f_ff + 5 * u * f_f) / (9 * vs)
+
+    def bulk_modulus_derivative(self, vs):
+        """
+        :return: :math:`B_T' = (\\partial B_T / \\partial P)_T` at the volumes *vs*, with shape (nt, len(vs)).
+        """
+        u = (self.v0 / vs) ** (2 / 3)
+        f_f, f_ff, f_fff = (self.strain_derivative(vs, n) for n in (1, 2, 3))
+        return (u ** 2 * f_fff + 12 * u * f_ff + 25 * f_f) / (3 * (u * f_ff + 5 * f_f))
 
 
 @jit(nopython=True)
@@ -90,6 +168,100 @@ def eval_polynomial(P, x):
     return result
 
 
+@jit(nopython=True, parallel=True, cache=True)
+def _project_columns(projection, ys):
+    """
+    Apply the (deg + 1, n) projection matrix to every column of the (n, ncol) matrix *ys*.
+    Each column is reduced in a fixed order, so its coefficients do not depend on how the columns are batched.
+    """
+    n_coeffs, n = projection.shape
+    n_columns = ys.shape[1]
+    coeffs = np.empty((n_coeffs, n_columns), dtype=ys.dtype)
+    for c in prange(n_columns):
+        for d in range(n_coeffs):
+            acc = 0.0
+            for k in range(n):
+                acc += projection[d, k] * ys[k, c]
+            coeffs[d, c] = acc
+    return coeffs
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _horner_columns(p, x):
+    """
+    Evaluate every column of the (deg + 1, ncol) coefficient matrix *p* on the points *x*, highest order first.
+    """
+    n_coeffs, n_columns = p.shape
+    result = np.empty((x.shape[0], n_columns), dtype=p.dtype)
+    for i in prange(x.shape[0]):
+        for c in range(n_columns):
+            r = p[0, c]
+            for d in range(1, n_coeffs):
+                r = x[i] * r + p[d, c]
+            result[i, c] = r
+    return result
+
+
+def batched_polyfit(x, ys, deg):
+    """
+    Least-square fit a polynomial of degree *deg* to every column of *ys* in one pass.
+
+    All the columns share the same Vandermonde matrix of *x*, so its pseudo-inverse is computed once
+    and applied to all columns, instead of solving one least-square problem per column as ``fit_poly`` does.
+
+    :param x: A vector of the x-coordinates, with length :math:`n`.
+    :param ys: An array with shape :math:`(n, \\ldots)`, each column of which is fitted against *x*.
+    :param deg: The degree of the polynomial.
+    :return: The coefficients with shape :math:`(deg + 1, \\ldots)`, highest order coefficient first.
+    """
+    x = np.asarray(x, dtype=float)
+    ys = np.asarray(ys)
+    if ys.shape[0] != x.shape[0]:
+        raise ValueError('The first axis of *ys* should have the same length as *x*!')
+    # Reverse the rows so that the highest order coefficient comes first, like ``fit_poly``.
+    projection = np.linalg.pinv(_coeff_mat(x, deg))[::-1]
+    projection = np.ascontiguousarray(projection, dtype=ys.dtype)
+    coeffs = _project_columns(projection, ys.reshape(x.shape[0], -1))
+    return coeffs.reshape((deg + 1,) + ys.shape[1:])
+
+
+def batched_polyval(p, x):
+    """
+    Evaluate the polynomials fitted by ``batched_polyfit`` on the points *x*, with Horner's Method.
+
+    :param p: The coefficients with shape :math:`(deg + 1, \\ldots)`, highest order coefficient first.
+    :param x: A vector of the points to be evaluated.
+    :return: The values with shape :math:`(len(x), \\ldots)`.
+    """
+    x = np.asarray(x, dtype=p.dtype)
+    result = _horner_columns(p.reshape(p.shape[0], -1), x)
+    return result.reshape(x.shape + p.shape[1:])
+
+
+def batched_polyder(p):
+    """
+    Differentiate the polynomials fitted by ``batched_polyfit``.
+
+    :param p: The coefficients with shape :math:`(deg + 1, \\ldots)`, highest order coefficient first.
+    :return: The coefficients of the derivatives with shape :math:`(deg, \\ldots)`, highest order coefficient first.
+    """
+    powers = np.arange(p.shape[0] - 1, 0, -1, dtype=p.dtype).reshape((-1,) + (1,) * (p.ndim - 1))
+    return p[:-1] * powers
+
+
+def iter_polyval(p, x, chunk_size: int):
+    """
+    Evaluate the polynomials fitted by ``batched_polyfit`` on *x*, chunk by chunk.
+
+    :param p: The coefficients with shape :math:`(deg + 1, \\ldots)`, highest order coefficient first.
+    :param x: A vector of the points to be evaluated.
+    :param chunk_size: The number of points evaluated per chunk.
+    :return: A generator of ``(start, values)``, where *start* is the index of the first point in the chunk.
+    """
+    for start in range(0, len(x), chunk_size):
+        yield start, batched_polyval(p, x[start:start + chunk_size])
+
+
 class FrequencyInterpolation:
     """
     Interpolate the frequencies against the temperatures
@@ -140,6 +312,36 @@ class FrequencyInterpolation:
             print(interpolated_freq.size * interpolated_freq.itemsize, "bytes")
         return interpolated_freq
 
+    def batched_polyfit(self, temperature: numpy.ndarray, DEBUG: bool = False):
+        start = time.time()
+        p_coeffs = batched_polyfit(self.discrete_temp, self.freq, 2)  # quadratic form
+        interpolated_freq = batched_polyval(p_coeffs, temperature)
+        end = time.time()
+        if DEBUG == True:
+            print("runtime is", (end - start), "s")
+            print(interpolated_freq.size * interpolated_freq.itemsize, "bytes")
+        return interpolated_freq
+
+    def fit(self):
+        """
+        Fit the frequencies of every volume, q-point and mode against the discrete temperatures.
+
+        :return: The coefficients with shape (3, nv, nq, nm), highest order coefficient first.
+        """
+        return batched_polyfit(self.discrete_temp, self.freq, 2)  # quadratic form
+
+    def iter_polyfit(self, temperature: numpy.ndarray, chunk_size: int):
+        """
+        Fit the frequencies once and evaluate them on *temperature* chunk by chunk, so that
+        only one chunk of shape (chunk_size, nv, nq, nm) is alive at a time.
+
+        :param temperature: A vector of temperatures to be evaluated.
+        :param chunk_size: The number of temperatures evaluated per chunk.
+        :return: A generator of ``(start, frequencies)``, where *start* is the index of the first temperature
+            in the chunk.
+        """
+        return iter_polyval(self.fit(), temperature, chunk_size)
+
 
 class ElectronicEntropyInterpolation:
     """
@@ -166,3 +368,25 @@ class ElectronicEntropyInterpolation:
             print("runtime is", (end - start), "s")
             print(interpolated_s_el.size * interpolated_s_el.itemsize, "bytes")
         return interpolated_s_el
+
+    def batched_polyfit(self, temperature: numpy.ndarray, DEBUG: bool = False):
+        start = time.time()
+        p_coeffs = batched_polyfit(self.discrete_temp, self.s_el, 2)  # quadratic form
+        interpolated_s_el = batched_polyval(p_coeffs, temperature)
+        end = time.time()
+        if DEBUG == True:
+            print("runtime is", (end - start), "s")
+            print(interpolated_s_el.size * interpolated_s_el.itemsize, "bytes")
+        return interpolated_s_el
+
+    def heat_capacity(self, temperature: numpy.ndarray):
+        """
+        The electronic heat capacity :math:`T \\partial S_{el} / \\partial T`, from the derivative of the same
+        quadratic fit as ``batched_polyfit``.
+
+        :param temperature: A vector of temperatures to be evaluated.
+        :return: The heat capacity with shape (len(temperature), nv).
+        """
+        p_coeffs = batched_polyfit(self.discrete_temp, self.s_el, 2)  # quadratic form
+        temperature = np.asarray(temperature)
+        return temperature[:, None] * batched_polyval(batched_polyder(p_coeffs), temperature)
@@ -1,5 +1,6 @@
 import matplotlib.pyplot as plt
 from pgm.data import read_data
+from pgm.util.tools import find_nearest
 import numpy
 
 
@@ -69,8 +70,7 @@ class Plot:
             So needs to find the closest value to target in volumes
             """
             all_volumes = self.df.columns.values
-            for v in self.volume:
-                closest_column_index = numpy.abs(all_volumes - v).argmin()
+            for closest_column_index in find_nearest(all_volumes, self.volume):
                 closest_column_value = self.df.columns[closest_column_index]
                 line = self.df[closest_column_value].values
                 plt.plot(plot_temperature[4:-4], line[4:-4], label=f'{closest_column_value} $Ang^3$')
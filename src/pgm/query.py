@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+.. module query
+   :platform: Unix, Windows, Mac, Linux
+   :synopsis: Evaluate the thermodynamic properties at arbitrary :math:`(T, P)` or :math:`(T, V)` points,
+    or along isentropes and geotherms, from the fitted free energy, without computing the whole :math:`(T, V)` grid.
+"""
+
+import functools
+
+import numpy as np
+from numba import jit, prange
+
+from .calculator import FreeEnergyCalculation
+from .interpolate import StrainPolynomial
+from .settings import Settings, DEFAULT_SETTINGS
+from .thermo import calculate_derivatives
+from .util.grid_interpolation import calculate_eulerian_strain, from_eulerian_strain
+from .util.tools import bracket_indices
+from .util.unit_conversion import a3_to_b3, b3_to_a3, gpa_to_ry_b3, ry_b3_to_gpa, ry_to_ev, ry_to_j_mol
+
+# ===================== What can be exported? =====================
+__all__ = ['PROPERTIES', 'ThermodynamicModel']
+
+# The properties a query returns, in the order of the rows of ``_evaluate_points``, with their output units
+PROPERTIES = {
+    'v': 'A^3',
+    'p': 'GPa',
+    'f': 'eV',
+    's': 'eV/K',
+    'u': 'eV',
+    'h': 'eV',
+    'g': 'eV',
+    'alpha': '1/K',
+    'bt': 'GPa',
+    'btp': '1',
+    'gamma': '1',
+    'bs': 'GPa',
+    'cv': 'J/mol/K',
+    'cp': 'J/mol/K',
+}
+# The conversion of each property from atomic units to its output units
+_CONVERSIONS = {
+    'v': b3_to_a3, 'p': ry_b3_to_gpa, 'f': ry_to_ev, 's': ry_to_ev, 'u': ry_to_ev, 'h': ry_to_ev, 'g': ry_to_ev,
+    'bt': ry_b3_to_gpa, 'bs': ry_b3_to_gpa, 'cv': ry_to_j_mol, 'cp': ry_to_j_mol,
+}
+# The number of strain intervals scanned for a sign change of :math:`P - P_0` before refining the root
+_SCAN_INTERVALS = 16
+
+
+class ThermodynamicModel:
+    """
+    The fitted free energy :math:`F(T, V)`, i.e., at each temperature of the continuous grid,
+    the polynomial of the Eulerian strain fitted by ``Interpolation``.
+
+    A point :math:`(T, V)` is evaluated by interpolating the coefficients of the two neighbouring temperatures
+    linearly, and then differentiating the polynomial analytically in the strain. A point :math:`(T, P)` is first
+    converted to :math:`(T, V)` by finding the root of the fitted :math:`P(V) - P`. The temperature derivatives
+    are taken on the coefficients with the same finite differences as ``ThermodynamicProperties``.
+    Only the rows of the two neighbouring temperatures are read for each point.
+
+    Points outside of the temperature range or of the volume range of the grid give ``nan``.
+    The results of the last *cache_size* batches are kept in an LRU cache, so that repeating a batch is a lookup.
+
+    :param temperature: The continuous temperatures, in K.
+    :param strain_polynomial: The ``StrainPolynomial`` of :math:`F(T, V)` on *temperature*, in atomic units.
+    :param volumes: The volumes of the grid, in :math:`\\text{bohr}^3`, whose range bounds the queries.
+    :param cache_size: The number of batches kept in the LRU cache.
+    """
+
+    def __init__(self, temperature, strain_polynomial, volumes, cache_size: int = 128):
+        self.temperature = np.ascontiguousarray(temperature, dtype=float)
+        self.coefficients = np.asarray(strain_polynomial.coefficients, dtype=float)
+        self.v0 = float(strain_polynomial.v0)
+        strains = calculate_eulerian_strain(self.v0, np.asarray(volumes, dtype=float))
+        self.strain_range = float(np.min(strains)), float(np.max(strains))
+        # F, S = -dF/dT and C_V = dU/dT are all linear in the coefficients, so are their polynomials
+        s = -calculate_derivatives(self.temperature, self.coefficients.T).T
+        cv = calculate_derivatives(self.temperature, (self.coefficients + self.temperature * s).T).T
+        # One contiguous row of (3, order + 1) per temperature
+        self._rows = np.ascontiguousarray(np.stack((self.coefficients, s, cv)).transpose(2, 0, 1))
+        self._cached = functools.lru_cache(maxsize=cache_size)(self._evaluate_bytes)
+
+    @classmethod
+    def from_settings(cls, user_settings, cache_size: int = 128):
+        """
+        Fit the model of a calculation.
+
+        :param user_settings: A ``Settings``, or the name of its yaml file.
+        :param cache_size: The number of batches kept in the LRU cache.
+        :return: The ``ThermodynamicModel`` of the calculation.
+        """
+        if not isinstance(user_settings, Settings):
+            file_settings, user_settings = user_settings, Settings(DEFAULT_SETTINGS)
+            user_settings.read_from_yaml(file_settings)
+        calc = FreeEnergyCalculation(user_settings)
+        strain_polynomial, volumes = calc.evaluate('strain_polynomial', 'volumes')
+        return cls(calc.continuous_temperature, strain_polynomial, volumes, cache_size)
+
+    @classmethod
+    def load(cls, filename: str, cache_size: int = 128):
+        """
+        Load a model saved by ``save``.
+
+        :param filename: The ``.npz`` file.
+        :param cache_size: The number of batches kept in the LRU cache.
+        :return: The ``ThermodynamicModel``.
+        """
+        with np.load(filename) as data:
+            strain_polynomial = StrainPolynomial(data['coefficients'], float(data['v0']))
+            # The volumes of the grid are not saved, only the ends of their range
+            volumes = from_eulerian_strain(strain_polynomial.v0, data['strain_range'])
+            return cls(data['temperature'], strain_polynomial, volumes, cache_size)
+
+    def save(self, filename: str):
+        """
+        Save the model to a ``.npz`` file, to be read by ``load``.
+        """
+        np.savez(filename, temperature=self.temperature, coefficients=self.coefficients, v0=self.v0,
+                 strain_range=np.array(self.strain_range))
+
+    def at_pressures(self, temperatures, pressures, *names):
+        """
+        Evaluate properties at :math:`(T, P)` points.
+
+        :param temperatures: The temperatures of the points, in K.
+        :param pressures: The pressures of the points, in GPa, broadcast against *temperatures*.
+        :param names: The properties wanted, any key of ``PROPERTIES``, all of them if not given.
+        :return: A dictionary of the properties, each an array of the broadcast shape, in the units of ``PROPERTIES``.
+        """
+        return self._query(True, temperatures, gpa_to_ry_b3(np.asarray(pressures, dtype=float)), names)
+
+    def at_volumes(self, temperatures, volumes, *names):
+        """
+        Evaluate properties at :math:`(T, V)` points.
+
+        :param temperatures: The temperatures of the points, in K.
+        :param volumes: The volumes of the points, in :math:`\\unicode{x212B}^3`, broadcast against *temperatures*.
+        :param names: The properties wanted, any key of ``PROPERTIES``, all of them if not given.
+        :return: A dictionary of the properties, each an array of the broadcast shape, in the units of ``PROPERTIES``.
+        """
+        return self._query(False, temperatures, a3_to_b3(np.asarray(volumes, dtype=float)), names)
+
+    def isentropes(self, temperatures, pressures, *names, substeps: int = 1):
+        """
+        Trace the isentropes starting at (*temperatures*, ``pressures[0]``) along *pressures*,
+        by integrating
+
+        .. math::
+
+           \\bigg( \\frac{ \\partial T }{ \\partial P } \\bigg)_S = \\frac{ \\gamma T }{ B_S }
+           = \\frac{ \\alpha V T }{ C_P }
+
+        with the classical Runge-Kutta method, all the starting points at once. The properties along the isentropes
+        are evaluated at the points of the path, not snapped to the grid. An isentrope leaving the range of
+        the model gives ``nan`` from there on.
+
+        :param temperatures: The temperatures of the starting points, in K.
+        :param pressures: The pressures along the paths, in GPa, increasing or decreasing.
+        :param names: The properties wanted, any key of ``PROPERTIES``, all of them if not given.
+        :param substeps: The number of Runge-Kutta steps between two consecutive *pressures*.
+        :return: A dictionary of the temperatures ``'t'`` and the properties along the paths,
+            each with shape (number of starting points, number of pressures).
+        """
+        t = np.atleast_1d(np.asarray(temperatures, dtype=float))
+        pressures = np.asarray(pressures, dtype=float)
+        path = np.empty(t.shape + pressures.shape)
+        path[:, 0] = t
+
+        def slope(t, p):
+            gamma, bs = self._query(True, t, gpa_to_ry_b3(np.full_like(t, p)), ('gamma', 'bs'), cache=False).values()
+            return gamma * t / bs
+
+        for k in range(1, len(pressures)):
+            h = (pressures[k] - pressures[k - 1]) / substeps
+            for step in range(substeps):
+                p = pressures[k - 1] + step * h
+                k1 = slope(t, p)
+                k2 = slope(t + h / 2 * k1, p + h / 2)
+                k3 = slope(t + h / 2 * k2, p + h / 2)
+                k4 = slope(t + h * k3, p + h)
+                t = t + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+            path[:, k] = t
+        results = self._query(True, path, gpa_to_ry_b3(np.broadcast_to(pressures, path.shape)), names, cache=False)
+        return {'t': path, **results}
+
+    def geotherms(self, node_pressures, node_temperatures, pressures, *names):
+        """
+        Evaluate properties along geotherms :math:`T(P)`, given at a few nodes and interpolated linearly
+        between them to *pressures*.
+
+        :param node_pressures: The pressures of the nodes, in GPa, increasing.
+        :param node_temperatures: The temperatures of the nodes, in K, with shape (number of nodes,)
+            for one geotherm, or (number of geotherms, number of nodes) for many.
+        :param pressures: The pressures along the paths, in GPa. Those outside of the nodes give ``nan``.
+        :param names: The properties wanted, any key of ``PROPERTIES``, all of them if not given.
+        :return: A dictionary of the temperatures ``'t'`` and the properties along the paths,
+            each with shape (number of geotherms, number of pressures).
+        """
+        node_pressures = np.asarray(node_pressures, dtype=float)
+        node_temperatures = np.atleast_2d(np.asarray(node_temperatures, dtype=float))
+        pressures = np.asarray(pressures, dtype=float)
+        j = bracket_indices(node_pressures, pressures)
+        weights = (pressures - node_pressures[j]) / (node_pressures[j + 1] - node_pressures[j])
+        weights[(pressures < node_pressures[0]) | (pressures > node_pressures[-1])] = np.nan
+        path = (1 - weights) * node_temperatures[:, j] + weights * node_temperatures[:, j + 1]
+        results = self._query(True, path, gpa_to_ry_b3(np.broadcast_to(pressures, path.shape)), names)
+        return {'t': path, **results}
+
+    def cache_info(self):
+        """
+        :return: The statistics of the LRU cache, as ``functools.lru_cache`` gives.
+        """
+        return self._cached.cache_info()
+
+    def cache_clear(self):
+        self._cached.cache_clear()
+
+    def _query(self, by_pressure, temperatures, xs, names, cache=True):
+        for name in names:
+            if name not in PROPERTIES:
+                raise KeyError("Unknown property '{0}', should be one of {1}!".format(name, list(PROPERTIES)))
+        ts, xs = np.broadcast_arrays(np.asarray(temperatures, dtype=float), xs)
+        ts, xs = np.ascontiguousarray(ts), np.ascontiguousarray(xs)
+        if cache:
+            results = self._cached(by_pressure, ts.shape, ts.tobytes(), xs.tobytes())
+        else:  # The intermediate points of a path are never asked again
+            results = self._evaluate(by_pressure, ts, xs)
+        return {name: results[list(PROPERTIES).index(name)] for name in (names or PROPERTIES)}
+
+    def _evaluate_bytes(self, by_pressure, shape, ts, xs):
+        results = self._evaluate(by_pressure, np.frombuffer(ts).reshape(shape), np.frombuffer(xs).reshape(shape))
+        for result in results:
+            result.flags.writeable = False  # Shared by every hit of the cache
+        return results
+
+    def _evaluate(self, by_pressure, ts, xs):
+        raw = _evaluate_points(self.temperature, self._rows, self.v0, self.strain_range[0], self.strain_range[1],
+                               ts.ravel(), xs.ravel(), by_pressure)
+        return tuple(_CONVERSIONS.get(name, lambda x: x)(row).reshape(ts.shape) for name, row in zip(PROPERTIES, raw))
+
+
+@jit(nopython=True, cache=True)
+def _strain_polynomial(c, f):
+    """
+    Evaluate the polynomial of the coefficients *c* (lowest order first) and its first three derivatives at *f*.
+    """
+    p0, p1, p2, p3 = 0.0, 0.0, 0.0, 0.0
+    for k in range(c.shape[0] - 1, -1, -1):
+        p3 = p3 * f + 3 * p2
+        p2 = p2 * f + 2 * p1
+        p1 = p1 * f + p0
+        p0 = p0 * f + c[k]
+    return p0, p1, p2, p3
+
+
+@jit(nopython=True, cache=True)
+def _pressure_of_strain(c, v0, f):
+    """
+    :return: :math:`P` and :math:`dP / df` at the strain *f*, where :math:`P = (2 f + 1)^{5/2} F_f / (3 V_0)`.
+    """
+    _, f_f, f_ff, _ = _strain_polynomial(c, f)
+    u = 2 * f + 1
+    return u ** 2.5 * f_f / (3 * v0), (5 * u ** 1.5 * f_f + u ** 2.5 * f_ff) / (3 * v0)
+
+
+@jit(nopython=True, cache=True)
+def _solve_strain(c, v0, p, f_lower, f_upper):
+    """
+    Find the strain in [*f_lower*, *f_upper*] where the pressure is *p*: the first interval of a uniform scan
+    where :math:`P - p` changes sign is refined by Newton's method, falling back to bisection
+    whenever a step leaves the interval. Return ``nan`` if there is no sign change.
+    """
+    step = (f_upper - f_lower) / _SCAN_INTERVALS
+    a = f_lower
+    ga = _pressure_of_strain(c, v0, a)[0] - p
+    if ga == 0:
+        return a
+    b, gb = a, ga
+    for i in range(1, _SCAN_INTERVALS + 1):
+        b = f_lower + i * step
+        gb = _pressure_of_strain(c, v0, b)[0] - p
+        if ga * gb <= 0:
+            break
+        a, ga = b, gb
+    if ga * gb > 0:
+        return np.nan
+    f = 0.5 * (a + b)
+    for _ in range(100):
+        g, dg = _pressure_of_strain(c, v0, f)
+        g -= p
+        if g == 0:
+            return f
+        if (g < 0) == (ga < 0):
+            a = f
+        else:
+            b = f
+        f_new = f - g / dg if dg != 0 else 0.5 * (a + b)
+        if not a < f_new < b:
+            f_new = 0.5 * (a + b)
+        if abs(f_new - f) <= 1e-15 * (1 + abs(f)):
+            return f_new
+        f = f_new
+    return f
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _evaluate_points(temperature, rows, v0, f_lower, f_upper, ts, xs, by_pressure):
+    """
+    Evaluate all the properties of ``PROPERTIES`` at the points (*ts*, *xs*) in atomic units, where *xs* are
+    the pressures if *by_pressure*, otherwise the volumes.
+    """
+    n = ts.shape[0]
+    nt = temperature.shape[0]
+    out = np.full((14, n), np.nan)
+    for i in prange(n):
+        t = ts[i]
+        if not temperature[0] <= t <= temperature[nt - 1]:
+            continue
+        j = min(max(np.searchsorted(temperature, t) - 1, 0), nt - 2)
+        w = (t - temperature[j]) / (temperature[j + 1] - temperature[j])
+        c = (1 - w) * rows[j] + w * rows[j + 1]
+        if by_pressure:
+            f = _solve_strain(c[0], v0, xs[i], f_lower, f_upper)
+        else:
+            f = 0.5 * ((v0 / xs[i]) ** (2 / 3) - 1)
+        # Volumes at the ends of the grid may come back slightly outside of it from the unit conversions
+        if not f_lower - 1e-12 <= f <= f_upper + 1e-12:
+            continue
+        u = 2 * f + 1
+        v = v0 * u ** -1.5
+        e, e_f, e_ff, e_fff = _strain_polynomial(c[0], f)
+        s, s_f, _, _ = _strain_polynomial(c[1], f)
+        cv = _strain_polynomial(c[2], f)[0]
+        p = u * e_f / (3 * v)
+        bt = (u ** 2 * e_ff + 5 * u * e_f) / (9 * v)
+        btp = (u ** 2 * e_fff + 12 * u * e_ff + 25 * e_f) / (3 * (u * e_ff + 5 * e_f))
+        dp_dt = -u * s_f / (3 * v)  # (dP/dT)_V = -d(dF/dT)/dV = dS/dV
+        alpha = dp_dt / bt
+        gamma = dp_dt * v / cv if cv != 0 else 0.0
+        out[0, i] = v
+        out[1, i] = p
+        out[2, i] = e
+        out[3, i] = s
+        out[4, i] = e + t * s
+        out[5, i] = e + t * s + p * v
+        out[6, i] = e + p * v
+        out[7, i] = alpha
+        out[8, i] = bt
+        out[9, i] = btp
+        out[10, i] = gamma
+        out[11, i] = bt * (1 + alpha * gamma * t)
+        out[12, i] = cv
+        out[13, i] = cv * (1 + alpha * gamma * t)
+    return out
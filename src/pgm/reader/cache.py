@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+.. module cache
+   :platform: Unix, Windows, Mac, Linux
+   :synopsis: A content-addressed binary cache of parsed input files, so that a file is parsed only once
+    and later runs load it with ``numpy.load(mmap_mode='r')``.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+# ===================== What can be exported? =====================
+__all__ = ['CACHE_FORMAT_VERSION', 'InputCache', 'user_cache_directory']
+
+# The version of the stored entries, to be increased whenever the parser or the layout of the stored arrays changes,
+# so that the entries of an older version are never loaded
+CACHE_FORMAT_VERSION = 1
+
+# The names of the arrays returned by ``read_input``, after the number of formula units
+_ARRAYS = ('volumes', 'static_energies', 'frequencies', 'q_weights', 'electronic_entropy')
+# The name of the default cache directory, created next to each input file
+_DEFAULT_DIRECTORY = '.pgm_cache'
+
+
+def user_cache_directory() -> str:
+    """
+    :return: The cache directory of the user, used when the directory of an input file is not writable,
+        i.e., ``$XDG_CACHE_HOME/pgm`` (``~/.cache/pgm`` by default), or ``%LOCALAPPDATA%\\pgm`` on Windows.
+    """
+    if os.name == 'nt' and os.environ.get('LOCALAPPDATA'):
+        return os.path.join(os.environ['LOCALAPPDATA'], 'pgm')
+    return os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser(os.path.join('~', '.cache')), 'pgm')
+
+
+class InputCache:
+    """
+    A binary cache of the results of ``read_input``.
+
+    Each parsed file is stored in a directory named by the hash of its content, of ``CACHE_FORMAT_VERSION``
+    and of the parser, one ``.npy`` file per array. The dtype of every array is recorded, an entry whose arrays
+    do not match it is parsed again.
+    A small index, keyed by the absolute path of the input file, remembers its size, modification time
+    and content hash. If the size and the modification time are unchanged, the content is not hashed again.
+    If they changed but the content did not (e.g., the file was touched or copied), the stored arrays are reused.
+    If the cache cannot be written, e.g., the directory is read-only, the file is parsed as if there was no cache.
+
+    :param directory: The cache directory, by default a ``.pgm_cache`` directory next to each input file,
+        or ``user_cache_directory()`` if that directory is not writable.
+    :param parser: The function parsing an input file, by default ``fast_read_input``.
+    """
+
+    def __init__(self, directory=None, parser=None):
+        self.directory = directory
+        self.parser = parser
+
+    def cache_directory(self, path) -> str:
+        """
+        :return: The cache directory used for the input file *path*.
+        """
+        if self.directory is not None:
+            return os.path.abspath(self.directory)
+        parent = os.path.dirname(os.path.abspath(path))
+        directory = os.path.join(parent, _DEFAULT_DIRECTORY)
+        if os.path.isdir(directory) and os.access(directory, os.W_OK) or os.access(parent, os.W_OK):
+            return directory
+        return user_cache_directory()
+
+    def read(self, path):
+        """
+        Read an input file through the cache.
+
+        :param path: The input file.
+        :return: The same as ``read_input``, with read-only memory-mapped arrays if it is loaded from the cache.
+        """
+        path = os.path.abspath(path)
+        directory = self.cache_directory(path)
+        stat = os.stat(path)
+        index_file = os.path.join(directory, 'index', hashlib.sha256(path.encode()).hexdigest() + '.json')
+        index = _read_json(index_file)
+        if index is not None and index['size'] == stat.st_size and index['mtime_ns'] == stat.st_mtime_ns:
+            digest = index['digest']
+        else:
+            digest = _file_digest(path)
+
+        entry = os.path.join(directory, self._entry_name(digest))
+        result = _load_entry(entry)
+        if result is None:
+            result = self._parse(path)
+            # An entry which cannot be loaded, e.g., with arrays of another dtype, is replaced
+            shutil.rmtree(entry, ignore_errors=True)
+            try:
+                _write_entry(entry, result)
+            except OSError:
+                return result
+        new_index = {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'digest': digest}
+        if index != new_index:
+            try:
+                _write_json(index_file, new_index)
+            except OSError:
+                pass
+        return result
+
+    def clear(self, paths):
+        """
+        Remove the cache entries and the index from the cache directories used by the input files *paths*.
+        Only what the cache wrote is removed, the directories themselves and any other file in them are kept.
+
+        :param paths: The input files.
+        """
+        for directory in {self.cache_directory(path) for path in paths}:
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in names:
+                if name == 'index' or _is_entry_name(name):
+                    shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+    def _entry_name(self, digest: str) -> str:
+        # Entries of another format version or of another parser never share a name
+        parser = 'fast_read_input' if self.parser is None else \
+            '{0}.{1}'.format(self.parser.__module__, self.parser.__qualname__)
+        h = hashlib.blake2b('{0}:{1}:{2}'.format(digest, CACHE_FORMAT_VERSION, parser).encode(), digest_size=20)
+        return h.hexdigest()
+
+    def _parse(self, path):
+        if self.parser is not None:
+            return self.parser(path)
+        from .read_input import fast_read_input
+        return fast_read_input(path)
+
+
+def _is_entry_name(name: str) -> bool:
+    # The names given by ``InputCache._entry_name``, i.e., 40 lowercase hexadecimal digits
+    return len(name) == 40 and all(c in '0123456789abcdef' for c in name)
+
+
+def _file_digest(path) -> str:
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _read_json(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(filename, content):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(content, f)
+    os.replace(tmp, filename)
+
+
+def _load_entry(entry):
+    meta = _read_json(os.path.join(entry, 'meta.json'))
+    if meta is None or meta.get('format') != CACHE_FORMAT_VERSION:
+        return None
+    try:
+        arrays = [np.load(os.path.join(entry, name + '.npy'), mmap_mode='r') for name in _ARRAYS]
+    except (OSError, ValueError):
+        return None
+    if [array.dtype.str for array in arrays] != meta.get('dtypes'):
+        return None
+    return (meta['formula_unit_number'], *arrays)
+
+
+def _write_entry(entry, result):
+    # Written to a temporary directory first, so that a concurrent reader never sees a partial entry
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=os.path.dirname(entry), suffix='.tmp')
+    try:
+        arrays = [np.asarray(array) for array in result[1:]]
+        for name, array in zip(_ARRAYS, arrays):
+            np.save(os.path.join(tmp, name + '.npy'), array)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'formula_unit_number': int(result[0]), 'format': CACHE_FORMAT_VERSION,
+                       'dtypes': [array.dtype.str for array in arrays]}, f)
+        os.replace(tmp, entry)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        if not os.path.isdir(entry):  # Another process may have written the same entry first.
+            raise
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
+import multiprocessing
 import pathlib
 import re
+import warnings
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import closing
 from typing import Iterator, Union, Tuple
 
 import numpy as np
@@ -10,7 +14,7 @@ from text_stream import TextStream
 from pgm.util.tools import is_monotonic_decreasing
 
 # ===================== What can be exported? =====================
-__all__ = ['Input', 'read_input']
+__all__ = ['Input', 'read_input', 'fast_read_input', 'read_inputs', 'check_consistency']
 
 
 class Input:
@@ -26,24 +30,42 @@ class Input:
     input_dict[temp][3], which is very confusing.
     """
 
-    def __init__(self, path_to_dir, discrete_temperature):
+    def __init__(self, path_to_dir, discrete_temperature, dtype=float, workers=1, cache=None,
+                 frequency_store=None):
         # TODO:add path checker
         self.input_path = [path_to_dir % str(x) for x in discrete_temperature]
         self.__temperatures = discrete_temperature
         rs = {}
+        # The files are parsed concurrently if *workers* > 1, and checked against each other as they arrive.
+        # The frequencies of each file are copied into the 4D array right away, so that only one parsed copy
+        # is alive at a time.
+        first = None
+        frequencies = None
+        with closing(read_inputs(self.input_path, workers, cache)) as results:  # Stop the pool on the first mismatch
+            for i, result in results:
+                if first is None:
+                    first = i
+                    frequencies = _allocate_frequencies((len(discrete_temperature),) + result[3].shape, dtype,
+                                                        frequency_store)
+                else:
+                    check_consistency(self.input_path[first], rs[discrete_temperature[first]], self.input_path[i],
+                                      result)
+                frequencies[i] = result[3]
+                rs[discrete_temperature[i]] = result[:3] + (frequencies[i],) + result[4:]
+        if frequency_store is not None:
+            # Written once, then only read back page by page
+            frequencies.flush()
+            frequencies = np.load(frequency_store, mmap_mode='r')
+            rs = {temp: rs[temp][:3] + (frequencies[i],) + rs[temp][4:] for i, temp in enumerate(discrete_temperature)}
         number_of_formula_unit = []
         all_volumes = []
         static_energy = []
-        frequencies = []
         weights = []
         all_electronic_entropy = []
         for temp in discrete_temperature:
-            path = path_to_dir % str(temp)
-            rs[temp] = read_input(path)
             number_of_formula_unit.append(rs[temp][0])
             all_volumes.append(rs[temp][1])
             static_energy.append(rs[temp][2])
-            frequencies.append(rs[temp][3])
             weights.append(rs[temp][4])
             all_electronic_entropy.append(rs[temp][5])
 
@@ -52,8 +74,9 @@ class Input:
         self.number_of_formula_unit = numpy.array(number_of_formula_unit)
         self.volumes = numpy.array(all_volumes[0])
         self.static_energy = numpy.array(static_energy[0])
-        # A 4D array with shape of (# of temp, # of volumes, # of q points, # of modes)
-        self.frequencies = numpy.array(frequencies)
+        # A 4D array with shape of (# of temp, # of volumes, # of q points, # of modes), stored in *dtype*,
+        # a read-only ``numpy.memmap`` of *frequency_store* if it is given
+        self.frequencies = frequencies
         self.weights = numpy.array(weights)
         self.electronic_entropy = numpy.array(all_electronic_entropy)
 
@@ -64,6 +87,61 @@ class Input:
         return self.__temperatures
 
 
+def _allocate_frequencies(shape, dtype, frequency_store=None):
+    """
+    Allocate the 4D array of frequencies, in memory, or in the ``.npy`` file *frequency_store* if it is given,
+    which is then memory-mapped so that the array does not need to fit in the memory.
+    """
+    if frequency_store is None:
+        return np.empty(shape, dtype=dtype)
+    return np.lib.format.open_memmap(frequency_store, mode='w+', dtype=dtype, shape=shape)
+
+
+def read_inputs(paths, workers: int = 1, cache=None):
+    """
+    Read several input files, concurrently in a process pool if *workers* is larger than 1.
+
+    :param paths: The filenames or their paths.
+    :param workers: The number of processes.
+    :param cache: An ``InputCache`` the files are read through, or ``None`` to always parse them.
+    :return: A generator of ``(index, result)`` in the order the files finish, where *index* is the position
+        of the file in *paths* and *result* is what ``read_input`` returns, parsed by ``fast_read_input``.
+        If the consumer stops early, e.g., by raising an error, the files not yet started are cancelled.
+    """
+    reader = fast_read_input if cache is None else cache.read
+    if workers <= 1 or len(paths) < 2:
+        for i, path in enumerate(paths):
+            yield i, reader(path)
+        return
+
+    executor = ProcessPoolExecutor(max_workers=min(workers, len(paths)),
+                                   mp_context=multiprocessing.get_context('spawn'))
+    try:
+        futures = {executor.submit(reader, path): i for i, path in enumerate(paths)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def check_consistency(reference_path, reference, path, result, rtol: float = 1e-4):
+    """
+    Check that two results of ``read_input`` have the same header (nv, nq, nm) and the same volumes.
+
+    :param reference_path: The path of the *reference* file, for the error message.
+    :param reference: The result of ``read_input`` the other one is checked against.
+    :param path: The path of the *result* file, for the error message.
+    :param result: The result of ``read_input`` to be checked.
+    :param rtol: The relative tolerance of the volumes, which are usually printed with a few decimals only.
+    """
+    if result[3].shape != reference[3].shape:
+        raise ValueError("The (nv, nq, nm) of file {0} is {1}, but it is {2} in file {3}!".format(
+            path, result[3].shape, reference[3].shape, reference_path))
+    if not np.allclose(result[1], reference[1], rtol=rtol, atol=0):
+        raise ValueError("The volumes of file {0} are different from the ones in file {1}!".format(
+            path, reference_path))
+
+
 def read_input(inp: Union[str, pathlib.PurePath]):
     """
     Read the standard "input" file for ``qha``.
@@ -172,3 +250,102 @@ def read_input(inp: Union[str, pathlib.PurePath]):
         raise ValueError('The volumes in the input file is not monotonicly decreasing, please check your input file')
 
     return formula_unit_number, volumes, static_energies, frequencies, q_weights, electronic_entropy
+
+
+def _to_floats(text: str, expected: int, what: str, inp) -> np.ndarray:
+    """
+    Convert the whitespace-separated numbers in *text* in one call, and check that there are *expected* of them.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', DeprecationWarning)  # Raised by ``numpy.fromstring`` on unparsable data
+        try:
+            values = np.fromstring(text, sep=' ')
+        except DeprecationWarning:
+            raise ValueError("Unparsable {0} in file {1}!".format(what, inp)) from None
+    if values.size != expected:
+        raise ValueError("Expected {0} numbers in the {1} of file {2}, found {3}!".format(
+            expected, what, inp, values.size))
+    return values
+
+
+def fast_read_input(inp: Union[str, pathlib.PurePath]):
+    """
+    Read the standard "input" file for ``qha``, like ``read_input`` and with exactly the same output,
+    but in bulk: the boundaries of the blocks are found once by searching the whole text, then each block
+    of frequencies is converted to floats in one call, instead of line by line.
+
+    Each q-point line must have 3 numbers, and each weight line must have the same number of columns.
+
+    :param inp: The filename or its path.
+    :return: The same as ``read_input``.
+    """
+    with open(inp) as f:
+        text = f.read()
+
+    # The metadata is the first line, which is not empty nor a comment, matching the pattern of 4 integers.
+    regex0 = re.compile(r"\s*(\d+)[\s,]*(\d+)[\s,]*(\d+)[\s,]*(\d+)")
+    match = None
+    for line in re.finditer(r'^.*$', text, re.MULTILINE):
+        if not line.group().strip() or line.group().startswith('#'):
+            continue
+        match = regex0.search(line.group())
+        if match is not None:
+            break
+    if match is None:
+        raise ValueError("At least one of the desired values 'nv', 'nq', 'np' is not found in file {0}!".format(inp))
+    volumes_amount, q_points_amount, modes_per_q_point_amount, formula_unit_number = strings_to_integers(
+        match.groups())
+    offset = line.end()
+
+    # Each volume starts at a line containing "=", found by searching the character itself rather than every line.
+    volume_lines = []  # The start and the end of each of these lines
+    position = text.find('=', offset)
+    while position != -1:
+        start, end = text.rfind('\n', 0, position) + 1, text.find('\n', position)
+        end = len(text) if end == -1 else end
+        volume_lines.append((start, end))
+        position = text.find('=', end)
+    if len(volume_lines) != volumes_amount:
+        raise ValueError('The number of volumes detected is not equal to what specified in head! Check your file!')
+
+    # The weights start at the line containing "weight" after the last volume.
+    tail = volume_lines[-1][1]
+    weight_start = text[tail:].lower().find('weight')
+    if weight_start == -1:
+        body_end = weights_start = len(text)
+    else:
+        body_end = text.rfind('\n', 0, tail + weight_start) + 1
+        weights_start = text.find('\n', tail + weight_start)
+        weights_start = len(text) if weights_start == -1 else weights_start
+
+    regex1 = re.compile(r"P\s*=\s*-?\d*\.?\d*\s*V\s*=(\s*\d*\.?\d*)\s*E\s*=\s*(-?\d*\.?\d*)\s*S_el\s*=\s*(-?\d*\.?\d*)",
+                        re.IGNORECASE)
+
+    volumes = np.empty(volumes_amount, dtype=float)
+    static_energies = np.empty(volumes_amount, dtype=float)
+    electronic_entropy = np.empty(volumes_amount, dtype=float)
+    frequencies = np.empty((volumes_amount, q_points_amount, modes_per_q_point_amount), dtype=float)
+
+    # Each q-point has a line of its 3 coordinates, followed by one line per mode.
+    numbers_per_q_point = 3 + modes_per_q_point_amount
+    ends = [start for start, _ in volume_lines[1:]] + [body_end]
+    for i, ((start, line_end), end) in enumerate(zip(volume_lines, ends)):
+        line = text[start:line_end]
+        match = regex1.search(line)
+        if match is None:
+            raise ValueError("Search of pattern {0} failed in line '{1}!".format(regex1.pattern, line))
+        volumes[i], static_energies[i], electronic_entropy[i] = match.groups()
+        block = _to_floats(text[line_end:end], q_points_amount * numbers_per_q_point,
+                           'frequencies of volume {0}'.format(i + 1), inp)
+        frequencies[i] = block.reshape(q_points_amount, numbers_per_q_point)[:, 3:]
+
+    # This line has format: q_x q_y q_z weight, and only weight is taken
+    weights_text = text[weights_start:]
+    weight_columns = len(weights_text.lstrip().split('\n', 1)[0].split()) or 1  # The columns of the first line
+    q_weights = _to_floats(weights_text, q_points_amount * weight_columns, 'q-point weights', inp)
+    q_weights = q_weights.reshape(q_points_amount, weight_columns)[:, -1].copy()
+
+    if not is_monotonic_decreasing(volumes):
+        raise ValueError('The volumes in the input file is not monotonicly decreasing, please check your input file')
+
+    return formula_unit_number, volumes, static_energies, frequencies, q_weights, electronic_entropy
@@ -26,6 +26,18 @@ DEFAULT_SETTINGS: Dict[str, Any] = {
     'ratio': 1.2,
     'temperature': [1500, 2000, 2500, 3000, 3500, 4000],
     'output_directory': './results/',
+    'chunk_size': 16,
+    'workers': 1,
+    'precision': 'float64',
+    'cache': True,
+    'cache_directory': None,
+    'frequency_store': None,
+    'volume_derivatives': 'numerical',
+    'temperature_grid': 'uniform',
+    'block_size': None,
+    'stack_interpolations': False,
+    'integration': 'trapezoid',
+    'temperature_derivatives': 'numerical',
     'pressure': True,
     'entropy': False,
     'internal_energy': False,
@@ -36,7 +48,8 @@ DEFAULT_SETTINGS: Dict[str, Any] = {
     'gruneisen_parameter': False,
     'adiabatic_bulk_modulus': False,
     'volumetric_heat_capacity': False,
-    'isobaric_heat_capacity': False
+    'isobaric_heat_capacity': False,
+    'bulk_modulus_derivative': False
 }
 
 
@@ -53,6 +66,18 @@ class Settings:
         self.ratio = dic['ratio']
         self.temperature = dic['temperature']
         self.output_directory = dic['output_directory']
+        self.chunk_size = dic['chunk_size']
+        self.workers = dic['workers']
+        self.precision = dic['precision']
+        self.cache = dic['cache']
+        self.cache_directory = dic['cache_directory']
+        self.frequency_store = dic['frequency_store']
+        self.volume_derivatives = dic['volume_derivatives']
+        self.temperature_grid = dic['temperature_grid']
+        self.block_size = dic['block_size']
+        self.stack_interpolations = dic['stack_interpolations']
+        self.integration = dic['integration']
+        self.temperature_derivatives = dic['temperature_derivatives']
         self.continuous_temperature = np.linspace(self.temperature[0], self.temperature[-1], self.NT)
         self.desired_pressure = np.linspace(self.initP, self.finalP, self.NV)
         self.ptv = False
@@ -66,6 +91,11 @@ class Settings:
         self.bs_tp = False
         self.cv_tp = False
         self.cp_tp = False
+        self.btp_tp = False
+
+    @property
+    def input_paths(self):
+        return [self.folder % str(x) for x in self.temperature]
 
     def read_from_yaml(self, filename: str):
         if not filename.endswith('.yaml'):
@@ -81,6 +111,19 @@ class Settings:
             self.ratio = dic['ratio']
             self.temperature = dic['temperature'] # Notice this is a list
             self.output_directory = dic['output_directory']
+            # Optional settings, keep the defaults if not given
+            self.chunk_size = dic.get('chunk_size', self.chunk_size)
+            self.workers = dic.get('workers', self.workers)
+            self.precision = dic.get('precision', self.precision)
+            self.cache = dic.get('cache', self.cache)
+            self.cache_directory = dic.get('cache_directory', self.cache_directory)
+            self.frequency_store = dic.get('frequency_store', self.frequency_store)
+            self.volume_derivatives = dic.get('volume_derivatives', self.volume_derivatives)
+            self.temperature_grid = dic.get('temperature_grid', self.temperature_grid)
+            self.block_size = dic.get('block_size', self.block_size)
+            self.stack_interpolations = dic.get('stack_interpolations', self.stack_interpolations)
+            self.integration = dic.get('integration', self.integration)
+            self.temperature_derivatives = dic.get('temperature_derivatives', self.temperature_derivatives)
             self.continuous_temperature = np.linspace(self.temperature[0], self.temperature[-1], self.NT)
             self.desired_pressure = np.linspace(self.initP, self.finalP, self.NV)
 
@@ -95,3 +138,4 @@ class Settings:
             self.bs_tp = dic['adiabatic_bulk_modulus']
             self.cv_tp = dic['volumetric_heat_capacity']
             self.cp_tp = dic['isobaric_heat_capacity']
+            self.btp_tp = dic.get('bulk_modulus_derivative', self.btp_tp)
@@ -1,7 +1,8 @@
 from lazy_property import LazyProperty
-from .v2p import v2p
+from .v2p import V2PPlan
 from .util.unit_conversion import *
-from .util.tools import find_value
+from .util.tools import bracket_indices, interpolate_in_rows
+from .util.stage_graph import StageGraph
 import numpy as np
 
 
@@ -16,9 +17,16 @@ def calculate_derivatives(xs, fs):
     if xs.ndim > 1 or fs.ndim < 2:
         raise ValueError('The argument *xs* should be a 1D array and *ys* should be a 2D array!')
 
+    if not _is_uniform(xs):  # Second-order central differences for any spacing, e.g., an adaptive grid
+        return np.gradient(fs, xs, axis=0)
     return np.gradient(fs, axis=0) / np.gradient(xs)[:, None]  # df(x)/dx.
 
 
+def _is_uniform(xs) -> bool:
+    steps = np.diff(xs)
+    return len(xs) < 3 or np.allclose(steps, steps.mean(), rtol=1e-8, atol=0)
+
+
 def pressure(vs, free_energies):
     """
     Calculate the pressure as a function of temperature and volume, i.e.,
@@ -49,7 +57,7 @@ def entropy(temperature, free_energies):
     return -calculate_derivatives(temperature, free_energies)
 
 
-def thermodynamic_potentials(temperature, vs, free_energies, ps):
+def thermodynamic_potentials(temperature, vs, free_energies, ps, entropies=None):
     """
     Calculate the enthalpy :math:`H(T, V)`, the internal energy :math:`U(T, V)`,
     and the Gibbs free energy :math:`G` on a :math:`(T, V)` grid from Helmholtz free energy :math:`F(T, V)` by
@@ -64,31 +72,37 @@ def thermodynamic_potentials(temperature, vs, free_energies, ps):
     :param vs: A vector of volumes.
     :param free_energies: A matrix, the free energy as a function of temperature and volume, i.e., :math:`F(T, V)`.
     :param ps: A matrix, the pressure as a function of temperature and volume, i.e., :math:`P(T, V)`.
+    :param entropies: A matrix, the entropy :math:`S(T, V)`, numerically derived from *free_energies* if not given.
     :return: A dictionary that contains the enthalpy :math:`H(T, V)`, the internal energy :math:`U(T, V)`,
         and the Gibbs free energy :math:`G` on a :math:`(T, V)` grid. They can be retrieved by ``'U'``, ``'H'``, or
         ``'G'`` keys, respectively.
     """
     g = free_energies + ps * vs  # G(T,V) = F(T,V) + V * P(T,V)
 
-    u = free_energies + entropy(temperature, free_energies) * temperature.reshape(-1, 1)  # U(T,V) = F(T,V) + T * S(T,V)
+    if entropies is None:
+        entropies = entropy(temperature, free_energies)
+    u = free_energies + entropies * temperature.reshape(-1, 1)  # U(T,V) = F(T,V) + T * S(T,V)
 
     h = u + ps * vs  # H(T,V) = U(T,V) + V * P(T,V)
 
     return {'U': u, 'H': h, 'G': g}
 
 
-def volume(vs, desired_ps, ps):
+def volume(vs, desired_ps, ps, plan=None):
     """
     Convert the volumes as a function of temperature and pressure, i.e., on a :math:`(T, P)` grid.
 
     :param vs: A vector of volumes.
     :param desired_ps: A vector of desired pressures.
     :param ps: A matrix, the pressure as a function of temperature and volume, i.e., :math:`P(T,V)`, in atomic unit.
+    :param plan: A ``V2PPlan`` of *ps* and *desired_ps* to reuse, planned here if not given.
     :return: A matrix, the volume as a function of temperature and pressure, i.e., :math:`V(T, P)`.
     """
     nt, ntv = ps.shape
     vs = vs.reshape(1, -1).repeat(nt, axis=0)
-    return v2p(vs, ps, desired_ps)
+    if plan is None:
+        plan = V2PPlan(ps, desired_ps)
+    return plan.apply(vs)
 
 
 def thermal_expansion_coefficient(temperature, vs):
@@ -108,6 +122,25 @@ def thermal_expansion_coefficient(temperature, vs):
     return calculate_derivatives(temperature, vs) / vs
 
 
+def thermal_expansion_coefficient_tv(vs, entropies, bt):
+    """
+    Calculate the thermal expansion coefficient from the entropy, without any temperature derivative, by
+
+    .. math::
+
+       \\alpha = \\frac{ 1 }{ B_T } \\bigg( \\frac{ \\partial P }{ \\partial T } \\bigg)_V
+               = \\frac{ 1 }{ B_T } \\bigg( \\frac{ \\partial S }{ \\partial V } \\bigg)_T.
+
+    :param vs: A vector of volumes.
+    :param entropies: A matrix, the entropy as a function of temperature and volume, i.e., :math:`S(T, V)`.
+    :param bt: A matrix, the isothermal bulk modulus as a function of temperature and volume,
+        i.e., :math:`B_T(T, V)`.
+    :return: A matrix, the thermal expansion coefficient as a function of temperature and volume,
+        i.e., :math:`\\alpha(T, V)`.
+    """
+    return np.gradient(entropies, axis=1) / np.gradient(vs) / bt
+
+
 def gruneisen_parameter(vs, bt, alpha, cv):
     """
     Calculate the Grüneisen parameter by
@@ -186,6 +219,23 @@ def bulk_modulus_derivative(ps, bt):
     return calculate_derivatives(ps, bt.T).T
 
 
+def bulk_modulus_derivative_tv(ps, bt):
+    """
+    Calculate the first-order derivative of bulk modulus with respect to pressure on a :math:`(T, V)` grid by
+
+    .. math::
+
+       B_T' = \\bigg( \\frac{ \\partial B_T }{ \\partial V } \\bigg)_T \\bigg/
+       \\bigg( \\frac{ \\partial P }{ \\partial V } \\bigg)_T.
+
+    :param ps: A matrix, the pressure as a function of temperature and volume, i.e., :math:`P(T, V)`.
+    :param bt: A matrix, the isothermal bulk modulus, as a function of temperature and volume,
+        i.e., :math:`B_T(T, V)`.
+    :return: A matrix, :math:`B_T'(T, V)`.
+    """
+    return np.gradient(bt, axis=1) / np.gradient(ps, axis=1)
+
+
 def isobaric_heat_capacity(cv, alpha, gamma, temperature):
     """
     Calculate the isobaric heat capacity by
@@ -228,12 +278,30 @@ class ThermodynamicProperties:
     all units are ry, bohr^3
     all 2-d matrix are t,v(p)
     energy matrix should has the same size as volume or temperature
+    if the ``StrainPolynomial`` of the energy is given, P, B_T and B_T' are its analytic volume derivatives,
+    otherwise they are numerical derivatives on the volume grid
+    if the entropies and heat capacities are given, e.g., from the frequencies, S, U and C_V take them,
+    and alpha is derived from S on the volume grid, rather than from numerical temperature derivatives
     """
-    def __init__(self, volume, temperature, pressure, energy):
+    # The (T, P) properties interpolated from the (T, V) property of the same name, e.g. 'u_tp' from 'u_tv'
+    INTERPOLATED = ('v_tp', 'u_tp', 'h_tp', 'g_tp', 'bt_tp', 'cv_tp', 'btp_tp')
+    # The interpolated properties each derived (T, P) property needs
+    DERIVED = {
+        'alpha_tp': ('v_tp',),
+        'gamma_tp': ('v_tp', 'bt_tp', 'cv_tp'),
+        'bs_tp': ('v_tp', 'bt_tp', 'cv_tp'),
+        'cp_tp': ('v_tp', 'bt_tp', 'cv_tp'),
+    }
+
+    def __init__(self, volume, temperature, pressure, energy, strain_polynomial=None, entropies=None,
+                 heat_capacities=None):
         self.__volume = volume
         self.__temperature = temperature
         self.__pressure = pressure
         self.__energy = energy
+        self.__strain_polynomial = strain_polynomial
+        self.__entropies = entropies
+        self.__heat_capacities = heat_capacities
 
     @LazyProperty
     def energy(self):
@@ -241,34 +309,53 @@ class ThermodynamicProperties:
 
     @LazyProperty
     def p_tv(self):
+        if self.__strain_polynomial is not None:
+            return self.__strain_polynomial.pressure(self.__volume)
         return pressure(self.__volume, self.__energy)
 
+    @LazyProperty
+    def v2p_plan(self):
+        # The stencils from (T, V) to (T, P) are the same for every property, so they are planned once
+        return V2PPlan(self.p_tv, self.__pressure)
+
     @LazyProperty
     def thermal_potential(self):
-        return thermodynamic_potentials(self.__temperature, self.__volume, self.__energy, self.p_tv)
+        return thermodynamic_potentials(self.__temperature, self.__volume, self.__energy, self.p_tv, self.s_tv)
 
     @LazyProperty
     def v_tp(self):
-        return volume(self.__volume, self.__pressure, self.p_tv)
+        return volume(self.__volume, self.__pressure, self.p_tv, self.v2p_plan)
 
     @LazyProperty
     def s_tv(self):
+        if self.__entropies is not None:
+            return self.__entropies
         return entropy(self.__temperature, self.energy)
 
     @LazyProperty
     def cv_tp(self):
-        return v2p(self.cv_tv, self.p_tv, self.__pressure)
+        return self.v2p_plan.apply(self.cv_tv)
 
     @LazyProperty
     def bt_tv(self):
+        if self.__strain_polynomial is not None:
+            return self.__strain_polynomial.isothermal_bulk_modulus(self.__volume)
         return isothermal_bulk_modulus(self.__volume, self.p_tv)
 
+    @LazyProperty
+    def btp_tv(self):
+        if self.__strain_polynomial is not None:
+            return self.__strain_polynomial.bulk_modulus_derivative(self.__volume)
+        return bulk_modulus_derivative_tv(self.p_tv, self.bt_tv)
+
     @LazyProperty
     def bt_tp(self):
-        return v2p(self.bt_tv, self.p_tv, self.__pressure)
+        return self.v2p_plan.apply(self.bt_tv)
 
     @LazyProperty
     def cv_tv(self):
+        if self.__heat_capacities is not None:
+            return self.__heat_capacities
         return volumetric_heat_capacity(self.__temperature, self.thermal_potential["U"])
 
     @LazyProperty
@@ -281,10 +368,16 @@ class ThermodynamicProperties:
 
     @LazyProperty
     def bt_tp(self):
-        return v2p(self.bt_tv, self.p_tv, self.__pressure)
+        return self.v2p_plan.apply(self.bt_tv)
+
+    @LazyProperty
+    def alpha_tv(self):
+        return thermal_expansion_coefficient_tv(self.__volume, self.s_tv, self.bt_tv)
 
     @LazyProperty
     def alpha_tp(self):
+        if self.__entropies is not None:
+            return self.v2p_plan.apply(self.alpha_tv)
         return thermal_expansion_coefficient(self.__temperature, self.v_tp)
 
     @LazyProperty
@@ -293,7 +386,7 @@ class ThermodynamicProperties:
 
     @LazyProperty
     def h_tp(self):
-        return v2p(self.h_tv, self.p_tv, self.__pressure)
+        return self.v2p_plan.apply(self.h_tv)
 
     @LazyProperty
     def bs_tp(self):
@@ -305,15 +398,15 @@ class ThermodynamicProperties:
 
     @LazyProperty
     def g_tp(self):
-        return v2p(self.g_tv, self.p_tv, self.__pressure)
+        return self.v2p_plan.apply(self.g_tv)
 
     @LazyProperty
     def cv_tp(self):
-        return v2p(self.cv_tv, self.p_tv, self.__pressure)
+        return self.v2p_plan.apply(self.cv_tv)
 
     @LazyProperty
     def btp_tp(self):
-        return calculate_derivatives(self.__temperature, self.bt_tp)
+        return self.v2p_plan.apply(self.btp_tv)
 
     @LazyProperty
     def u_tv(self):
@@ -321,13 +414,201 @@ class ThermodynamicProperties:
 
     @LazyProperty
     def u_tp(self):
-        return v2p(self.u_tv, self.p_tv, self.__pressure)
+        return self.v2p_plan.apply(self.u_tv)
+
+    def interpolate(self, *names):
+        """
+        Interpolate the (T, P) properties *names* through one stacked call of ``v2p_plan``, instead of one call
+        per property. The results are memoized, as if each property was accessed on its own.
+        A derived property, e.g. 'cp_tp', brings in the interpolated properties it needs.
+
+        :param names: The names of the wanted (T, P) properties.
+        """
+        wanted = []
+        for name in names:
+            wanted.extend(self.DERIVED.get(name, (name,)))
+        wanted = [name for name in dict.fromkeys(wanted)
+                  if name in self.INTERPOLATED and not hasattr(self, getattr(type(self), name).cache_name)]
+        if not wanted:
+            return
+        stack = np.stack([self._tv_of(name) for name in wanted])
+        for name, value in zip(wanted, self.v2p_plan.apply(stack)):
+            setattr(self, getattr(type(self), name).cache_name, value)
+
+    def _tv_of(self, name):
+        if name == 'v_tp':
+            return np.broadcast_to(self.__volume, self.p_tv.shape)
+        return getattr(self, name[:-3] + '_tv')
 
     def get_adiabatic_eos(self, temperature, pressure):
-        ptv = ry_b3_to_gpa(self.p_tv)
-        all_volume = []
-        for i, temp in enumerate(temperature):
-            row_index = find_value(self.__temperature, temperature[i])
-            column_index = find_value(ptv[row_index], pressure[i])
-            all_volume.append(self.__volume[column_index])
-        return np.array(all_volume)
+        """
+        The volumes at the points (*temperature*, *pressure*), e.g., along an adiabat, interpolated linearly
+        in pressure along the two neighbouring temperatures of the grid, and then linearly in temperature.
+        Points outside of the grid give ``nan``. To trace the adiabats themselves, see
+        ``pgm.query.ThermodynamicModel.isentropes``.
+
+        :param temperature: A vector of temperatures, in K.
+        :param pressure: A vector of pressures, in GPa, with the same length as *temperature*.
+        :return: A vector of the volumes.
+        """
+        temperature = np.atleast_1d(np.asarray(temperature, dtype=float))
+        ts, vs, ptv = np.asarray(self.__temperature), np.asarray(self.__volume), ry_b3_to_gpa(self.p_tv)
+        if ptv[0, 0] > ptv[0, -1]:  # The rows should be increasing in pressure
+            vs, ptv = vs[::-1], ptv[:, ::-1]
+        rows = bracket_indices(ts, temperature)
+        weights = (temperature - ts[rows]) / (ts[rows + 1] - ts[rows])
+        weights[(temperature < ts[0]) | (temperature > ts[-1])] = np.nan
+        return (1 - weights) * interpolate_in_rows(ptv, rows, pressure, vs) + \
+            weights * interpolate_in_rows(ptv, rows + 1, pressure, vs)
+
+
+def thermodynamic_stages(vs, temperature, desired_ps, free_energies, strain_polynomial=None, stacked=(),
+                         entropies=None, heat_capacities=None):
+    """
+    The properties of ``ThermodynamicProperties`` as a ``StageGraph``, one stage per property with the same name,
+    so that only the asked properties and their dependencies are computed, and each of them is released
+    as soon as its last consumer has run. Each (T, V) property is followed by its interpolation to (T, P),
+    so that it can be released before the next one is computed, unless it is *stacked*: the interpolations
+    of the *stacked* properties are done by one 'tp_stack' stage, in one pass of ``V2PPlan.apply`` over their stack
+    like ``ThermodynamicProperties.interpolate``, which is about twice as fast but keeps all their (T, V)
+    properties alive together.
+
+    :param vs: A vector of volumes.
+    :param temperature: A vector of temperature.
+    :param desired_ps: A vector of desired pressures.
+    :param free_energies: A matrix, the free energy as a function of temperature and volume, i.e., :math:`F(T, V)`.
+    :param strain_polynomial: The ``StrainPolynomial`` of *free_energies*. If it is given, P, B_T and B_T'
+        are its analytic volume derivatives, otherwise they are numerical derivatives on the volume grid.
+    :param stacked: The names of the properties of ``ThermodynamicProperties.INTERPOLATED`` to be interpolated
+        together.
+    :param entropies: The entropy :math:`S(T, V)`, e.g., from the frequencies, otherwise it is the numerical
+        temperature derivative of *free_energies*. If it is given, alpha is derived from it rather than from
+        the numerical temperature derivative of V(T, P).
+    :param heat_capacities: The heat capacity :math:`C_V(T, V)`, otherwise it is the numerical temperature
+        derivative of the internal energy.
+    :return: The stage graph.
+    """
+    interpolated = ThermodynamicProperties.INTERPOLATED + (('alpha_tp',) if entropies is not None else ())
+    stacked = [name for name in interpolated if name in stacked]
+
+    def add_interpolated(name):
+        if name not in stacked:
+            stages.add(name, lambda plan, f: plan.apply(f), ('v2p_plan', name[:-3] + '_tv'))
+
+    stages = StageGraph()
+    stages.add('energy', lambda: free_energies)
+    if strain_polynomial is None:
+        stages.add('p_tv', lambda f: pressure(vs, f), ('energy',))
+    else:
+        stages.add('p_tv', lambda: strain_polynomial.pressure(vs))
+    stages.add('v2p_plan', lambda ps: V2PPlan(ps, desired_ps), ('p_tv',))
+    stages.add('v_tv', lambda ps: np.broadcast_to(vs, ps.shape), ('p_tv',))
+    add_interpolated('v_tp')
+    if entropies is None:
+        stages.add('s_tv', lambda f: entropy(temperature, f), ('energy',))
+    else:
+        stages.add('s_tv', lambda: entropies)
+    # The same as ``thermodynamic_potentials``, but U, H and G can be released one by one
+    stages.add('u_tv', lambda f, s: f + s * temperature.reshape(-1, 1), ('energy', 's_tv'))
+    if heat_capacities is None:
+        stages.add('cv_tv', lambda u: volumetric_heat_capacity(temperature, u), ('u_tv',))
+    else:
+        stages.add('cv_tv', lambda: heat_capacities)
+    add_interpolated('cv_tp')
+    stages.add('h_tv', lambda u, ps: u + ps * vs, ('u_tv', 'p_tv'))
+    add_interpolated('h_tp')
+    add_interpolated('u_tp')
+    stages.add('g_tv', lambda f, ps: f + ps * vs, ('energy', 'p_tv'))
+    add_interpolated('g_tp')
+    if strain_polynomial is None:
+        stages.add('bt_tv', lambda ps: isothermal_bulk_modulus(vs, ps), ('p_tv',))
+        stages.add('btp_tv', bulk_modulus_derivative_tv, ('p_tv', 'bt_tv'))
+    else:
+        stages.add('bt_tv', lambda: strain_polynomial.isothermal_bulk_modulus(vs))
+        stages.add('btp_tv', lambda: strain_polynomial.bulk_modulus_derivative(vs))
+    add_interpolated('btp_tp')
+    if entropies is not None:
+        stages.add('alpha_tv', lambda s, bt: thermal_expansion_coefficient_tv(vs, s, bt), ('s_tv', 'bt_tv'))
+        add_interpolated('alpha_tp')
+    add_interpolated('bt_tp')
+    if stacked:
+        stages.add('tp_stack', lambda plan, *fs: plan.apply(np.stack(fs)),
+                   ('v2p_plan', *(name[:-3] + '_tv' for name in stacked)))
+        for i, name in enumerate(stacked):
+            stages.add(name, lambda stack, i=i: stack[i], ('tp_stack',))
+    if entropies is None:
+        stages.add('alpha_tp', lambda v: thermal_expansion_coefficient(temperature, v), ('v_tp',))
+    stages.add('gamma_tp', gruneisen_parameter, ('v_tp', 'bt_tp', 'alpha_tp', 'cv_tp'))
+    stages.add('bs_tp', lambda bt, alpha, gamma: adiabatic_bulk_modulus(bt, alpha, gamma, temperature),
+               ('bt_tp', 'alpha_tp', 'gamma_tp'))
+    stages.add('cp_tp', lambda cv, alpha, gamma: isobaric_heat_capacity(cv, alpha, gamma, temperature),
+               ('cv_tp', 'alpha_tp', 'gamma_tp'))
+    return stages
+
+
+def evaluate_thermodynamics(vs, temperature, desired_ps, free_energies, *targets, strain_polynomial=None,
+                            stacked=(), entropies=None, heat_capacities=None):
+    """
+    Compute the properties *targets* (e.g. 'p_tv', 'cp_tp') in dependency order, and yield each of them
+    as soon as it is ready. Only the needed properties are computed, and each intermediate is released as soon as
+    its last consumer has run. The results are the same as those of ``ThermodynamicProperties``.
+
+    :param vs: A vector of volumes.
+    :param temperature: A vector of temperature.
+    :param desired_ps: A vector of desired pressures.
+    :param free_energies: A matrix, the free energy as a function of temperature and volume, i.e., :math:`F(T, V)`.
+    :param targets: The names of the wanted properties.
+    :param strain_polynomial: The ``StrainPolynomial`` of *free_energies*, for analytic P, B_T and B_T'.
+    :param stacked: The names of the (T, P) properties to be interpolated together, see ``thermodynamic_stages``,
+        which is faster but keeps all their (T, V) properties in memory at once. By default each of them
+        is interpolated right after its (T, V) property.
+    :param entropies: The entropy :math:`S(T, V)`, e.g., from the frequencies, for analytic S, U and alpha.
+    :param heat_capacities: The heat capacity :math:`C_V(T, V)`, e.g., from the frequencies, for analytic C_V.
+    :return: A generator of ``(name, property)``, in dependency order rather than in the order of *targets*.
+    """
+    stages = thermodynamic_stages(vs, temperature, desired_ps, free_energies, strain_polynomial, stacked,
+                                  entropies=entropies, heat_capacities=heat_capacities)
+    yield from stages.evaluate(*targets)
+
+
+# The rows of temperature a block needs on each side: C_V is the derivative of U = F + T S, whose S is a derivative of F
+TEMPERATURE_HALO = 2
+
+
+def evaluate_thermodynamics_blocks(vs, temperature, desired_ps, free_energies, *targets, block_size: int,
+                                   strain_polynomial=None, stacked=(), entropies=None, heat_capacities=None):
+    """
+    Compute the properties *targets* like ``evaluate_thermodynamics``, but *block_size* temperatures at a time,
+    so that the intermediates never hold more than *block_size* + 2 ``TEMPERATURE_HALO`` rows.
+    Every property depends on the neighbouring temperatures only through the temperature derivatives,
+    so each block is computed with a halo of ``TEMPERATURE_HALO`` rows on each side, which are then dropped.
+    The rows of the blocks are the same as those of ``evaluate_thermodynamics`` on the whole grid,
+    bit for bit on a uniform temperature grid.
+
+    :param vs: A vector of volumes.
+    :param temperature: A vector of temperature.
+    :param desired_ps: A vector of desired pressures.
+    :param free_energies: A matrix, the free energy as a function of temperature and volume, i.e., :math:`F(T, V)`,
+        e.g., memory-mapped, only the rows of one block and its halo are read at a time.
+    :param targets: The names of the wanted properties.
+    :param block_size: The number of temperatures per block.
+    :param strain_polynomial: The ``StrainPolynomial`` of *free_energies*, for analytic P, B_T and B_T'.
+    :param stacked: The names of the (T, P) properties to be interpolated together, see ``evaluate_thermodynamics``.
+    :param entropies: The entropy :math:`S(T, V)`, for analytic S, U and alpha, read a block at a time like
+        *free_energies*.
+    :param heat_capacities: The heat capacity :math:`C_V(T, V)`, for analytic C_V, read a block at a time.
+    :return: A generator of ``(rows, name, block)``, where *rows* is the slice of the temperatures of the block,
+        in the order of the blocks, and in dependency order within a block.
+    """
+    temperature = np.asarray(temperature)
+    nt = len(temperature)
+    for start in range(0, nt, block_size):
+        stop = min(start + block_size, nt)
+        lower, upper = max(start - TEMPERATURE_HALO, 0), min(stop + TEMPERATURE_HALO, nt)
+        polynomial = None if strain_polynomial is None else strain_polynomial[lower:upper]
+        given = {name: None if value is None else np.asarray(value[lower:upper])
+                 for name, value in (('entropies', entropies), ('heat_capacities', heat_capacities))}
+        for name, result in evaluate_thermodynamics(vs, temperature[lower:upper], desired_ps,
+                                                    np.asarray(free_energies[lower:upper]), *targets,
+                                                    strain_polynomial=polynomial, stacked=stacked, **given):
+            yield slice(start, stop), name, result[start - lower:stop - lower]
@@ -10,33 +10,49 @@
 from typing import Optional
 
 import numpy as np
-from numpy.linalg import inv
 import warnings
 # from qha.type_aliases import Matrix, Vector
 
 # ===================== What can be exported? =====================
-__all__ = ['polynomial_least_square_fitting', 'apply_finite_strain_fitting']
+__all__ = ['polynomial_least_square_projection', 'polynomial_least_square_fitting', 'apply_finite_strain_fitting']
 
 ###TODO: Dangerous! This arise when I try to involve numba in the calculator, need to be change later
 warnings.simplefilter(action = "ignore", category = RuntimeWarning)
+def polynomial_least_square_projection(xs, new_xs, order: Optional[int] = 3):
+    """
+    The linear maps of the least-square polynomial fitting on *xs*, which only depend on the x-coordinates,
+    so that any number of y-coordinates can be fitted by a matrix product. They are built from the QR decomposition
+    of the Vandermonde matrix :math:`X = QR`, i.e., the coefficients are :math:`a = R^{-1} Q^T y`, instead of
+    inverting the ill-conditioned :math:`X^T X`.
+
+    :param xs: A vector of existing x-coordinates, with length n.
+    :param new_xs: A new vector of x-coordinates to be applied with the polynomial-fitting result, with length m.
+    :param order: The order chose to fit the finite strain EoS, the default value is ``3``,
+        which is, the third-order Birch--Murnaghan EoS.
+    :return: A tuple, the (order + 1, n) matrix from the y-coordinates to the coefficients, lowest order first,
+        and the (m, n) matrix from the y-coordinates to the new y-coordinates.
+    """
+    order += 1  # The definition of order in ``numpy.vander`` is different from the order in finite strain by one.
+    q, r = np.linalg.qr(np.vander(xs, order, increasing=True))
+    coefficients = np.linalg.solve(r, q.T)
+    return coefficients, np.vander(new_xs, order, increasing=True) @ coefficients
+
+
 def polynomial_least_square_fitting(xs, ys, new_xs, order: Optional[int] = 3):
     """
     The algorithm is referenced from the
-    `Wolfram MathWorld <http://mathworld.wolfram.com/LeastSquaresFittingPolynomial.html>`_.
+    `Wolfram MathWorld <http://mathworld.wolfram.com/LeastSquaresFittingPolynomial.html>`_,
+    solved through ``polynomial_least_square_projection``.
 
     :param xs: A vector of existing x-coordinates.
-    :param ys: A vector of y-coordinates correspond to the *xs*.
+    :param ys: A vector of y-coordinates correspond to the *xs*, or a matrix whose columns are fitted at once.
     :param new_xs: A new vector of x-coordinates to be applied with the polynomial-fitting result.
     :param order: The order chose to fit the finite strain EoS, the default value is ``3``,
         which is, the third-order Birch--Murnaghan EoS.
     :return: A tuple, the polynomial-fitting coefficients and the new vector of y-coordinates.
     """
-    order += 1  # The definition of order in ``numpy.vander`` is different from the order in finite strain by one.
-    xx = np.vander(xs, order, increasing=True)  # This will make a Vandermonde matrix that will be used in EoS fitting.
-    xx_t = xx.T  # Transpose the matrix.
-    a = inv(xx_t @ xx) @ xx_t @ ys  # a = (X^T . X)^{-1} . X^T . ys
-    new_y = np.vander(new_xs, order, increasing=True) @ a
-    return a, new_y
+    coefficients, projection = polynomial_least_square_projection(xs, new_xs, order)
+    return coefficients @ ys, projection @ ys
 
 
 def apply_finite_strain_fitting(strains_sparse, free_energies, strains_dense,
@@ -45,7 +61,8 @@ def apply_finite_strain_fitting(strains_sparse, free_energies, strains_dense,
     Calculate the free energies :math:`F(T, V)` for some strains (*strains_dense*), with the
     free energies (*free_energies*) on some other strains (*strains_sparse*) known already.
     Do a polynomial curve-fitting the apply the fitted function
-    to the *strains_dense*.
+    to the *strains_dense*. All the temperatures share the same strains, so they are fitted
+    by one matrix product with the projection of ``polynomial_least_square_projection``.
 
     :param strains_sparse: A vector of the Eulerian strains for a sparse set of volumes.
     :param free_energies: The free energies correspond to *strains_sparse* at several temperature.
@@ -54,11 +71,5 @@ def apply_finite_strain_fitting(strains_sparse, free_energies, strains_dense,
         which is, the third-order Birch--Murnaghan EoS.
     :return: The free energies correspond to *strains_dense* at different temperature.
     """
-    temperature_amount, _ = free_energies.shape
-    dense_volume_amount = len(strains_dense)
-    f_v_t = np.empty((temperature_amount, dense_volume_amount))  # Initialize the F(T,V) array
-
-    for i in range(temperature_amount):
-        _, f_i = polynomial_least_square_fitting(strains_sparse, free_energies[i], strains_dense, order)
-        f_v_t[i] = f_i
-    return f_v_t
\ No newline at end of file
+    _, projection = polynomial_least_square_projection(strains_sparse, strains_dense, order)
+    return free_energies @ projection.T
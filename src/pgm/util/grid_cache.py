@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+.. module grid_cache
+   :platform: Unix, Windows, Mac, Linux
+   :synopsis: A bounded cache of the expanded volume grids and of the least-square projections onto them,
+    keyed by the input volumes, the number of output volumes, the ratio and the order, so that repeated runs
+    and parameter sweeps in one process set them up only once.
+"""
+
+import functools
+
+import numpy as np
+
+from .fitting import polynomial_least_square_projection
+from .grid_interpolation import calculate_eulerian_strain, VolumeExpander
+
+# ===================== What can be exported? =====================
+__all__ = ['GRID_CACHE_SIZE', 'strain_grid', 'least_square_projection', 'cache_info', 'cache_clear']
+
+# The number of entries kept by each cache, the least recently used ones are dropped first
+GRID_CACHE_SIZE = 32
+
+
+def _read_only(*arrays):
+    # The cached arrays are shared by every caller, so nobody may change them in place
+    for array in arrays:
+        array.setflags(write=False)
+    return arrays
+
+
+def _volumes_key(volumes) -> tuple:
+    return tuple(np.asarray(volumes, dtype=float).ravel().tolist())
+
+
+@functools.lru_cache(maxsize=GRID_CACHE_SIZE)
+def _strain_grid(volumes: tuple, num: int, ratio: float):
+    in_volumes = np.array(volumes)
+    expander = VolumeExpander(in_volumes, num, ratio)
+    expander.interpolate_volumes()
+    in_strains = calculate_eulerian_strain(in_volumes[0], in_volumes)
+    return _read_only(expander.out_volumes, expander.strains, in_strains)
+
+
+@functools.lru_cache(maxsize=GRID_CACHE_SIZE)
+def _projection(volumes: tuple, num: int, ratio: float, order: int):
+    _, out_strains, in_strains = _strain_grid(volumes, num, ratio)
+    return _read_only(*polynomial_least_square_projection(in_strains, out_strains, order))
+
+
+def strain_grid(in_volumes, num: int, ratio: float):
+    """
+    The volume grid of ``VolumeExpander`` for *in_volumes*, *num* and *ratio*, computed once.
+
+    :param in_volumes: A vector of the input volumes.
+    :param num: The number of output volumes.
+    :param ratio: The ratio the volume range is expanded by.
+    :return: A tuple of read-only vectors, the output volumes, their Eulerian strains with respect to the largest
+        input volume, and the strains of *in_volumes* with respect to the first of them.
+    """
+    return _strain_grid(_volumes_key(in_volumes), int(num), float(ratio))
+
+
+def least_square_projection(in_volumes, num: int, ratio: float, order: int = 3):
+    """
+    The maps of ``polynomial_least_square_projection`` from the strains of *in_volumes* to the strains of
+    ``strain_grid(in_volumes, num, ratio)``, computed once.
+
+    :param in_volumes: A vector of the input volumes.
+    :param num: The number of output volumes.
+    :param ratio: The ratio the volume range is expanded by.
+    :param order: The order of the polynomials.
+    :return: A tuple of read-only matrices, the (order + 1, number of input volumes) map to the coefficients,
+        and the (num, number of input volumes) map to the values on the output volumes.
+    """
+    return _projection(_volumes_key(in_volumes), int(num), float(ratio), int(order))
+
+
+def cache_info() -> dict:
+    """
+    :return: The statistics of the caches of the grids and of the projections, as ``functools.lru_cache`` gives.
+    """
+    return {'strain_grid': _strain_grid.cache_info(), 'least_square_projection': _projection.cache_info()}
+
+
+def cache_clear():
+    """
+    Drop all the cached grids and projections.
+    """
+    _strain_grid.cache_clear()
+    _projection.cache_clear()
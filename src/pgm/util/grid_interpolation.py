@@ -13,7 +13,6 @@ from typing import Optional, Tuple
 import numpy as np
 from numba import vectorize, float64
 
-from .fitting import polynomial_least_square_fitting, apply_finite_strain_fitting
 # from qha.type_aliases import Vector, Matrix
 from .unit_conversion import gpa_to_ry_b3
 
@@ -21,6 +20,7 @@ from .unit_conversion import gpa_to_ry_b3
 __all__ = [
     'calculate_eulerian_strain',
     'from_eulerian_strain',
+    'equidistributed_grid',
     'VolumeExpander',
     'FinerGrid'
 ]
@@ -60,6 +60,29 @@ def from_eulerian_strain(v0, fs):
     return v0 * (2 * fs + 1) ** (-3 / 2)
 
 
+def equidistributed_grid(xs, density, n: int, floor: float = 1.0):
+    """
+    A non-uniform grid of *n* points from ``xs[0]`` to ``xs[-1]``, with the same integral of *density* between
+    every two consecutive points, so that the points are dense where *density* is large and sparse elsewhere.
+
+    To keep a minimal resolution everywhere, *density* is raised by *floor* times its mean, i.e., the spacing is
+    never more than about :math:`1 + 1 / \\text{floor}` times the uniform spacing.
+
+    :param xs: A vector of increasing points, where *density* is sampled.
+    :param density: A vector of the non-negative density at *xs*, e.g., the square root of the magnitude of
+        the second derivative of a quantity, for a constant error of central differences.
+    :param n: The number of points of the grid.
+    :param floor: The fraction of the mean density added everywhere.
+    :return: A vector of *n* increasing points, whose ends are ``xs[0]`` and ``xs[-1]``.
+    """
+    xs, density = np.asarray(xs, dtype=float), np.abs(np.asarray(density, dtype=float))
+    density = density + floor * np.mean(density) if np.any(density > 0) else np.ones_like(xs)
+    cumulative = np.concatenate(([0], np.cumsum((density[1:] + density[:-1]) / 2 * np.diff(xs))))
+    grid = np.interp(np.linspace(0, cumulative[-1], n), cumulative, xs)
+    grid[0], grid[-1] = xs[0], xs[-1]
+    return grid
+
+
 class VolumeExpander:
     """
     Interpolate volumes on input volumes *in_volumes*, with *ratio* given.
@@ -190,11 +213,12 @@ class FinerGrid:
         :param initial_ratio: Initial ratio, a guess value, which can be set to a very large number.
         :return: The suitable `ratio` for further calculation.
         """
-        vr = VolumeExpander(volumes, self.dense_volumes_amount, initial_ratio)
-        vr.interpolate_volumes()
-        strains, finer_volumes = vr.strains, vr.out_volumes
-        eulerian_strain = calculate_eulerian_strain(volumes[0], volumes)
-        _, f_v_tmax = polynomial_least_square_fitting(eulerian_strain, free_energies, strains, self.option)
+        # Imported here, since the cache is built on this module
+        from .grid_cache import least_square_projection, strain_grid
+
+        finer_volumes, _, _ = strain_grid(volumes, self.dense_volumes_amount, initial_ratio)
+        _, projection = least_square_projection(volumes, self.dense_volumes_amount, initial_ratio, self.option)
+        f_v_tmax = projection @ free_energies
         p_v_tmax = -np.gradient(f_v_tmax) / np.gradient(finer_volumes)
         p_desire = gpa_to_ry_b3(self.desired_p_min)
         # Find the index of the first pressure value that slightly smaller than p_desire.
@@ -202,6 +226,56 @@ class FinerGrid:
         final_ratio = finer_volumes[idx] / max(volumes)
         return final_ratio
 
+    def covering_ratio(self, volumes, free_energies, desired_p_max: float, max_ratio: float = 1.5,
+                       margin: int = 6, tolerance: float = 1e-4) -> float:
+        """
+        The smallest ratio whose expanded volumes cover the pressures from ``desired_p_min`` to *desired_p_max*
+        at every temperature, found by bisection. Only the pressures of the finite-strain fit at two volumes of the
+        dense grid are evaluated, no dense grid is built. The pressures are covered by the dense volumes but the
+        *margin* ones at each end, since the interpolation to pressures needs 4 volumes around each pressure,
+        and the derivatives are one-sided at the ends.
+
+        :param volumes: Volumes of these calculations were perform (sparse).
+        :param free_energies: Free energies at all the temperatures (sparse), with shape (nt, number of volumes).
+        :param desired_p_max: The desired maximum pressure, in GPa.
+        :param max_ratio: The largest ratio allowed.
+        :param margin: The number of dense volumes at each end left out of the covering.
+        :param tolerance: The bisection stops when the ratio is known within it, the larger end is returned.
+        :return: The ratio, ``1.0`` if the input volumes are large enough.
+        """
+        volumes = np.asarray(volumes, dtype=float)
+        eulerian_strain = calculate_eulerian_strain(volumes[0], volumes)
+        # The fitted polynomials are evaluated on the strains with respect to the largest volume, like the dense grid
+        coefficients = np.polynomial.polynomial.polyfit(eulerian_strain, np.asarray(free_energies).T, self.option)
+        v_max = np.max(volumes)
+        p_min, p_max = gpa_to_ry_b3(self.desired_p_min), gpa_to_ry_b3(desired_p_max)
+
+        def covers(ratio):
+            # The strains of the dense volumes *margin* from each end, as in ``VolumeExpander``
+            s_upper = calculate_eulerian_strain(v_max, np.min(volumes) / ratio)
+            s_lower = calculate_eulerian_strain(v_max, v_max * ratio)
+            step = (s_upper - s_lower) / (self.dense_volumes_amount - 1)
+            fs = np.array([s_upper - margin * step, s_lower + margin * step])
+            vs = from_eulerian_strain(v_max, fs)
+            u = (v_max / vs) ** (2 / 3)
+            ps = u * np.polynomial.polynomial.polyval(fs, np.polynomial.polynomial.polyder(coefficients)) / (3 * vs)
+            # P = -dF/dV with shape (nt, 2), at the small and the large volume
+            return np.all(ps[:, 0] >= p_max) and np.all(ps[:, 1] <= p_min)
+
+        if covers(1.0):
+            return 1.0
+        if not covers(max_ratio):
+            raise ValueError("The pressures from {0} to {1} GPa are not covered at all temperatures by a volume "
+                             "expansion ratio up to {2}!".format(self.desired_p_min, desired_p_max, max_ratio))
+        lower, upper = 1.0, float(max_ratio)
+        while upper - lower > tolerance:
+            middle = (lower + upper) / 2
+            if covers(middle):
+                upper = middle
+            else:
+                lower = middle
+        return upper
+
     def refine_grid(self, volumes, free_energies,
                     ratio: Optional[float] = None):
         """
@@ -224,9 +298,9 @@ class FinerGrid:
 
         self._ratio = new_ratio
 
-        eulerian_strain = calculate_eulerian_strain(volumes[0], volumes)
-        vr = VolumeExpander(in_volumes=volumes, out_volumes_num=self.dense_volumes_amount, ratio=new_ratio)
-        vr.interpolate_volumes()  # As mentioned in ``VolumeExpander`` doc, call this method immediately.
-        strains, dense_volumes = vr.strains, vr.out_volumes
-        dense_free_energies = apply_finite_strain_fitting(eulerian_strain, free_energies, strains, self.option)
+        from .grid_cache import least_square_projection, strain_grid
+
+        dense_volumes, _, _ = strain_grid(volumes, self.dense_volumes_amount, new_ratio)
+        _, projection = least_square_projection(volumes, self.dense_volumes_amount, new_ratio, self.option)
+        dense_free_energies = free_energies @ projection.T
         return dense_volumes, dense_free_energies, new_ratio
\ No newline at end of file
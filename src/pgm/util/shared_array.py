@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+.. module shared_array
+   :platform: Unix, Windows, Mac, Linux
+   :synopsis: Place a ``numpy`` array in shared memory, so that worker processes can attach it by name
+    instead of receiving a pickled copy.
+"""
+
+from multiprocessing import shared_memory
+from typing import Tuple
+
+import numpy as np
+
+# ===================== What can be exported? =====================
+__all__ = ['SharedArray', 'read_shared_array']
+
+
+class SharedArray:
+    """
+    A copy of *array* in a block of shared memory. Only the small ``descriptor`` needs to be sent to
+    the worker processes, which then call ``read_shared_array`` on it.
+
+    The block is freed by ``unlink``, or when leaving the ``with`` statement.
+
+    :param array: The array to be shared.
+    """
+
+    def __init__(self, array):
+        array = np.asarray(array)
+        self._shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.array = np.ndarray(array.shape, dtype=array.dtype, buffer=self._shm.buf)
+        np.copyto(self.array, array)
+
+    @property
+    def descriptor(self) -> Tuple[str, Tuple[int, ...], str]:
+        """
+        :return: The name of the shared memory block, the shape and the dtype of the array.
+        """
+        return self._shm.name, self.array.shape, self.array.dtype.str
+
+    def unlink(self):
+        del self.array
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.unlink()
+
+
+def read_shared_array(descriptor, key=Ellipsis):
+    """
+    Copy a block of the array of a ``SharedArray`` from another process. Only the block is copied,
+    the rest of the array is never read.
+
+    :param descriptor: The ``descriptor`` of the ``SharedArray``.
+    :param key: The index of the block, e.g., ``(slice(None), slice(0, 3))``, the whole array by default.
+    :return: A copy of the block.
+    """
+    name, shape, dtype = descriptor
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        block = np.array(array[key])
+        del array  # No view of the buffer may survive ``close``.
+    finally:
+        shm.close()
+    return block
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+.. module stage_graph
+   :platform: Unix, Windows, Mac, Linux
+   :synopsis: A small dependency graph of named computation stages, each of which is computed once,
+    memoized, and released as soon as no later stage needs it.
+"""
+
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+# ===================== What can be exported? =====================
+__all__ = ['StageGraph']
+
+
+class StageGraph:
+    """
+    A graph of named stages. A stage is a function whose arguments are the results of the stages it depends on.
+
+    Every stage is computed at most once and its result is memoized. If the wanted results are declared
+    by ``plan`` (or ``evaluate``), the number of consumers of each stage is counted, and a memoized result
+    is released as soon as its last consumer has run. Stages outside of a plan are kept until the graph is
+    dropped. Asking for a released stage again computes it again.
+
+    Stages must be added after the stages they depend on, so the order of adding is a topological order,
+    which is also the order of evaluation.
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, Tuple[Callable, Tuple[str, ...]]] = {}
+        self._results: Dict[str, Any] = {}
+        self._consumers: Dict[str, int] = {}
+
+    def add(self, name: str, function: Callable, dependencies: Tuple[str, ...] = ()):
+        """
+        Add a stage.
+
+        :param name: The name of the stage.
+        :param function: A function called with the results of *dependencies*, in the same order.
+        :param dependencies: The names of the stages this stage depends on, which must be added already.
+        """
+        for dependency in dependencies:
+            if dependency not in self._stages:
+                raise ValueError("Stage '{0}' depends on unknown stage '{1}'!".format(name, dependency))
+        self._stages[name] = (function, tuple(dependencies))
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._stages
+
+    def is_computed(self, name: str) -> bool:
+        """
+        :return: ``True`` if the result of stage *name* is currently memoized, otherwise ``False``.
+        """
+        return name in self._results
+
+    def plan(self, *targets: str) -> List[str]:
+        """
+        Declare the stages whose results will be asked for, and count how many consumers each needed stage has.
+
+        :param targets: The names of the wanted stages.
+        :return: The names of the stages to be computed, in evaluation order.
+        """
+        needed = set()
+
+        def visit(name):
+            if name not in self._stages:
+                raise KeyError("Unknown stage '{0}'!".format(name))
+            if name in needed or name in self._results:
+                return
+            needed.add(name)
+            for dependency in self._stages[name][1]:
+                visit(dependency)
+
+        targets = tuple(dict.fromkeys(targets))
+        for target in targets:
+            visit(target)
+
+        consumers: Dict[str, int] = {}
+        for name in needed:
+            for dependency in self._stages[name][1]:
+                consumers[dependency] = consumers.get(dependency, 0) + 1
+        for target in targets:
+            consumers[target] = consumers.get(target, 0) + 1
+        self._consumers = consumers
+        return [name for name in self._stages if name in needed]
+
+    def evaluate(self, *targets: str) -> Iterator[Tuple[str, Any]]:
+        """
+        Compute the stages needed by *targets* in evaluation order, and yield each target as soon as it is ready.
+        Intermediate results are released when their last consumer has run.
+
+        :param targets: The names of the wanted stages.
+        :return: A generator of ``(name, result)`` of the *targets*.
+        """
+        targets = tuple(dict.fromkeys(targets))
+        order = self.plan(*targets)
+        for name in order:
+            self._compute(name)
+            if name in targets:
+                yield name, self.get(name)
+        for name in targets:
+            if name not in order:  # It was memoized before the plan.
+                yield name, self.get(name)
+
+    def get(self, name: str):
+        """
+        :return: The result of stage *name*, computed if not memoized.
+        """
+        result = self._compute(name)
+        self._release(name)
+        return result
+
+    def _compute(self, name: str):
+        if name not in self._results:
+            function, dependencies = self._stages[name]
+            arguments = [self._compute(dependency) for dependency in dependencies]
+            self._results[name] = function(*arguments)
+            del arguments
+            for dependency in dependencies:
+                self._release(dependency)
+        return self._results[name]
+
+    def _release(self, name: str):
+        if name not in self._consumers:
+            return
+        self._consumers[name] -= 1
+        if self._consumers[name] <= 0:
+            del self._consumers[name]
+            self._results.pop(name, None)
@@ -1,12 +1,13 @@
 import numpy as np
+from numba import jit, prange
 
 
 def find_value(value, target_list):
     """
     find index of the value in a target list
     """
-    target_list = np.array(target_list)
-    return np.argmin(np.abs(target_list - value))
+    return int(find_nearest(target_list, value)[0])
+
 
 def vectorized_find_nearest(array, values, result):
     """
@@ -16,30 +17,182 @@ def vectorized_find_nearest(array, values, result):
     :param result: An array of indices. It is suggested to generate a vector of zeros by ``numpy`` package.
     :return: The *result*, an array of indices mentioned above.
     """
-    n: int = len(array)
-
     if len(values) != len(result):
         raise ValueError('The *values* and *result* arguments should have same length!')
+    result[:] = bracket_indices(array, values)
+    return result
+
+
+def bracket_indices(array, values):
+    """
+    For each of *values*, the index ``j`` with ``array[j] <= value < array[j + 1]``, found by binary search.
+    A value below ``array[0]`` gets 0 and a value at or above ``array[-1]`` gets ``len(array) - 2``.
+
+    :param array: An array of monotonic increasing real numbers, with at least 2 elements.
+    :param values: An array of values in any order.
+    :return: An integer array of the indices, with the same length as *values*.
+    """
+    return _bracket_indices(np.asarray(array, dtype=float), np.atleast_1d(np.asarray(values, dtype=float)))
+
+
+def merge_brackets(array, values):
+    """
+    The same as ``bracket_indices``, for *values* sorted in increasing order: both arrays are walked once
+    side by side, in :math:`O(N + M)` instead of :math:`O(M \\log N)`.
+
+    :param array: An array of monotonic increasing real numbers, with at least 2 elements.
+    :param values: An array of values in increasing order.
+    :return: An integer array of the indices, with the same length as *values*.
+    """
+    return _merge_brackets(np.asarray(array, dtype=float), np.atleast_1d(np.asarray(values, dtype=float)))
+
+
+def find_nearest(array, values):
+    """
+    For each of *values*, the index of the element of *array* nearest to it, the first one if there are ties,
+    i.e., ``numpy.argmin(numpy.abs(array - value))`` for all values at once.
+    If *array* is increasing, the nearest elements are found from the brackets, otherwise by a linear scan.
+
+    :param array: An array of real numbers.
+    :param values: A value or an array of values.
+    :return: An integer array of the indices, with the same length as *values*.
+    """
+    array = np.asarray(array, dtype=float)
+    values = np.atleast_1d(np.asarray(values, dtype=float))
+    if len(array) > 1 and np.all(np.diff(array) > 0):
+        return _nearest_sorted(array, values)
+    return _nearest_scan(array, values)
+
+
+def find_nearest_in_rows(matrix, rows, values):
+    """
+    For each pair of ``rows[i]`` and ``values[i]``, the index of the element in the row ``matrix[rows[i]]``
+    nearest to ``values[i]``, as ``find_nearest`` does for a single row.
+
+    :param matrix: A 2D array.
+    :param rows: An integer array of row indices.
+    :param values: An array of values, with the same length as *rows*.
+    :return: An integer array of the column indices.
+    """
+    rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+    values = np.atleast_1d(np.asarray(values, dtype=float))
+    if rows.shape != values.shape:
+        raise ValueError('The *rows* and *values* arguments should have same length!')
+    return _nearest_in_rows(np.asarray(matrix, dtype=float), rows, values)
+
+
+def interpolate_in_rows(matrix, rows, values, ys):
+    """
+    For each pair of ``rows[i]`` and ``values[i]``, the linear interpolation of *ys* at ``values[i]``
+    against the row ``matrix[rows[i]]``, i.e., ``numpy.interp(values[i], matrix[rows[i]], ys)`` for all pairs at once.
+    A value outside of its row gives ``nan``.
+
+    :param matrix: A 2D array, each row of which is monotonic increasing.
+    :param rows: An integer array of row indices.
+    :param values: An array of values, with the same length as *rows*.
+    :param ys: A vector of the values to be interpolated, with the same length as the rows of *matrix*.
+    :return: An array of the interpolated values, with the same length as *values*.
+    """
+    rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+    values = np.atleast_1d(np.asarray(values, dtype=float))
+    if rows.shape != values.shape:
+        raise ValueError('The *rows* and *values* arguments should have same length!')
+    return _interpolate_in_rows(np.asarray(matrix, dtype=float), rows, values, np.asarray(ys, dtype=float))
+
+
+@jit(nopython=True, cache=True)
+def _bracket(array, value):
+    n = array.shape[0]
+    if value < array[0]:
+        return 0
+    if value >= array[n - 1]:
+        return n - 2
+    j_low = 0  # Initialize lower limit.
+    j_up = n - 1  # Initialize upper limit.
+    while j_up - j_low > 1:  # If we are not yet done,
+        j_mid = (j_up + j_low) // 2  # compute a midpoint,
+        if value >= array[j_mid]:
+            j_low = j_mid  # and replace either the lower limit
+        else:
+            j_up = j_mid  # or the upper limit, as appropriate.
+    return j_low
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _bracket_indices(array, values):
+    result = np.empty(values.shape[0], dtype=np.int64)
+    for i in prange(values.shape[0]):
+        result[i] = _bracket(array, values[i])
+    return result
+
+
+@jit(nopython=True, cache=True)
+def _merge_brackets(array, values):
+    n = array.shape[0]
+    result = np.empty(values.shape[0], dtype=np.int64)
+    j = 0
+    for i in range(values.shape[0]):
+        # The brackets of increasing values never move back
+        while j < n - 2 and values[i] >= array[j + 1]:
+            j += 1
+        result[i] = j
+    return result
+
+
+@jit(nopython=True, cache=True)
+def _nearest_in_sorted(array, value):
+    j = _bracket(array, value)
+    # The upper neighbor only wins if it is strictly nearer, so ties go to the first index like ``argmin``
+    if abs(array[j + 1] - value) < abs(array[j] - value):
+        return j + 1
+    return j
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _nearest_sorted(array, values):
+    result = np.empty(values.shape[0], dtype=np.int64)
+    for i in prange(values.shape[0]):
+        result[i] = _nearest_in_sorted(array, values[i])
+    return result
+
+
+@jit(nopython=True, cache=True)
+def _nearest_in_row(row, value):
+    best = 0
+    for j in range(1, row.shape[0]):
+        if abs(row[j] - value) < abs(row[best] - value):
+            best = j
+    return best
+
 
-    for i in range(len(values)):
+@jit(nopython=True, parallel=True, cache=True)
+def _nearest_scan(array, values):
+    result = np.empty(values.shape[0], dtype=np.int64)
+    for i in prange(values.shape[0]):
+        result[i] = _nearest_in_row(array, values[i])
+    return result
 
-        if values[i] <= array[0]:
-            result[i] = 0
-        elif values[i] >= array[-1]:
-            result[i] = n - 2
 
-        j_low = 0  # Initialize lower limit.
-        j_up = n - 1  # Initialize upper limit.
+@jit(nopython=True, parallel=True, cache=True)
+def _nearest_in_rows(matrix, rows, values):
+    result = np.empty(values.shape[0], dtype=np.int64)
+    for i in prange(values.shape[0]):
+        result[i] = _nearest_in_row(matrix[rows[i]], values[i])
+    return result
 
-        while j_up - j_low > 1:  # If we are not yet done,
-            j_mid: int = (j_up + j_low) // 2  # compute a midpoint,
-            if values[i] >= array[j_mid]:
-                j_low = j_mid  # and replace either the lower limit
-            else:
-                j_up = j_mid  # or the upper limit, as appropriate.
-            # Repeat until the test condition is satisfied.
 
-        result[i] = j_low
+@jit(nopython=True, parallel=True, cache=True)
+def _interpolate_in_rows(matrix, rows, values, ys):
+    result = np.empty(values.shape[0])
+    n = matrix.shape[1]
+    for i in prange(values.shape[0]):
+        row, value = matrix[rows[i]], values[i]
+        if not row[0] <= value <= row[n - 1]:
+            result[i] = np.nan
+            continue
+        j = _bracket(row, value)
+        result[i] = ys[j] + (value - row[j]) / (row[j + 1] - row[j]) * (ys[j + 1] - ys[j])
+    return result
 
 
 def is_monotonic_decreasing(array) -> bool:
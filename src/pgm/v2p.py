@@ -8,16 +8,16 @@
 .. moduleauthor:: Hongjin Wang <hw2626@columbia.edu>
 """
 
-# import numba
 import numpy as np
+from numba import jit, prange
 
-from pgm.util.tools import find_value, vectorized_find_nearest
+from pgm.util.tools import is_monotonic_increasing, _bracket, _merge_brackets
 
 # ===================== What can be exported? =====================
-__all__ = ['v2p']
+__all__ = ['v2p', 'V2PPlan']
 
 
-# @numba.jit(nopython=True, parallel=True)
+@jit(nopython=True, cache=True, error_model='numpy')
 def lagrange4(x: float, x0, x1, x2, x3, y0, y1, y2, y3) -> float:
     """
     A third-order Lagrange polynomial function. Given 4 points for interpolation:
@@ -52,45 +52,105 @@ def v2p(func_of_t_v, p_of_t_v, desired_pressures):
     :param desired_pressures: A vector of pressures which user wants to apply.
     :return: The interpolated function :math:`f` on :math:`(T, P)` grid.
     """
-    # Assume the function is temperature in row and volume in column
-    t_amount, v_amount = func_of_t_v.shape
+    return V2PPlan(p_of_t_v, desired_pressures).apply(func_of_t_v)
 
-    desired_pressures_amount = len(desired_pressures)
 
-    result = np.empty((t_amount, desired_pressures_amount))
+class V2PPlan:
+    """
+    The interpolation of ``v2p`` from a fixed :math:`P(T, V)` to fixed desired pressures, planned once.
 
-    # Put three parts together
-    # third column, function tv, last fourth column
-    # TODO: Still confused of the artificial choice of 3 and -4. Why? Can't I just use 0 and -1 lmao?
-    extended_f = np.hstack(
-        (func_of_t_v[:, 0].reshape(-1, 1), func_of_t_v, func_of_t_v[:, -1].reshape(-1, 1)))
-    extended_p = np.hstack(
-        (p_of_t_v[:, 0].reshape(-1, 1), p_of_t_v, p_of_t_v[:, -1].reshape(-1, 1)))
+    The bracketing of the desired pressures and the weights of the 4-point Lagrange stencils only depend on
+    :math:`P(T, V)` and the desired pressures, so they are computed once here. Then every :math:`f(T, V)` is
+    converted by ``apply`` as a gather of 4 values and a weighted sum per point, with exactly the same result
+    as ``v2p``.
 
-    # Proceed row by row
-    for i in range(t_amount):
-        rs = np.zeros(desired_pressures_amount)
+    :param p_of_t_v: Pressures on :math:`(T, V)` grid, which has
+        shape: (number of temperature, number of volumes).
+    :param desired_pressures: A vector of pressures which user wants to apply.
+    """
 
-        # Search desired pressures in the extended p array
-        if (np.min(desired_pressures) > np.max(extended_p[i])) or (np.max(desired_pressures) < np.min(extended_p[i])):
+    def __init__(self, p_of_t_v, desired_pressures):
+        p_of_t_v = np.asarray(p_of_t_v, dtype=float)
+        desired_pressures = np.asarray(desired_pressures, dtype=float)
+        # The first and the last pressures are repeated at both ends, like the original row-by-row ``v2p``
+        if np.any(np.min(desired_pressures) > np.max(p_of_t_v, axis=1)) or \
+                np.any(np.max(desired_pressures) < np.min(p_of_t_v, axis=1)):
             raise ValueError("Desired pressure is out of bound. Try to change the volume expansion ratio.")
+        self.shape = p_of_t_v.shape
+        # The start of the stencil of each (T, P) in the extended row, with shape (nt, np),
+        # and the weights of the stencils, with shape (nt, np, 4)
+        self.starts, self.weights = _v2p_stencils(p_of_t_v, desired_pressures,
+                                                  is_monotonic_increasing(desired_pressures))
+
+    def apply(self, func_of_t_v):
+        """
+        Convert :math:`f(T, V)` to :math:`f(T, P)`, or a stack of them at once.
+
+        :param func_of_t_v: Any function :math:`f` on the :math:`(T, V)` grid of the plan, or a stack of
+            such functions with shape (number of quantities, number of temperature, number of volumes).
+            A stack is converted in one pass, which reads the stencils of each :math:`(T, P)` point only once.
+        :return: The interpolated function :math:`f` on :math:`(T, P)` grid, or the stack of them.
+        """
+        func_of_t_v = np.asarray(func_of_t_v, dtype=float)
+        if func_of_t_v.shape[-2:] != self.shape or func_of_t_v.ndim not in (2, 3):
+            raise ValueError("The shape of the function {0} is different from the (T, V) grid {1} of the plan!"
+                             .format(func_of_t_v.shape, self.shape))
+        if func_of_t_v.ndim == 2:
+            return _apply_stencils(func_of_t_v[None], self.starts, self.weights)[0]
+        return _apply_stencils(func_of_t_v, self.starts, self.weights)
+
+
+@jit(nopython=True, parallel=True, cache=True, error_model='numpy')
+def _v2p_stencils(p_of_t_v, desired_pressures, sorted_pressures):
+    """
+    The stencils of ``V2PPlan``, parallel over the temperatures. Each row brackets all the desired pressures,
+    in one merge walk if they are sorted, the stencil is the 4 points starting at each bracket, shifted inwards
+    at the ends of the row, and its weights are the Lagrange basis polynomials evaluated as in ``lagrange4``.
+    """
+    t_amount, v_amount = p_of_t_v.shape
+    n = v_amount + 2  # Length of a row extended by its first and last pressures
+    desired_pressures_amount = desired_pressures.shape[0]
+    starts = np.empty((t_amount, desired_pressures_amount), dtype=np.int32)
+    weights = np.empty((t_amount, desired_pressures_amount, 4))
+    for i in prange(t_amount):
+        extended_p = np.empty(n)
+        extended_p[0] = p_of_t_v[i, 0]
+        extended_p[1:n - 1] = p_of_t_v[i]
+        extended_p[n - 1] = p_of_t_v[i, v_amount - 1]
+        # The index k of each desired pressure, with extended_p[k] <= p < extended_p[k + 1]
+        if sorted_pressures:
+            ks = _merge_brackets(extended_p, desired_pressures)
         else:
-            vectorized_find_nearest(extended_p[i], desired_pressures, rs)
-
+            ks = np.empty(desired_pressures_amount, dtype=np.int64)
+            for j in range(desired_pressures_amount):
+                ks[j] = _bracket(extended_p, desired_pressures[j])
+        for j in range(desired_pressures_amount):
+            # The stencil is kept within the row, without its repeated first and last pressures at the ends
+            k = min(max(ks[j], 1), n - 5)
+            starts[i, j] = k
+            x = desired_pressures[j]
+            x0, x1, x2, x3 = extended_p[k], extended_p[k + 1], extended_p[k + 2], extended_p[k + 3]
+            weights[i, j, 0] = (x - x1) * (x - x2) * (x - x3) / (x0 - x1) / (x0 - x2) / (x0 - x3)
+            weights[i, j, 1] = (x - x0) * (x - x2) * (x - x3) / (x1 - x0) / (x1 - x2) / (x1 - x3)
+            weights[i, j, 2] = (x - x0) * (x - x1) * (x - x3) / (x2 - x0) / (x2 - x1) / (x2 - x3)
+            weights[i, j, 3] = (x - x0) * (x - x1) * (x - x2) / (x3 - x0) / (x3 - x1) / (x3 - x2)
+    return starts, weights
+
+
+@jit(nopython=True, parallel=True, cache=True)
+def _apply_stencils(funcs_of_t_v, starts, weights):
+    """
+    Gather the 4 values of each stencil of ``V2PPlan`` and sum them with their weights, in the order of ``lagrange4``,
+    for every function in the stack *funcs_of_t_v* of shape (nf, nt, nv).
+    """
+    f_amount = funcs_of_t_v.shape[0]
+    t_amount, desired_pressures_amount = starts.shape
+    result = np.empty((f_amount, t_amount, desired_pressures_amount))
+    for i in prange(t_amount):
         for j in range(desired_pressures_amount):
-            # The index of found desired pressure in the extended p
-            k = int(rs[j])
-            # print(k)
-            # print(rs)
-
-            # Solve the unpacked errors
-            if k >= desired_pressures_amount - 4:
-                x1 = x2 = x3 = x4 = extended_p[i, -1]
-                f1 = f2 = f3 = f4 = extended_f[i, -1]
-            else:
-                x1, x2, x3, x4 = extended_p[i, k: k + 4]
-                f1, f2, f3, f4 = extended_f[i, k: k + 4]
-
-            result[i, j] = lagrange4(
-                desired_pressures[j], x1, x2, x3, x4, f1, f2, f3, f4)
+            k = starts[i, j] - 1  # The first volume of the stencil, back from the extended row
+            w0, w1, w2, w3 = weights[i, j, 0], weights[i, j, 1], weights[i, j, 2], weights[i, j, 3]
+            for q in range(f_amount):
+                result[q, i, j] = w0 * funcs_of_t_v[q, i, k] + w1 * funcs_of_t_v[q, i, k + 1] + \
+                                  w2 * funcs_of_t_v[q, i, k + 2] + w3 * funcs_of_t_v[q, i, k + 3]
     return result
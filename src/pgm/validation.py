@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+.. module validation
+   :platform: Unix, Windows, Mac, Linux
+   :synopsis: Measure the error of the single-precision mode, by comparing its free energy and derived
+    thermodynamic properties against the double-precision run of the same settings, and the error of the
+    temperature integration against a run on a much finer temperature grid.
+"""
+
+import copy
+
+import numpy as np
+import pandas as pd
+
+from .calculator import FreeEnergyCalculation
+from .settings import Settings
+from .thermo import ThermodynamicProperties
+from .util.unit_conversion import gpa_to_ry_b3, ry_b3_to_gpa, ry_to_j_mol, ry_to_ev
+
+# ===================== What can be exported? =====================
+__all__ = ['PROPERTIES', 'thermodynamic_properties', 'compare_precision', 'compare_integration']
+
+# The output name of each property, and how to get it from ``ThermodynamicProperties`` in output units
+PROPERTIES = {
+    'ftv_ev_a3': lambda thermo: ry_to_ev(thermo.energy),
+    'ptv_gpa_K_a3': lambda thermo: ry_b3_to_gpa(thermo.p_tv),
+    'stv_ev_K_a3': lambda thermo: ry_to_ev(thermo.s_tv),
+    'utp_ev_K_gpa': lambda thermo: ry_to_ev(thermo.u_tp),
+    'htp_ev_T_gpa': lambda thermo: ry_to_ev(thermo.h_tp),
+    'gtp_ev_T_gpa': lambda thermo: ry_to_ev(thermo.g_tp),
+    'alpha_tp_K_gpa': lambda thermo: thermo.alpha_tp,
+    'bt_tp_gpa_K_gpa': lambda thermo: ry_b3_to_gpa(thermo.bt_tp),
+    'gamma_tp_K_gpa': lambda thermo: thermo.gamma_tp,
+    'bs_tp_gpa_K_gpa': lambda thermo: ry_b3_to_gpa(thermo.bs_tp),
+    'cv_tp_jmol_K_gpa': lambda thermo: ry_to_j_mol(thermo.cv_tp),
+    'cp_tp_jmol_K_gpa': lambda thermo: ry_to_j_mol(thermo.cp_tp),
+}
+
+
+def thermodynamic_properties(user_settings: Settings, precision: str, **changes) -> ThermodynamicProperties:
+    """
+    Run the free energy calculation of *user_settings* in the given *precision*.
+
+    :param user_settings: The settings of the calculation, which are not modified.
+    :param precision: Either ``'float32'`` or ``'float64'``.
+    :param changes: Other settings to be changed, e.g., ``NT`` or ``integration``.
+    :return: The thermodynamic properties of the run.
+    """
+    user_settings = copy.copy(user_settings)
+    user_settings.precision = precision
+    for name, value in changes.items():
+        setattr(user_settings, name, value)
+    if 'NT' in changes:
+        user_settings.continuous_temperature = np.linspace(user_settings.temperature[0],
+                                                           user_settings.temperature[-1], user_settings.NT)
+    calc = FreeEnergyCalculation(user_settings)
+    targets = ['free_energy', 'volumes']
+    if calc.volume_derivatives == 'analytic':
+        targets.append('strain_polynomial')
+    if calc.temperature_derivatives == 'analytic':
+        targets.extend(['entropy', 'heat_capacity'])
+    results = dict(zip(targets, calc.evaluate(*targets)))
+    return ThermodynamicProperties(results['volumes'], calc.continuous_temperature, gpa_to_ry_b3(calc.pressures),
+                                   results['free_energy'], results.get('strain_polynomial'),
+                                   results.get('entropy'), results.get('heat_capacity'))
+
+
+def compare_precision(user_settings: Settings, precision: str = 'float32') -> pd.DataFrame:
+    """
+    Compare the free energy and the derived properties of a run in *precision* against the float64 run.
+
+    :param user_settings: The settings of the calculation.
+    :param precision: The precision to be validated.
+    :return: A table with one row per property, holding the maximum absolute error over the whole grid,
+        and the relative error, i.e., the maximum absolute error divided by the maximum magnitude of the property.
+    """
+    reference = thermodynamic_properties(user_settings, 'float64')
+    result = thermodynamic_properties(user_settings, precision)
+    rows = []
+    for name, get_property in PROPERTIES.items():
+        expected, actual = get_property(reference), get_property(result)
+        max_abs_error = np.nanmax(np.abs(actual - expected))
+        rows.append({'property': name, 'max_abs_error': max_abs_error,
+                     'rel_error': max_abs_error / np.nanmax(np.abs(expected))})
+    return pd.DataFrame(rows).set_index('property')
+
+
+def compare_integration(user_settings: Settings, nts, schemes=('trapezoid', 'simpson', 'cubic'),
+                        reference_nt: int = 1601, edge: int = 2) -> pd.DataFrame:
+    """
+    Measure how the error of every output converges with the number of temperatures, for each temperature
+    integration scheme, with the temperature derivatives of *user_settings*. The reference is a ``'cubic'`` run
+    with analytic temperature derivatives, whose grid holds the temperatures of every run, i.e., at least
+    *reference_nt* temperatures, such that the number of intervals is a multiple of those of every run.
+    The error of the reference itself is estimated against a run with twice as many intervals,
+    and reported as the row ``('reference', number of temperatures)``.
+
+    :param user_settings: The settings of the calculation.
+    :param nts: The numbers of temperatures to be run.
+    :param schemes: The integration schemes to be run.
+    :param reference_nt: The least number of temperatures of the reference run.
+    :param edge: The number of temperatures at each end left out, where the temperature derivatives are
+        one-sided.
+    :return: A table with one row per scheme and number of temperatures, holding the relative error of every
+        output, i.e., the maximum absolute error divided by the maximum magnitude of the output.
+    """
+    intervals = int(np.lcm.reduce([nt - 1 for nt in nts]))
+    intervals *= -(-(reference_nt - 1) // intervals)
+
+    def run(nt, scheme, temperature_derivatives):
+        return thermodynamic_properties(user_settings, 'float64', NT=nt, integration=scheme,
+                                        temperature_grid='uniform', temperature_derivatives=temperature_derivatives)
+
+    def errors(actual, expected, step):
+        row = {}
+        for name, get_property in PROPERTIES.items():
+            wanted = get_property(expected)[::step][edge:-edge]
+            row[name] = np.nanmax(np.abs(get_property(actual)[edge:-edge] - wanted)) / np.nanmax(np.abs(wanted))
+        return row
+
+    reference = run(intervals + 1, 'cubic', 'analytic')
+    finer = run(2 * intervals + 1, 'cubic', 'analytic')
+    rows = [{'scheme': 'reference', 'NT': intervals + 1, **errors(reference, finer, 2)}]
+    del finer
+    for scheme in schemes:
+        for nt in nts:
+            result = run(nt, scheme, user_settings.temperature_derivatives)
+            rows.append({'scheme': scheme, 'NT': nt, **errors(result, reference, intervals // (nt - 1))})
+    return pd.DataFrame(rows).set_index(['scheme', 'NT'])
@@ -0,0 +1,141 @@
+import numpy
+import pytest
+from pgm.calculator import FreeEnergyCalculation, entropy, integrate, vibrational_entropies, zero_point_energy, \
+    streamed_vibrational_entropies, streamed_vibrational_heat_capacities, HBAR, K
+from pgm.settings import Settings, DEFAULT_SETTINGS
+from pgm.util.unit_conversion import gpa_to_ry_b3
+
+temperatures = numpy.array([0.0, 10.0, 300.0, 1000.0, 4000.0])
+
+
+def reference_entropy(temperature, frequency, weights):
+    frequency = numpy.where(frequency < 0, 0.0, frequency)
+    with numpy.errstate(all='ignore'):
+        hw_2kt = HBAR * frequency / (2 * K * temperature)
+        result = K * (hw_2kt / numpy.tanh(hw_2kt) - numpy.log(2 * numpy.sinh(hw_2kt)))
+    return numpy.dot(numpy.nan_to_num(result).sum(axis=2), weights / numpy.sum(weights))
+
+
+@pytest.fixture
+def frequencies():
+    rng = numpy.random.default_rng(0)
+    freq = rng.uniform(-50, 800, size=(len(temperatures), 4, 6, 9))
+    freq[:, :, 0, :3] = 0.0  # acoustic modes at Gamma
+    return freq
+
+
+def test_vibrational_entropies(frequencies):
+    weights = numpy.arange(1.0, 7.0)
+    s_vib = vibrational_entropies(temperatures, frequencies, weights)
+    assert s_vib.shape == (len(temperatures), 4)
+    for i, t in enumerate(temperatures):
+        numpy.testing.assert_allclose(s_vib[i], reference_entropy(t, frequencies[i], weights), rtol=1e-12)
+        numpy.testing.assert_array_equal(s_vib[i], entropy(t, frequencies[i], weights))
+    assert numpy.all(s_vib[0] == 0.0)
+
+
+def test_zero_point_energy(frequencies):
+    weights = numpy.arange(1.0, 7.0)
+    expected = numpy.dot((HBAR / 2 * numpy.clip(frequencies[0], 0, None)).sum(axis=2), weights / weights.sum())
+    numpy.testing.assert_allclose(zero_point_energy(frequencies[0], weights), expected, rtol=1e-12)
+
+
+def test_vibrational_heat_capacities():
+    # C_V = T dS/dT with the frequencies changing with temperature, against central differences of S
+    rng = numpy.random.default_rng(1)
+    p_coeffs = numpy.stack([rng.uniform(-2e-6, 2e-6, (4, 6, 9)), rng.uniform(-0.02, 0.02, (4, 6, 9)),
+                            rng.uniform(-50, 800, (4, 6, 9))])
+    weights = numpy.arange(1.0, 7.0)
+    ts, dt = numpy.linspace(20, 4000, 17), 1e-3
+    cv = streamed_vibrational_heat_capacities(p_coeffs, ts, weights, 5)
+    expected = ts[:, None] * (streamed_vibrational_entropies(p_coeffs, ts + dt, weights, 5) -
+                              streamed_vibrational_entropies(p_coeffs, ts - dt, weights, 5)) / (2 * dt)
+    numpy.testing.assert_allclose(cv, expected, rtol=1e-6)
+
+
+def test_analytic_temperature_derivatives():
+    settings = dict(DEFAULT_SETTINGS, folder='examples/feo/%sK.txt', temperature=[0, 1000, 2000, 3000, 4000],
+                    NT=401, NV=201, temperature_derivatives='analytic')
+    calc = FreeEnergyCalculation(Settings(settings))
+    free_energies, entropies, heat_capacities = calc.evaluate('free_energy', 'entropy', 'heat_capacity')
+    ts = calc.continuous_temperature
+    # Up to the error of the central differences, largest at the lowest temperatures
+    numpy.testing.assert_allclose(entropies[1:-1], -numpy.gradient(free_energies, ts, axis=0)[1:-1], rtol=0,
+                                  atol=1e-3 * numpy.abs(entropies).max())
+    numpy.testing.assert_allclose(heat_capacities[2:-2], ts[2:-2, None] * numpy.gradient(entropies, ts, axis=0)[2:-2],
+                                  rtol=0, atol=2e-3 * heat_capacities.max())
+    blocked = FreeEnergyCalculation(Settings(dict(settings, workers=2)))
+    numpy.testing.assert_array_equal(blocked.evaluate('heat_capacity')[0], heat_capacities)
+    with pytest.raises(KeyError):
+        FreeEnergyCalculation(Settings(dict(settings, temperature_derivatives='numerical'))).evaluate('entropy')
+
+
+@pytest.mark.parametrize("workers,store", [(2, False), (1, True), (2, True)])
+def test_volume_blocks_bit_identical(tmp_path, workers, store):
+    settings = dict(DEFAULT_SETTINGS, folder='examples/feo/%sK.txt', temperature=[0, 1000, 2000, 3000, 4000],
+                    NT=41, NV=201)
+    serial = FreeEnergyCalculation(Settings(settings)).evaluate('free_energy', 'volumes')
+    frequency_store = str(tmp_path / 'frequencies.npy') if store else None
+    blocked = FreeEnergyCalculation(Settings(dict(settings, workers=workers, frequency_store=frequency_store)))
+    for expected, result in zip(serial, blocked.evaluate('free_energy', 'volumes')):
+        numpy.testing.assert_array_equal(result, expected)
+
+
+def test_adaptive_temperature_grid():
+    settings = dict(DEFAULT_SETTINGS, folder='examples/feo/%sK.txt', temperature=[0, 1000, 2000, 3000, 4000],
+                    NT=41, NV=201, temperature_grid='adaptive')
+    calc = FreeEnergyCalculation(Settings(settings))
+    free_energies, _ = calc.evaluate('free_energy', 'volumes')
+    ts = calc.continuous_temperature
+    assert free_energies.shape == (41, 201) and ts[0] == 0 and ts[-1] == 4000
+    steps = numpy.diff(ts)
+    # Denser where the heat capacity rises, at low temperature, but never sparser than twice the uniform spacing
+    assert steps[0] < 50 and steps.max() <= 2 * 100
+    blocked = FreeEnergyCalculation(Settings(dict(settings, workers=2)))
+    numpy.testing.assert_array_equal(blocked.evaluate('free_energy')[0], free_energies)
+    numpy.testing.assert_array_equal(blocked.continuous_temperature, ts)
+
+
+def test_integrate():
+    rng = numpy.random.default_rng(1)
+    ts = numpy.sort(rng.uniform(0, 4000, 57))
+    entropies = rng.uniform(0, 1e-3, (57, 33))
+    areas = numpy.cumsum(numpy.diff(ts)[:, None] * (entropies[1:] + entropies[:-1]) / 2.0, axis=0)
+    expected = -numpy.concatenate((entropies[:1], areas))
+    out = numpy.empty_like(entropies)
+    assert integrate(ts, entropies, out) is out
+    numpy.testing.assert_array_equal(out, expected)
+
+
+@pytest.mark.parametrize('scheme, degree', [('simpson', 2), ('cubic', 3)])
+def test_integrate_schemes(scheme, degree):
+    # Exact for a polynomial entropy of the degree of the stencil, on non-uniform temperatures
+    ts = numpy.sort(numpy.random.default_rng(2).uniform(0, 4000, 23))
+    ts[0] = 0
+    coefficients = numpy.linspace(1, 2, degree + 1)[::-1] * 10.0 ** -(3 * numpy.arange(degree + 1))
+    entropies = numpy.polyval(coefficients, ts)[:, None].repeat(3, axis=1)
+    expected = -numpy.polyval(numpy.polyint(coefficients), ts)
+    result = integrate(ts, entropies, scheme=scheme)
+    numpy.testing.assert_allclose(result[1:], expected[1:, None].repeat(3, axis=1), rtol=1e-10)
+    numpy.testing.assert_array_equal(result[0], -entropies[0])
+    with pytest.raises(ValueError):
+        integrate(ts[:degree], entropies[:degree], scheme=scheme)
+
+
+def test_auto_ratio():
+    settings = dict(DEFAULT_SETTINGS, folder='examples/feo/%sK.txt', temperature=[0, 1000, 2000, 3000, 4000],
+                    NT=21, NV=201, initP=200, finalP=400, ratio='auto')
+    calc = FreeEnergyCalculation(Settings(settings))
+    free_energies, volumes = calc.evaluate('free_energy', 'volumes')
+    assert 1 < calc.ratio < 1.2
+    # The desired pressures lie within the dense volumes but the 6 at each end, at every temperature
+    pressures = -numpy.gradient(free_energies, volumes, axis=1)
+    assert (gpa_to_ry_b3(400) <= pressures[:, -7]).all() and (pressures[:, 6] <= gpa_to_ry_b3(200)).all()
+    with pytest.raises(ValueError, match='not covered'):
+        FreeEnergyCalculation(Settings(dict(settings, finalP=5000))).evaluate('volumes')
+
+
+def test_invalid_volume_derivatives():
+    settings = dict(DEFAULT_SETTINGS, folder='examples/feo/%sK.txt', volume_derivatives='numeric')
+    with pytest.raises(ValueError, match='volume derivatives'):
+        FreeEnergyCalculation(Settings(settings))
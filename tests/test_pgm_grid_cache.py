@@ -0,0 +1,41 @@
+import numpy
+import pytest
+from pgm.interpolate import Interpolation
+from pgm.util import grid_cache
+from pgm.util.grid_interpolation import FinerGrid, VolumeExpander
+
+volumes = numpy.linspace(170, 130, 9)
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    grid_cache.cache_clear()
+    yield
+    grid_cache.cache_clear()
+
+
+def test_shared_between_instances():
+    first, second = Interpolation(volumes, num=51, ratio=1.1), Interpolation(list(volumes), num=51, ratio=1.1)
+    assert second.out_volumes is first.out_volumes
+    assert second.projection() is first.projection()
+    info = grid_cache.cache_info()
+    assert info['strain_grid'].misses == 1
+    assert (info['least_square_projection'].misses, info['least_square_projection'].hits) == (1, 1)
+    assert Interpolation(volumes, num=51, ratio=1.2).out_volumes is not first.out_volumes
+    with pytest.raises(ValueError):
+        first.out_volumes[0] = 0
+
+
+def test_matches_volume_expander():
+    expander = VolumeExpander(volumes, 51, 1.1)
+    expander.interpolate_volumes()
+    out_volumes, out_strains, _ = grid_cache.strain_grid(volumes, 51, 1.1)
+    numpy.testing.assert_array_equal(out_volumes, expander.out_volumes)
+    numpy.testing.assert_array_equal(out_strains, expander.strains)
+
+
+def test_finer_grid():
+    energies = numpy.array([2e3 / volumes ** 2 - 1e-6 * t * volumes for t in (0, 1000, 2000)])
+    dense_volumes, dense_energies, ratio = FinerGrid(1e-4, 51).refine_grid(volumes, energies, 1.1)
+    assert ratio == 1.1 and dense_volumes is grid_cache.strain_grid(volumes, 51, 1.1)[0]
+    numpy.testing.assert_array_equal(dense_energies, Interpolation(volumes, num=51, ratio=1.1).fitting(energies))
@@ -0,0 +1,76 @@
+import numpy
+import pytest
+from pgm.interpolate import batched_polyfit, batched_polyval, fit_poly, eval_polynomial, FrequencyInterpolation, \
+    Interpolation
+from pgm.reader.read_input import Input
+from pgm.util.fitting import apply_finite_strain_fitting
+from pgm.util.grid_interpolation import equidistributed_grid
+
+discrete_temp = numpy.array([0.0, 1000.0, 2000.0, 3000.0, 4000.0])
+continuous_temp = numpy.linspace(0, 4000, 41)
+
+
+@pytest.mark.parametrize("shape", [(5, 3), (5, 3, 7, 4)])
+def test_batched_polyfit_matches_fit_poly(shape):
+    rng = numpy.random.default_rng(0)
+    ys = rng.uniform(100, 800, size=shape)
+    p_coeffs = batched_polyfit(discrete_temp, ys, 2)
+    assert p_coeffs.shape == (3,) + shape[1:]
+    result = batched_polyval(p_coeffs, continuous_temp)
+    assert result.shape == (41,) + shape[1:]
+    flat_ys = ys.reshape(5, -1)
+    flat_result = result.reshape(41, -1)
+    for c in range(flat_ys.shape[1]):
+        expected = eval_polynomial(fit_poly(discrete_temp, flat_ys[:, c].copy(), 2), continuous_temp)
+        numpy.testing.assert_allclose(flat_result[:, c], expected, rtol=1e-10)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 41])
+def test_iter_polyfit_matches_batched_polyfit(chunk_size):
+    input_instance = Input('examples/feo/%sK.txt', [0, 1000, 2000, 3000, 4000])
+    interpolation = FrequencyInterpolation(input_instance)
+    expected = interpolation.batched_polyfit(continuous_temp)
+    for start, freq in interpolation.iter_polyfit(continuous_temp, chunk_size):
+        assert len(freq) <= chunk_size
+        numpy.testing.assert_array_equal(freq, expected[start:start + len(freq)])
+
+
+def test_strain_polynomial_birch_murnaghan():
+    # Third-order Birch-Murnaghan F(V), whose B_T and B_T' at V0 are K0 and K0'
+    v0, k0, k0p = 160.0, 0.01, 4.5
+    volumes = numpy.linspace(170, 130, 9)
+    fs = 0.5 * ((v0 / volumes) ** (2 / 3) - 1)
+    energies = 4.5 * v0 * k0 * fs ** 2 * (1 + (k0p - 4) * fs)
+    inter = Interpolation(volumes, num=101, ratio=1.0)
+    polynomial = inter.strain_polynomial(numpy.array([energies, 2 * energies]))
+    numpy.testing.assert_allclose(polynomial(inter.out_volumes)[0], inter.fitting(energies), rtol=1e-10, atol=1e-14)
+    vs = numpy.array([v0])
+    numpy.testing.assert_allclose(polynomial.pressure(vs)[0], 0, atol=1e-12)
+    numpy.testing.assert_allclose(polynomial.isothermal_bulk_modulus(vs)[:, 0], [k0, 2 * k0], rtol=1e-9)
+    numpy.testing.assert_allclose(polynomial.bulk_modulus_derivative(vs)[:, 0], [k0p, k0p], rtol=1e-9)
+    # Against the numerical derivatives on a dense grid
+    dense = Interpolation(volumes, num=4001, ratio=1.0)
+    p_numerical = -numpy.gradient(dense.fitting(energies), dense.out_volumes)
+    numpy.testing.assert_allclose(polynomial.pressure(dense.out_volumes)[0, 1:-1], p_numerical[1:-1], rtol=1e-5,
+                                  atol=1e-9)
+
+
+def test_batched_strain_fitting():
+    inter = Interpolation(numpy.linspace(170, 130, 9), num=51, ratio=1.1)
+    energies = numpy.random.default_rng(3).uniform(-1, 1, (7, 9))
+    fitted = inter.fitting(energies)
+    assert fitted.shape == (7, 51)
+    for row, result in zip(energies, fitted):
+        coefficients = numpy.polyfit(inter.in_strains, row, 3)
+        numpy.testing.assert_allclose(result, numpy.polyval(coefficients, inter.out_strains), rtol=1e-9, atol=1e-12)
+    numpy.testing.assert_allclose(apply_finite_strain_fitting(inter.in_strains, energies, inter.out_strains), fitted,
+                                  rtol=1e-13, atol=1e-15)
+    assert inter.projection() is inter.projection()
+
+
+def test_equidistributed_grid():
+    xs = numpy.linspace(0, 10, 1001)
+    grid = equidistributed_grid(xs, numpy.where(xs < 2, 9.0, 0.0), 21, floor=0)
+    numpy.testing.assert_allclose(grid[[0, -1]], [0, 10])
+    assert numpy.all(numpy.diff(grid) > 0) and numpy.sum(grid < 2) >= 19
+    numpy.testing.assert_allclose(equidistributed_grid(xs, numpy.zeros_like(xs), 11), numpy.linspace(0, 10, 11))
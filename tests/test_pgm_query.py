@@ -0,0 +1,73 @@
+import numpy
+import pytest
+from pgm.interpolate import Interpolation
+from pgm.query import ThermodynamicModel
+from pgm.thermo import ThermodynamicProperties
+from pgm.util.unit_conversion import a3_to_b3, b3_to_a3, ry_b3_to_gpa, ry_to_ev, ry_to_j_mol
+
+temperatures = numpy.linspace(0, 2000, 41)
+inter = Interpolation(numpy.linspace(200, 120, 9), num=301, ratio=1.1)
+raw_energies = (2e3 / inter.in_volumes[None, :] ** 2 + 2e-7 * temperatures[:, None] * inter.in_volumes[None, :]
+                - 1e-10 * temperatures[:, None] ** 2)
+polynomial = inter.strain_polynomial(raw_energies)
+vs = inter.out_volumes
+pressures = numpy.linspace(1e-3, 2e-3, 301)
+expected = ThermodynamicProperties(vs, temperatures, pressures, polynomial(vs), polynomial)
+
+
+@pytest.fixture
+def model():
+    return ThermodynamicModel(temperatures, polynomial, vs)
+
+
+def test_at_volumes(model):
+    results = model.at_volumes(temperatures[:, None], b3_to_a3(vs), 'p', 'bt', 's', 'cv')
+    numpy.testing.assert_allclose(results['p'], ry_b3_to_gpa(expected.p_tv), rtol=1e-12, atol=1e-12)
+    numpy.testing.assert_allclose(results['bt'], ry_b3_to_gpa(expected.bt_tv), rtol=1e-12)
+    numpy.testing.assert_allclose(results['s'], ry_to_ev(expected.s_tv), rtol=1e-10, atol=1e-16)
+    numpy.testing.assert_allclose(results['cv'], ry_to_j_mol(expected.cv_tv), rtol=1e-8, atol=1e-8)
+
+
+def test_at_pressures(model):
+    results = model.at_pressures(temperatures[:, None], ry_b3_to_gpa(pressures))
+    numpy.testing.assert_allclose(a3_to_b3(results['v']), expected.v_tp, rtol=1e-8)
+    numpy.testing.assert_allclose(results['p'], numpy.broadcast_to(ry_b3_to_gpa(pressures), results['p'].shape))
+    # The finite differences of V(T, P) on the grid against the analytic (dP/dT)_V / B_T
+    numpy.testing.assert_allclose(results['alpha'][2:-2], expected.alpha_tp[2:-2], rtol=1e-3)
+
+
+def test_out_of_range(model):
+    results = model.at_pressures([-1, 1000, 3000, 1000], ry_b3_to_gpa(numpy.array([1e-3, 1e-3, 1e-3, 1])), 'v')
+    assert numpy.isnan(results['v']).tolist() == [True, False, True, True]
+
+
+def test_cache(model, tmp_path):
+    first = model.at_pressures([300, 1500.5], 20, 'v', 'cp')
+    second = model.at_pressures([300, 1500.5], 20, 'v')
+    assert model.cache_info().hits == 1
+    numpy.testing.assert_array_equal(first['v'], second['v'])
+    model.save(tmp_path / 'model.npz')
+    loaded = ThermodynamicModel.load(tmp_path / 'model.npz')
+    numpy.testing.assert_array_equal(loaded.at_pressures([300, 1500.5], 20, 'v')['v'], first['v'])
+    with pytest.raises(KeyError):
+        model.at_volumes(300, 20, 'volume')
+
+
+def test_isentropes():
+    # A heat capacity and a thermal pressure large enough to give a Grüneisen parameter of a few tenths
+    energies = (2e3 / inter.in_volumes[None, :] ** 2 - 1e-7 * temperatures[:, None] * inter.in_volumes[None, :]
+                - 1e-7 * temperatures[:, None] ** 2)
+    model = ThermodynamicModel(temperatures, inter.strain_polynomial(energies), vs)
+    results = model.isentropes([300, 800, 1500], numpy.linspace(16, 28, 13), 's', 'v', substeps=4)
+    assert results['t'].shape == results['v'].shape == (3, 13)
+    assert numpy.all(numpy.diff(results['t'], axis=1) > 0)
+    numpy.testing.assert_allclose(results['s'], results['s'][:, :1].repeat(13, axis=1), rtol=1e-9)
+    coarse = model.isentropes([300, 800, 1500], numpy.linspace(16, 28, 13), substeps=1)
+    numpy.testing.assert_allclose(coarse['t'], results['t'], rtol=1e-7)
+
+
+def test_geotherms(model):
+    results = model.geotherms([15, 25], [[500, 1500], [1000, 1200]], [15, 20, 24, 26], 'v')
+    numpy.testing.assert_allclose(results['t'][:, :3], [[500, 1000, 1400], [1000, 1100, 1180]])
+    assert numpy.isnan(results['t'][:, 3]).all() and numpy.isnan(results['v'][:, 3]).all()
+    numpy.testing.assert_array_equal(results['v'][:, :3], model.at_pressures(results['t'][:, :3], [15, 20, 24], 'v')['v'])
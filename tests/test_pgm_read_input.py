@@ -1,5 +1,8 @@
+import pathlib
+import numpy
 import pytest
-from pgm.reader.read_input import Input
+from pgm.reader.read_input import Input, read_input, fast_read_input
+from pgm.reader.cache import CACHE_FORMAT_VERSION, InputCache
 
 settings = [('examples/casio3/%sK.txt', [1500, 2000, 2500, 3000, 3500, 4000]),
             ('examples/feo/%sK.txt', [0, 1000, 2000, 3000, 4000])]
@@ -17,3 +20,110 @@ def test_feo_example(input_dir, discrete_temp):
     input_instance = Input(input_dir, discrete_temp)
     assert input_instance.frequencies.shape == (5, 9, 264, 12)
     assert input_instance.frequencies[4, 0, 0, 3] == 302.3405
+
+
+@pytest.mark.parametrize("input_dir,discrete_temp", [settings[1]])
+def test_parallel_read(input_dir, discrete_temp):
+    serial = Input(input_dir, discrete_temp)
+    parallel = Input(input_dir, discrete_temp, workers=3)
+    assert numpy.array_equal(parallel.frequencies, serial.frequencies)
+    assert numpy.array_equal(parallel.electronic_entropy, serial.electronic_entropy)
+    assert numpy.array_equal(parallel.volumes, serial.volumes)
+
+
+def test_frequency_store(tmp_path):
+    in_memory = Input(*settings[1])
+    stored = Input(*settings[1], dtype=numpy.float32, frequency_store=tmp_path / 'frequencies.npy')
+    assert isinstance(stored.frequencies, numpy.memmap)
+    assert stored.frequencies.dtype == numpy.float32
+    assert numpy.array_equal(stored.frequencies, in_memory.frequencies.astype(numpy.float32))
+    assert numpy.array_equal(numpy.load(tmp_path / 'frequencies.npy'), stored.frequencies)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_inconsistent_volumes(tmp_path, workers):
+    text = pathlib.Path('examples/feo/0K.txt').read_text()
+    (tmp_path / '0K.txt').write_text(text)
+    (tmp_path / '1000K.txt').write_text(text.replace('V = 158.7364', 'V = 160.0000'))
+    with pytest.raises(ValueError, match='volumes'):
+        Input(str(tmp_path / '%sK.txt'), [0, 1000], workers=workers)
+
+
+@pytest.mark.parametrize("temperature", [0, 1000, 2000, 3000, 4000])
+@pytest.mark.parametrize("weight_columns", [4, 1])
+def test_fast_read_input(tmp_path, temperature, weight_columns):
+    path = pathlib.Path('examples/feo/%sK.txt' % temperature)
+    if weight_columns == 1:  # Only the weight on each line of the q-point block
+        head, weights = path.read_text().rsplit('weight', 1)
+        weights = '\n'.join(line.split()[-1] if line.strip() else line for line in weights.split('\n')[1:])
+        path = tmp_path / path.name
+        path.write_text(head + 'weight\n' + weights)
+    expected = read_input(str(path))
+    result = fast_read_input(path)
+    assert result[0] == expected[0]
+    for a, b in zip(result[1:], expected[1:]):
+        assert numpy.array_equal(a, b)
+
+
+def test_fast_read_input_malformed(tmp_path):
+    lines = pathlib.Path('examples/feo/0K.txt').read_text().split('\n')
+    del lines[10]  # A missing frequency
+    (tmp_path / '0K.txt').write_text('\n'.join(lines))
+    with pytest.raises(ValueError, match='frequencies of volume 1'):
+        fast_read_input(tmp_path / '0K.txt')
+
+
+def test_input_cache(tmp_path):
+    source = pathlib.Path('examples/feo/1000K.txt')
+    (tmp_path / '1000K.txt').write_bytes(source.read_bytes())
+    cache = InputCache(tmp_path / 'cache')
+    expected = read_input(str(source))
+    first = cache.read(tmp_path / '1000K.txt')
+    second = cache.read(tmp_path / '1000K.txt')
+    assert isinstance(second[3], numpy.memmap)
+    for result in (first, second):
+        assert result[0] == expected[0]
+        for a, b in zip(result[1:], expected[1:]):
+            assert numpy.array_equal(a, b)
+
+    # A copy with the same content reuses the entry, a changed file gets a new one
+    (tmp_path / '2000K.txt').write_bytes(source.read_bytes())
+    cache.read(tmp_path / '2000K.txt')
+    assert len([p for p in (tmp_path / 'cache').iterdir() if p.name != 'index']) == 1
+    (tmp_path / '2000K.txt').write_text(source.read_text().replace('304.6034', '304.6035'))
+    assert cache.read(tmp_path / '2000K.txt')[3][0, 0, 3] == 304.6035
+
+    # Only the entries and the index are removed, not the other files of the directory
+    (tmp_path / 'cache' / 'notes.txt').write_text('notes')
+    cache.clear([tmp_path / '1000K.txt'])
+    assert [p.name for p in (tmp_path / 'cache').iterdir()] == ['notes.txt']
+
+
+def test_input_cache_stale_entries(tmp_path, monkeypatch):
+    source = pathlib.Path('examples/feo/1000K.txt')
+    (tmp_path / '1000K.txt').write_bytes(source.read_bytes())
+    calls = []
+
+    def parser(path):
+        calls.append(path)
+        return read_input(str(path))
+
+    cache = InputCache(tmp_path / 'cache', parser=parser)
+    cache.read(tmp_path / '1000K.txt')
+    # An entry of another dtype is parsed again and replaced
+    entry = next(p for p in (tmp_path / 'cache').iterdir() if p.name != 'index')
+    numpy.save(entry / 'frequencies.npy', numpy.load(entry / 'frequencies.npy').astype(numpy.float32))
+    cache.read(tmp_path / '1000K.txt')
+    assert cache.read(tmp_path / '1000K.txt')[3].dtype == numpy.float64 and len(calls) == 2
+    # So is every entry of an older format version
+    monkeypatch.setattr('pgm.reader.cache.CACHE_FORMAT_VERSION', CACHE_FORMAT_VERSION + 1)
+    cache.read(tmp_path / '1000K.txt')
+    assert len(calls) == 3
+
+
+def test_input_cache_unwritable_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'user'))
+    monkeypatch.setattr('pgm.reader.cache.os.access', lambda path, mode: not str(path).startswith('/data'))
+    cache = InputCache()
+    assert cache.cache_directory('/data/1000K.txt') == str(tmp_path / 'user' / 'pgm')
+    assert cache.cache_directory(tmp_path / '1000K.txt') == str(tmp_path / '.pgm_cache')
@@ -0,0 +1,48 @@
+import pytest
+from pgm.util.stage_graph import StageGraph
+
+
+@pytest.fixture
+def graph():
+    calls = []
+
+    def stage(name, value):
+        def function(*args):
+            calls.append(name)
+            return value + sum(args)
+        return function
+
+    g = StageGraph()
+    g.add('parse', stage('parse', 1))
+    g.add('fit', stage('fit', 10), ('parse',))
+    g.add('entropy', stage('entropy', 100), ('fit',))
+    g.add('zero_point', stage('zero_point', 1000), ('fit',))
+    g.add('integrate', stage('integrate', 0), ('entropy', 'zero_point', 'parse'))
+    g.add('volumes', stage('volumes', 5), ('parse',))
+    g.calls = calls
+    return g
+
+
+def test_each_stage_computed_once(graph):
+    results = dict(graph.evaluate('integrate', 'volumes'))
+    assert results == {'integrate': 111 + 1011 + 1, 'volumes': 6}
+    assert sorted(graph.calls) == sorted(['parse', 'fit', 'entropy', 'zero_point', 'integrate', 'volumes'])
+
+
+def test_intermediates_released(graph):
+    for name, _ in graph.evaluate('integrate', 'volumes'):
+        if name == 'integrate':
+            assert not graph.is_computed('fit')
+            assert not graph.is_computed('entropy')
+            assert graph.is_computed('parse')  # Still needed by 'volumes'
+    assert not any(graph.is_computed(name) for name in ['parse', 'fit', 'entropy', 'zero_point', 'integrate'])
+
+
+def test_unplanned_stages_memoized(graph):
+    assert graph.get('entropy') == graph.get('entropy')
+    assert graph.calls == ['parse', 'fit', 'entropy']
+
+
+def test_unknown_dependency():
+    with pytest.raises(ValueError):
+        StageGraph().add('fit', lambda parse: parse, ('parse',))
@@ -0,0 +1,107 @@
+import numpy
+import pytest
+from pgm.thermo import ThermodynamicProperties, thermodynamic_stages, evaluate_thermodynamics, \
+    evaluate_thermodynamics_blocks
+from pgm.interpolate import Interpolation
+from pgm.util.unit_conversion import ry_b3_to_gpa
+
+volumes = numpy.linspace(200, 120, 60)
+temperatures = numpy.linspace(0, 2000, 9)
+energies = 2e3 / volumes[None, :] ** 2 + 1e-8 * temperatures[:, None] * volumes[None, :]
+pressures = numpy.linspace(1e-3, 2e-3, 60)
+
+
+@pytest.mark.parametrize("targets", [('p_tv', 's_tv'), ('u_tp',), ('cp_tp', 'bt_tp', 'h_tp', 'g_tp', 'btp_tp')])
+def test_evaluate_thermodynamics(targets):
+    expected = ThermodynamicProperties(volumes, temperatures, pressures, energies)
+    results = dict(evaluate_thermodynamics(volumes, temperatures, pressures, energies, *targets))
+    assert set(results) == set(targets)
+    for name, result in results.items():
+        numpy.testing.assert_array_equal(result, getattr(expected, name))
+
+
+def test_stacked_interpolations():
+    targets = ('cp_tp', 'bt_tp', 'h_tp', 'g_tp')
+    stages = thermodynamic_stages(volumes, temperatures, pressures, energies, stacked=('bt_tp', 'h_tp', 'g_tp'))
+    assert 'tp_stack' in stages.plan(*targets)
+    assert 'tp_stack' not in thermodynamic_stages(volumes, temperatures, pressures, energies).plan(*targets)
+    stacked = dict(evaluate_thermodynamics(volumes, temperatures, pressures, energies, *targets,
+                                           stacked=('bt_tp', 'h_tp', 'g_tp')))
+    separate = dict(evaluate_thermodynamics(volumes, temperatures, pressures, energies, *targets))
+    for name in targets:
+        numpy.testing.assert_array_equal(stacked[name], separate[name])
+
+
+def test_given_entropies():
+    # F = E(V) - T^2 V / 1e12 has S = 2 T V / 1e12, C_V = S and (dS/dV)_T = 2 T / 1e12
+    fs = 2e3 / volumes[None, :] ** 2 - 1e-12 * temperatures[:, None] ** 2 * volumes[None, :]
+    entropies = 2e-12 * temperatures[:, None] * volumes[None, :]
+    numerical = ThermodynamicProperties(volumes, temperatures, pressures, fs)
+    analytic = ThermodynamicProperties(volumes, temperatures, pressures, fs, entropies=entropies,
+                                       heat_capacities=entropies)
+    numpy.testing.assert_allclose(analytic.u_tv[1:-1], numerical.u_tv[1:-1], rtol=1e-12)
+    numpy.testing.assert_allclose(analytic.cv_tp[2:-2, 5:-5], numerical.cv_tp[2:-2, 5:-5], rtol=1e-8)
+    numpy.testing.assert_allclose(analytic.alpha_tv, 2e-12 * temperatures[:, None] / analytic.bt_tv, rtol=1e-12)
+    numpy.testing.assert_allclose(analytic.alpha_tp[1:-1, 5:-5], numerical.alpha_tp[1:-1, 5:-5], rtol=1e-2)
+    targets = ('s_tv', 'alpha_tp', 'cp_tp', 'u_tp')
+    results = dict(evaluate_thermodynamics(volumes, temperatures, pressures, fs, *targets, entropies=entropies,
+                                           heat_capacities=entropies))
+    for name in targets:
+        numpy.testing.assert_array_equal(results[name], getattr(analytic, name))
+
+
+def test_intermediates_released():
+    stages = thermodynamic_stages(volumes, temperatures, pressures, energies)
+    needed = stages.plan('cp_tp')
+    assert 'h_tv' not in needed and 'u_tp' not in needed
+    for _ in stages.evaluate('cp_tp'):
+        pass
+    assert not any(stages.is_computed(name) for name in needed)
+
+
+def test_analytic_derivatives():
+    inter = Interpolation(numpy.linspace(200, 120, 9), num=301, ratio=1.1)
+    raw_energies = 2e3 / inter.in_volumes[None, :] ** 2 + 1e-8 * temperatures[:, None] * inter.in_volumes[None, :]
+    polynomial = inter.strain_polynomial(raw_energies)
+    fitted = numpy.array([inter.fitting(row) for row in raw_energies])
+    vs = inter.out_volumes
+    ps = numpy.linspace(2e-3, 4e-3, 301)
+    numerical = ThermodynamicProperties(vs, temperatures, ps, fitted)
+    analytic = ThermodynamicProperties(vs, temperatures, ps, fitted, polynomial)
+    # The numerical derivatives are one-sided at the ends of the grid
+    numpy.testing.assert_allclose(analytic.p_tv[:, 1:-1], numerical.p_tv[:, 1:-1], rtol=1e-4)
+    numpy.testing.assert_allclose(analytic.bt_tv[:, 2:-2], numerical.bt_tv[:, 2:-2], rtol=1e-4)
+    # F = c / V^2 at 0 K, so B_T' = 3
+    numpy.testing.assert_allclose(analytic.btp_tv[0], 3, rtol=1e-8)
+    # B_T' at the pressures within the grid, interpolated like B_T
+    numpy.testing.assert_allclose(analytic.btp_tp[0, 5:140], 3, rtol=1e-6)
+    results = dict(evaluate_thermodynamics(vs, temperatures, ps, fitted, 'p_tv', 'btp_tv', 'bt_tp', 'btp_tp',
+                                           strain_polynomial=polynomial))
+    for name, result in results.items():
+        numpy.testing.assert_array_equal(result, getattr(analytic, name))
+
+
+def test_get_adiabatic_eos():
+    thermo = ThermodynamicProperties(volumes, temperatures, pressures, energies)
+    ps = ry_b3_to_gpa(thermo.p_tv)
+    # At the points of the grid, the volumes of the grid
+    numpy.testing.assert_allclose(thermo.get_adiabatic_eos(temperatures[[2, 5]], ps[[2, 5], [10, 40]]),
+                                  volumes[[10, 40]])
+    # Between the temperatures of the grid, between the volumes at the neighbouring temperatures
+    t = (temperatures[2] + temperatures[3]) / 2
+    v_2, v_3 = thermo.get_adiabatic_eos(temperatures[[2, 3]], ps[[2, 2], [10, 10]])
+    numpy.testing.assert_allclose(thermo.get_adiabatic_eos([t], [ps[2, 10]]), (v_2 + v_3) / 2)
+    assert numpy.isnan(thermo.get_adiabatic_eos([-1, 100], [ps[0, 10], 1e6])).all()
+
+
+@pytest.mark.parametrize("block_size", [1, 4, 9, 20])
+def test_evaluate_thermodynamics_blocks(block_size):
+    targets = ('p_tv', 's_tv', 'cv_tp', 'alpha_tp', 'gamma_tp', 'cp_tp', 'btp_tp')
+    expected = dict(evaluate_thermodynamics(volumes, temperatures, pressures, energies, *targets))
+    blocks = {name: [] for name in targets}
+    for rows, name, block in evaluate_thermodynamics_blocks(volumes, temperatures, pressures, energies, *targets,
+                                                            block_size=block_size):
+        assert len(block) == len(range(*rows.indices(len(temperatures)))) <= block_size
+        blocks[name].append(block)
+    for name in targets:
+        numpy.testing.assert_array_equal(numpy.concatenate(blocks[name]), expected[name])
@@ -0,0 +1,40 @@
+import numpy
+import pytest
+from pgm.util.tools import vectorized_find_nearest, bracket_indices, merge_brackets, find_nearest, \
+    find_nearest_in_rows, find_value
+
+array = numpy.array([1.0, 2.0, 4.0, 4.5, 8.0, 10.0])
+
+
+def test_bracket_indices():
+    values = numpy.array([-1.0, 1.0, 1.5, 4.0, 9.99, 10.0, 42.0])
+    expected = [0, 0, 0, 2, 4, 4, 4]
+    numpy.testing.assert_array_equal(bracket_indices(array, values), expected)
+    numpy.testing.assert_array_equal(merge_brackets(array, values), expected)
+    result = numpy.zeros(len(values))
+    numpy.testing.assert_array_equal(vectorized_find_nearest(array, values, result), expected)
+    with pytest.raises(ValueError):
+        vectorized_find_nearest(array, values, numpy.zeros(3))
+
+
+def test_merge_brackets_matches_bisection():
+    rng = numpy.random.default_rng(0)
+    grid = numpy.cumsum(rng.uniform(0.1, 1, 200))
+    values = numpy.sort(rng.uniform(grid[0] - 5, grid[-1] + 5, 1000))
+    numpy.testing.assert_array_equal(merge_brackets(grid, values), bracket_indices(grid, values))
+
+
+@pytest.mark.parametrize("grid", [array, array[::-1], numpy.array([3.0, 1.0, 7.0, 2.0])])
+def test_find_nearest(grid):
+    values = numpy.array([-3.0, 1.4, 3.0, 4.2, 6.25, 9.0, 11.0])
+    expected = [numpy.argmin(numpy.abs(grid - v)) for v in values]
+    numpy.testing.assert_array_equal(find_nearest(grid, values), expected)
+    assert find_value(4.2, grid) == expected[3]
+
+
+def test_find_nearest_in_rows():
+    matrix = numpy.array([array, array * 2, array[::-1]])
+    rows = numpy.array([2, 0, 1, 1])
+    values = numpy.array([4.3, 7.0, 7.0, 100.0])
+    expected = [numpy.argmin(numpy.abs(matrix[r] - v)) for r, v in zip(rows, values)]
+    numpy.testing.assert_array_equal(find_nearest_in_rows(matrix, rows, values), expected)
@@ -0,0 +1,75 @@
+import numpy
+import pytest
+from pgm.v2p import v2p, lagrange4, V2PPlan
+from pgm.thermo import ThermodynamicProperties
+
+
+def test_lagrange4_exact_for_cubic():
+    xs = [0.0, 1.0, 2.5, 4.0]
+    ys = [x ** 3 - 2 * x for x in xs]
+    assert lagrange4(1.7, *xs, *ys) == pytest.approx(1.7 ** 3 - 2 * 1.7)
+
+
+def test_v2p_cubic():
+    # P(T, V) increases with the volume index, f is a cubic of P, so the 4-point stencil is exact
+    nt, nv = 7, 60
+    p_tv = numpy.linspace(-10, 110, nv)[None, :] + numpy.linspace(0, 5, nt)[:, None]
+    f_tv = 0.5 * p_tv ** 3 - p_tv ** 2 + 3
+    desired = numpy.linspace(20, 80, nv)
+    result = v2p(f_tv, p_tv, desired)
+    assert result.shape == (nt, nv)
+    expected = 0.5 * desired ** 3 - desired ** 2 + 3
+    numpy.testing.assert_allclose(result, numpy.broadcast_to(expected, (nt, nv)), rtol=1e-10)
+
+
+@pytest.mark.parametrize('np_amount', [7, 200])
+def test_v2p_pressures_amount(np_amount):
+    # The stencils depend on the volumes only, up to the last pressure of each row, whatever the number of pressures
+    nt, nv = 5, 30
+    p_tv = numpy.linspace(-10, 110, nv)[None, :] + numpy.linspace(0, 5, nt)[:, None]
+    f_tv = 0.5 * p_tv ** 3 - p_tv ** 2 + 3
+    desired = numpy.linspace(0, 110, np_amount)
+    result = v2p(f_tv, p_tv, desired)
+    assert result.shape == (nt, np_amount)
+    expected = 0.5 * desired ** 3 - desired ** 2 + 3
+    numpy.testing.assert_allclose(result, numpy.broadcast_to(expected, (nt, np_amount)), rtol=1e-10)
+
+
+def test_v2p_out_of_bound():
+    p_tv = numpy.linspace(0, 10, 20)[None, :].repeat(3, axis=0)
+    with pytest.raises(ValueError, match='out of bound'):
+        v2p(p_tv, p_tv, numpy.linspace(20, 30, 20))
+
+
+def test_plan_reused():
+    rng = numpy.random.default_rng(1)
+    p_tv = numpy.linspace(-10, 110, 50)[None, :] + rng.uniform(0, 2, size=(6, 1))
+    desired = numpy.linspace(0, 100, 50)
+    plan = V2PPlan(p_tv, desired)
+    for f_tv in (rng.random((6, 50)), numpy.exp(p_tv / 50)):
+        numpy.testing.assert_array_equal(plan.apply(f_tv), v2p(f_tv, p_tv, desired))
+    with pytest.raises(ValueError, match='shape'):
+        plan.apply(rng.random((6, 49)))
+
+
+def test_stacked_apply():
+    rng = numpy.random.default_rng(2)
+    p_tv = numpy.linspace(-10, 110, 50)[None, :] + rng.uniform(0, 2, size=(6, 1))
+    plan = V2PPlan(p_tv, numpy.linspace(0, 100, 50))
+    stack = rng.random((3, 6, 50))
+    result = plan.apply(stack)
+    assert result.shape == (3, 6, 50)
+    for f_tv, f_tp in zip(stack, result):
+        numpy.testing.assert_array_equal(f_tp, plan.apply(f_tv))
+
+
+def test_thermodynamic_properties_interpolate():
+    volumes = numpy.linspace(200, 120, 60)
+    temperatures = numpy.linspace(0, 2000, 9)
+    energies = 2e3 / volumes[None, :] ** 2 + 1e-8 * temperatures[:, None] * volumes[None, :]
+    pressures = numpy.linspace(1e-3, 2e-3, 60)
+    expected = ThermodynamicProperties(volumes, temperatures, pressures, energies)
+    batched = ThermodynamicProperties(volumes, temperatures, pressures, energies)
+    batched.interpolate('u_tp', 'cp_tp')
+    for name in ('u_tp', 'v_tp', 'bt_tp', 'cv_tp', 'cp_tp', 'alpha_tp'):
+        numpy.testing.assert_array_equal(getattr(batched, name), getattr(expected, name))
@@ -0,0 +1,33 @@
+import pytest
+from pgm.settings import Settings, DEFAULT_SETTINGS
+from pgm.validation import compare_integration, compare_precision, PROPERTIES
+
+settings = dict(DEFAULT_SETTINGS, folder='examples/feo/%sK.txt', temperature=[0, 1000, 2000, 3000, 4000],
+                NT=41, NV=201, initP=200, finalP=400)
+
+
+def test_float32_error_bounds():
+    report = compare_precision(Settings(settings), 'float32')
+    assert list(report.index) == list(PROPERTIES)
+    assert (report['rel_error'] > 0).all()
+    assert report.loc['ftv_ev_a3', 'rel_error'] < 1e-9
+    assert (report['rel_error'] < 1e-5).all()
+
+
+def test_unknown_precision():
+    with pytest.raises(ValueError):
+        compare_precision(Settings(settings), 'float16')
+
+
+def test_integration_convergence():
+    report = compare_integration(Settings(dict(settings, temperature_derivatives='analytic')), (41, 81),
+                                 ('trapezoid', 'cubic'), reference_nt=300)
+    assert list(report.columns) == list(PROPERTIES)
+    # The reference holds the temperatures of every run, and is converged well beyond their errors
+    assert ('reference', 321) in report.index
+    assert (report.loc['reference'] < 1e-6).all(axis=None)
+    errors = report['gtp_ev_T_gpa']
+    assert errors['trapezoid', 81] < errors['trapezoid', 41]
+    assert errors['cubic', 41] < errors['trapezoid', 41] / 3
+    for name in ('alpha_tp_K_gpa', 'cv_tp_jmol_K_gpa', 'cp_tp_jmol_K_gpa'):
+        assert report.loc[('cubic', 81), name] < report.loc[('cubic', 41), name] / 3